@@ -23,18 +23,24 @@ http://arduino.cc/en/Reference/HomePage
 """
 
 from io import open
-from os import listdir, environ
-from os.path import isdir, isfile, join
+from os import devnull, listdir, environ, makedirs, walk
+from os.path import abspath, isabs, isdir, isfile, join, relpath, splitext
 from platformio.util import get_systype
 from platformio.proc import exec_command
 import re
+import sys
 
-from SCons.Script import DefaultEnvironment
+from SCons.Script import COMMAND_LINE_TARGETS, DefaultEnvironment, Environment
 
 import multiprocessing
 
+from teensytools import boot, cycles, elf, hostbench, incprune, itcm, libindex, placement, printf_float, sizecache, stack, testbundle, tune
+
 
 def append_lto_options():
+    if "TEENSY_STACK_USAGE" in env['CPPDEFINES']:
+        sys.stderr.write(
+            "Warning! Stack usage analysis is not available with LTO optimization profiles\n")
     if "windows" in get_systype():
         env.Append(
             CCFLAGS=["-flto", "-fipa-pta"],
@@ -46,20 +52,6 @@ def append_lto_options():
             LINKFLAGS=["-flto=" + str(multiprocessing.cpu_count())]
         )
 
-def get_size_output(source):
-    cmd = env.get("SIZECHECKCMD")
-    if not cmd:
-        return None
-    if not isinstance(cmd, list):
-        cmd = cmd.split()
-    cmd = [arg.replace("$SOURCES", str(source[0])) for arg in cmd if arg]
-    sysenv = environ.copy()
-    sysenv["PATH"] = str(env["ENV"]["PATH"])
-    result = exec_command(env.subst(cmd), env=sysenv)
-    if result["returncode"] != 0:
-        return None
-    return result["out"].strip()
-
 def calculate_size(output, pattern):
     if not output or not pattern:
         return -1
@@ -88,7 +80,8 @@ def print_size_teensy4(target, source, env):
     ram1_max_size = int(env.BoardConfig().get("upload.maximum_ram_size", 0))
     ram2_max_size = int(env.BoardConfig().get("upload.maximum_ram_size", 0))
 
-    output = get_size_output(source)
+    report = env.GetSizeReport(source[0])
+    output = report["sections"]
     program_size = calculate_size(output, env.get("SIZEPROGREGEXP"))
     ram1_usage = calculate_size(output, env.get("SIZEDATAREGEXP"))
     ram2_usage = calculate_size(output, env.get("SIZERAM2REGEXP"))
@@ -97,17 +90,513 @@ def print_size_teensy4(target, source, env):
     itcm_total = itcm_blocks * 32768
     itcm_padding = itcm_total - itcm
 
+    summary = []
     if ram1_max_size and ram1_usage > -1:
-        print("RAM 1:  %s" % format_availale_bytes(ram1_usage + itcm_padding, ram1_max_size))
+        summary.append("RAM 1:  %s" % format_availale_bytes(ram1_usage + itcm_padding, ram1_max_size))
+        print(summary[-1])
+        if "TEENSY_STACK_USAGE" in env['CPPDEFINES']:
+            print_stack_usage(target, source, env, ram1_max_size - ram1_usage - itcm_padding)
+    if "TEENSY_BOOT_REPORT" in env['CPPDEFINES']:
+        print_boot_report(target, source, env)
     if ram2_max_size and ram2_usage > -1:
-        print("RAM 2:  %s" % format_availale_bytes(ram2_usage, ram2_max_size))
+        summary.append("RAM 2:  %s" % format_availale_bytes(ram2_usage, ram2_max_size))
+        print(summary[-1])
     if program_max_size and program_size > -1:
-        print("Flash:  %s" % format_availale_bytes(program_size, program_max_size))
+        summary.append("Flash:  %s" % format_availale_bytes(program_size, program_max_size))
+        print(summary[-1])
+    # printed instead of the generic RAM/Flash pair when `pio run` skips SCons
+    if output is not None and report.get("summary") != "\n".join(summary):
+        report["summary"] = "\n".join(summary)
+        sizecache.save(sizecache.report_path(env.subst(str(source[0]))), report)
     if int(ARGUMENTS.get("PIOVERBOSE", 0)):
         print("ITCM P: %s" % format_availale_bytes(itcm_padding, 32767))
+        if itcm_blocks > 1 or itcm_padding > 4096:
+            print("        (run `pio run -t itcm_plan` for placement suggestions)")
         print("")
         print(output)
 
+def print_stack_usage(target, source, env, free_ram=None):
+    entry_points = env.GetProjectOption("custom_stack_entry_points", "")
+    fpu = "-mfloat-abi=hard" in env.get("CCFLAGS", [])
+    report = stack.analyze(
+        env.subst("$BUILD_DIR"), entry_points.replace(",", " ").split(), fpu)
+    if not report["results"]:
+        print("Stack:  no stack usage information found")
+        return
+    summary = stack.format_summary(report)
+    if free_ram is not None:
+        summary += ", %d bytes RAM 1 left for stack" % free_ram
+    print("Stack:  %s" % summary)
+    details = stack.format_report(report)
+    with open(env.subst(join("$BUILD_DIR", "stack_usage.txt")), "w") as fp:
+        fp.write(details + "\n")
+    if int(ARGUMENTS.get("PIOVERBOSE", 0)):
+        print(details)
+
+def get_define(name, default=None):
+    for define in env.get("CPPDEFINES", []):
+        if isinstance(define, (list, tuple)) and define[0] == name:
+            return define[1]
+        if define == name:
+            return default
+    return default
+
+def print_boot_report(target, source, env):
+    timing = boot.STARTUP_TIMING[BUILD_CORE]
+    delays = boot.read_startup_delays(join(FRAMEWORK_DIR, BUILD_CORE, timing["source"]))
+    for name in boot.DELAY_DEFINES:
+        value = get_define(name)
+        if value is not None:
+            delays[name] = int(env.subst(str(value)))
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    firmware = str(source[0])
+    cpu = env.BoardConfig().get("build.cpu", "")
+    try:
+        cycle_report = cycles.get_report(firmware, env.subst("$OBJDUMP"), cpu, sysenv)[0]
+    except (cycles.CyclesError, elf.ElfError, OSError) as exc:
+        sys.stderr.write("Warning! No cycle estimates for constructors: %s\n" % exc)
+        cycle_report = None
+    f_cpu = int(env.subst("$BOARD_F_CPU").rstrip("L"))
+    report = boot.analyze(firmware, BUILD_CORE, cpu, f_cpu, delays, cycle_report)
+    names = elf.demangle([ctor["name"] for ctor in report["constructors"]],
+                         env.subst("$CXXFILT"), sysenv)
+    print(boot.format_report(report, names))
+    budget = float(env.GetProjectOption("custom_boot_budget", 0))
+    if budget and report["total_us"] > budget * 1000:
+        sys.stderr.write("Warning! Boot time estimate of %.1f ms exceeds `custom_boot_budget` "
+                         "of %g ms\n" % (report["total_us"] / 1000.0, budget))
+
+def get_compiler_major_version():
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    result = exec_command([env.subst("$CC"), "-dumpversion"], env=sysenv)
+    try:
+        return int(result["out"].strip().split(".")[0])
+    except ValueError:
+        return 0
+
+def print_itcm_plan(target, source, env):
+    firmware = elf.ElfFile(str(source[0]))
+    result = itcm.plan(firmware)
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    names = elf.demangle(
+        [fn.name for key in ("itcm_functions", "demote", "promote") for fn in result[key]],
+        env.subst("$CXXFILT"), sysenv)
+    print(itcm.format_plan(result, names))
+
+def get_itcm_placement_path():
+    return join(env.subst("$PROJECT_DIR"),
+                env.GetProjectOption("custom_itcm_placement", "itcm_placement.json"))
+
+def generate_itcm_placement(target, source, env):
+    samples_path = env.GetProjectOption("custom_itcm_profile", "")
+    if not samples_path:
+        sys.stderr.write("Error: Please specify the PC sample file with `custom_itcm_profile`\n")
+        env.Exit(1)
+    samples = placement.load_samples(join(env.subst("$PROJECT_DIR"), samples_path))
+    budget = int(env.GetProjectOption("custom_itcm_budget", placement.DEFAULT_BUDGET))
+    assignments = placement.build_assignments(
+        str(source[0]), samples, budget, placement.load_pinned(env.subst("$BUILD_DIR")))
+    placement.save(assignments, get_itcm_placement_path())
+    print(placement.format_assignments(assignments))
+    print("Saved %s, the placement is applied on the next build" % get_itcm_placement_path())
+
+def apply_itcm_placement():
+    assignments_path = get_itcm_placement_path()
+    if not isfile(assignments_path):
+        return
+    ldscript = env.subst("$LDSCRIPT_PATH")
+    if not isfile(ldscript):
+        ldscript = join(FRAMEWORK_DIR, BUILD_CORE, ldscript)
+    with open(ldscript, encoding="utf-8") as fp:
+        content = placement.render_ldscript(fp.read(), placement.load(assignments_path)["cold"])
+    build_dir = env.subst("$BUILD_DIR")
+    if not isdir(build_dir):
+        makedirs(build_dir)
+    ldscript_placed = join(build_dir, "itcm_placement.ld")
+    if not isfile(ldscript_placed) or open(ldscript_placed, encoding="utf-8").read() != content:
+        with open(ldscript_placed, "w", encoding="utf-8") as fp:
+            fp.write(content)
+    env.Replace(LDSCRIPT_PATH=ldscript_placed)
+    env.Depends(join("$BUILD_DIR", "${PROGNAME}.elf"), ldscript_placed)
+
+def get_printf_float_inputs(env, sources):
+    paths = [str(item) for item in sources]
+    for lib in env.Flatten(env.get("LIBS", [])):
+        if hasattr(lib, "get_abspath"):
+            paths.append(lib.get_abspath())
+    return paths
+
+# programs linked with float formatting only if one of their format strings needs it,
+# by ELF path: the analysis result of this build or None
+printf_float_results = {}
+
+def get_printf_float_options_path(program):
+    return splitext(program)[0] + ".printf_float.opt"
+
+def get_printf_float_flags(env, target):
+    program = abspath(str(target[0])) if target else None
+    if program not in printf_float_results:
+        return []
+    return ["@" + get_printf_float_options_path(program)]
+
+def write_printf_float_options(target, source, env):
+    """Decides before linking, the response file keeps the decision out of the link signature."""
+    program = abspath(str(target[0]))
+    result = printf_float.analyze(get_printf_float_inputs(env, source))
+    printf_float_results[program] = result
+    content = "-Wl,-u,_printf_float\n" if result["required"] else ""
+    path = get_printf_float_options_path(program)
+    if not isfile(path) or open(path).read() != content:
+        with open(path, "w") as fp:
+            fp.write(content)
+
+def print_printf_float_report(target, source, env):
+    result = printf_float_results.get(abspath(str(target[0])))
+    if result is None:
+        result = printf_float.analyze(get_printf_float_inputs(env, source))
+    print(printf_float.format_report(result))
+
+def add_printf_float_check(env, program, report=True):
+    """Links `program` with float formatting if its format strings need it."""
+    if "ENABLE_PRINTF_FLOAT" in env['CPPDEFINES'] or "DISABLE_PRINTF_FLOAT" in env['CPPDEFINES']:
+        return
+    for node in env.arg2nodes(program, env.fs.File):
+        printf_float_results.setdefault(node.get_abspath(), None)
+    env.AddPreAction(program, env.VerboseAction(write_printf_float_options, "Scanning format strings"))
+    if report:
+        env.AddPostAction(
+            program, env.VerboseAction(print_printf_float_report, "Checking printf float usage"))
+
+def get_opt_profile():
+    value = environ.get("TEENSY_OPT_PROFILE")
+    if not value:
+        value = env.GetProjectOption("custom_teensy_opt_profile", "")
+        # the tuner writes the profile, its candidates come in TEENSY_OPT_PROFILE
+        if not value or "tune" in COMMAND_LINE_TARGETS:
+            return None
+        if not value.strip().startswith("{") and not isfile(join(env.subst("$PROJECT_DIR"), value)):
+            sys.stderr.write(
+                "Warning! Optimization profile %s not found, run `pio run -t tune` to create it\n"
+                % value)
+            return None
+    try:
+        return tune.load_profile(value, env.subst("$PROJECT_DIR"))
+    except tune.TuneError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+
+def run_tuner(target, source, env):
+    space = env.GetProjectOption("custom_tune_space", "")
+    benchmark = env.GetProjectOption("custom_tune_benchmark", "")
+    output = env.GetProjectOption("custom_teensy_opt_profile", "")
+    if not output or output.lstrip().startswith("{"):
+        output = "teensy_opt_profile.json"
+    output = join(env.subst("$PROJECT_DIR"), output)
+    try:
+        tuner = tune.Tuner(
+            env.subst("$PROJECT_DIR"), env.subst("$PIOENV"),
+            join(env.subst("$PROJECT_WORKSPACE_DIR"), "tune", env.subst("$PIOENV")),
+            tune.load_space(join(env.subst("$PROJECT_DIR"), space)) if space else None,
+            int(env.GetProjectOption("custom_tune_jobs", max(1, multiprocessing.cpu_count() // 4))),
+            benchmark or None,
+            env.GetProjectOption("custom_tune_maximize", "no").lower() in ("1", "yes", "true"),
+            env.subst("$PYTHONEXE"))
+        profile, score = tuner.run(int(env.GetProjectOption("custom_tune_passes", 3)))
+    except (tune.TuneError, OSError, ValueError) as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+    tune.save_profile(output, profile, score, benchmark or "size")
+    print("Best flags: %s%s (%s %g)" % (
+        " ".join(profile["flags"]), " -flto" if profile["lto"] else "",
+        "score" if benchmark else "flash bytes", score))
+    print("Saved to %s" % output)
+    if not env.GetProjectOption("custom_teensy_opt_profile", ""):
+        print("Use it with `custom_teensy_opt_profile = teensy_opt_profile.json`")
+
+def find_sources(path, recursive=True):
+    sources = []
+    for root, dirs, files in walk(path):
+        dirs.sort()
+        sources.extend(
+            join(root, f) for f in sorted(files) if splitext(f)[1] in (".c", ".cc", ".cpp"))
+        if not recursive:
+            break
+    return sources
+
+def get_host_libraries():
+    """(include dir, sources) of the project libraries in `lib`."""
+    lib_dir = env.subst("$PROJECT_LIB_DIR")
+    libraries = []
+    for name in sorted(listdir(lib_dir)) if isdir(lib_dir) else []:
+        if isdir(join(lib_dir, name, "src")):
+            libraries.append((join(lib_dir, name, "src"), find_sources(join(lib_dir, name, "src"))))
+        elif isdir(join(lib_dir, name)):
+            libraries.append((join(lib_dir, name), find_sources(join(lib_dir, name), False)))
+    return libraries
+
+def get_host_sources():
+    project_dir = env.subst("$PROJECT_DIR")
+    sources = []
+    for item in env.GetProjectOption("custom_host_sources", "bench").replace(",", " ").split():
+        path = item if isabs(item) else join(project_dir, item)
+        sources.extend([path] if isfile(path) else find_sources(path))
+    return sources
+
+def build_host_bench():
+    """Builds `custom_host_sources` and the project libraries for the build machine."""
+    host_core_dir = join(platform.get_dir(), "misc", "host", "core")
+    project_dir = env.subst("$PROJECT_DIR")
+    build_dir = env.subst(join("$BUILD_DIR", "host"))
+    libraries = get_host_libraries()
+    host_env = Environment(
+        ENV=env["ENV"],
+        CC=env.GetProjectOption("custom_host_cc", "gcc"),
+        CXX=env.GetProjectOption("custom_host_cxx", "g++"),
+        LINK=env.GetProjectOption("custom_host_cxx", "g++"),
+        CCFLAGS=["-O2", "-g", "-Wall"] + env.GetProjectOption("custom_host_flags", "").split(),
+        CFLAGS=["-std=gnu17"],
+        CXXFLAGS=["-std=gnu++20"],
+        CPPDEFINES=[
+            "TEENSY_HOST",
+            ("ARDUINO", 10819),
+            ("TEENSYDUINO", int(FRAMEWORK_VERSION.split(".")[1])),
+            ("F_CPU", env.subst("$BOARD_F_CPU"))
+        ],
+        CPPPATH=[host_core_dir, env.subst("$PROJECT_INCLUDE_DIR"), env.subst("$PROJECT_SRC_DIR")] + [
+            include_dir for include_dir, _ in libraries],
+        LIBS=["m", "pthread"]
+    )
+    objects = [host_env.Object(join(build_dir, "core", "host_core.o"), join(host_core_dir, "host_core.cpp"))]
+    sources = get_host_sources()
+    for _, library_sources in libraries:
+        sources.extend(library_sources)
+    for source in sources:
+        name = relpath(source, project_dir)
+        if name.startswith(".."):
+            name = join("external", source.lstrip("/"))
+        objects.append(host_env.Object(join(build_dir, name + ".o"), source))
+    return host_env.Program(join(build_dir, "host_bench"), objects)
+
+def run_host_bench(target, source, env):
+    if not get_host_sources():
+        sys.stderr.write(
+            "Error: no host sources found, add benchmarks to `bench` or set `custom_host_sources`\n")
+        env.Exit(1)
+    result = exec_command(
+        [abspath(str(source[0]))] + env.GetProjectOption("custom_host_bench_args", "").split())
+    for line in result["out"].splitlines():
+        if not line.startswith("BENCH "):
+            print(line)
+    sys.stderr.write(result["err"])
+    if result["returncode"] != 0:
+        sys.stderr.write("Error: host program failed with exit code %d\n" % result["returncode"])
+        env.Exit(1)
+    results = hostbench.parse_output(result["out"])
+    if not results:
+        return
+    baseline = {}
+    baseline_path = env.GetProjectOption("custom_host_bench_baseline", "")
+    if baseline_path:
+        baseline_path = join(env.subst("$PROJECT_DIR"), baseline_path)
+        if isfile(baseline_path):
+            baseline = hostbench.load(baseline_path)
+    print(hostbench.format_table(results, baseline))
+    hostbench.save(env.subst(join("$BUILD_DIR", "host", "bench.json")), results)
+    regressions = hostbench.compare(results, baseline, float(env.GetProjectOption(
+        "custom_host_bench_tolerance", hostbench.DEFAULT_TOLERANCE)))
+    for name, before, after in regressions:
+        sys.stderr.write("Error: %s got slower: %.3f ns -> %.3f ns per call\n" % (name, before, after))
+    if regressions:
+        env.Exit(1)
+
+def get_option_list(name):
+    value = env.GetProjectOption(name, [])
+    if isinstance(value, str):
+        value = value.replace(",", "\n").splitlines()
+    return [item.strip() for item in value if item.strip()]
+
+def find_unity_dir():
+    unity_dir = env.GetProjectOption("custom_unity_dir", "")
+    if unity_dir:
+        return join(env.subst("$PROJECT_DIR"), unity_dir)
+    libdeps_dir = join(env.subst("$PROJECT_LIBDEPS_DIR"), env.subst("$PIOENV"))
+    if isdir(libdeps_dir):
+        for name in sorted(listdir(libdeps_dir)):
+            if isfile(join(libdeps_dir, name, "src", "unity.c")):
+                return join(libdeps_dir, name, "src")
+    return None
+
+def link_test_suite(target, source, env):
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    relocatable = str(target[0])
+    result = exec_command(
+        [env.subst("$CC"), "-nostdlib", "-r", "-o", relocatable] + [str(s) for s in source],
+        env=sysenv)
+    if result["returncode"] != 0:
+        sys.stderr.write(result["err"])
+        return 1
+    entry, localize = testbundle.suite_symbols(elf.ElfFile(relocatable))
+    if entry is None:
+        sys.stderr.write("Error: test suite %s defines no setup()\n" % env["TEST_SUITE_NAME"])
+        return 1
+    symbols_file = relocatable + ".localize"
+    with open(symbols_file, "w") as fp:
+        fp.write("".join(name + "\n" for name in localize))
+    result = exec_command([
+        env.subst("$OBJCOPY"), "--localize-symbols=" + symbols_file,
+        "--redefine-sym", "%s=%s" % (entry, testbundle.entry_name(env["TEST_SUITE_INDEX"])),
+        relocatable], env=sysenv)
+    if result["returncode"] != 0:
+        sys.stderr.write(result["err"])
+        return 1
+    return 0
+
+def build_test_bundle(env):
+    """Links the selected test suites into one firmware, returns (ELF node, suite names)."""
+    if "-flto" in env.get("CCFLAGS", []):
+        sys.stderr.write("Error: Test bundles are not available with LTO optimization profiles\n")
+        env.Exit(1)
+    test_dir = env.subst("$PROJECT_TEST_DIR")
+    suites = testbundle.find_suites(
+        test_dir, get_option_list("test_filter"), get_option_list("test_ignore"))
+    if not suites:
+        sys.stderr.write("Error: No test suites found in %s\n" % test_dir)
+        env.Exit(1)
+    unity_dir = find_unity_dir()
+    if not unity_dir:
+        sys.stderr.write(
+            "Error: Unity not found, add `lib_deps = throwtheswitch/Unity` or set `custom_unity_dir`\n")
+        env.Exit(1)
+    bundle_dir = env.subst(join("$BUILD_DIR", "test_bundle"))
+    names = [name for name, _ in suites]
+    testbundle.write_if_changed(join(bundle_dir, "unity_config.h"), testbundle.UNITY_CONFIG)
+    testbundle.write_if_changed(join(bundle_dir, "bundle.cpp"), testbundle.render_dispatcher(names))
+
+    # the core, libraries and Unity are built once for all suites
+    test_env = env.Clone()
+    test_env.Append(
+        CPPDEFINES=["PIO_UNIT_TESTING", "UNITY_INCLUDE_CONFIG_H"],
+        CPPPATH=[bundle_dir, unity_dir, test_dir]
+    )
+    unity = test_env.Object(join(bundle_dir, "unity", "unity.c.o"), join(unity_dir, "unity.c"))
+    objects = [test_env.Object(join(bundle_dir, "bundle.cpp.o"), join(bundle_dir, "bundle.cpp"))]
+    for index, (name, suite_dir) in enumerate(suites):
+        suite_env = test_env.Clone()
+        suite_env.Append(CPPPATH=[suite_dir])
+        suite_objects = [
+            suite_env.Object(join(bundle_dir, "suites", name, relpath(source, suite_dir) + ".o"), source)
+            for source in testbundle.suite_sources(suite_dir)]
+        objects.append(env.Command(
+            join(bundle_dir, "suites", name + ".o"), suite_objects + unity,
+            env.VerboseAction(link_test_suite, "Linking test suite %s" % name),
+            TEST_SUITE_INDEX=index, TEST_SUITE_NAME=name))
+    if str(env.GetProjectOption("test_build_src", "no")).lower() in ("1", "yes", "true"):
+        objects.append(test_env.BuildLibrary(join(bundle_dir, "src"), "$PROJECT_SRC_DIR"))
+    program = env.Program(join(bundle_dir, env.subst("$PROGNAME")), objects)
+    # decided from the format strings of the suites, not those of the firmware
+    add_printf_float_check(env, program, report=False)
+    return program, names
+
+FP_ARCH_NAMES = {
+    0: "no FPU",
+    5: "VFPv4",
+    6: "VFPv4-D16 (fpv4-sp-d16)",
+    7: "FPv5",
+    8: "FPv5-D16 (fpv5-d16)"
+}
+
+def check_cmsis_dsp_abi(archive):
+    """Compares the FPU and float ABI of a prebuilt library with the build flags."""
+    flags = env.get("CCFLAGS", [])
+    hard_float = "-mfloat-abi=hard" in flags
+    if "-mfpu=fpv5-d16" in flags:
+        fp_archs = (7, 8)
+    elif "-mfpu=fpv4-sp-d16" in flags:
+        fp_archs = (5, 6)
+    else:
+        fp_archs = (0,)
+    attributes = None
+    for _, data in elf.read_archive(archive):
+        try:
+            attributes = elf.arm_attributes(elf.ElfFile(archive, data))
+        except elf.ElfError:
+            continue
+        if attributes:
+            break
+    if not attributes:
+        return None
+    lib_hard_float = attributes.get(elf.TAG_ABI_VFP_ARGS, 0) == 1
+    fp_arch = attributes.get(elf.TAG_FP_ARCH, 0)
+    # hard float libraries must match the FPU, soft float ones must not use it at all
+    if lib_hard_float != hard_float or (hard_float and fp_arch not in fp_archs) or (
+            fp_archs == (5, 6) and attributes.get(elf.TAG_ABI_HARDFP_USE, 0) not in (0, 1)):
+        return "%s is built for %s with %s float ABI, the board uses %s with %s float ABI" % (
+            archive, FP_ARCH_NAMES.get(fp_arch, "FP arch %d" % fp_arch),
+            "hard" if lib_hard_float else "soft",
+            FP_ARCH_NAMES.get(fp_archs[-1]), "hard" if hard_float else "soft")
+    return None
+
+def use_cmsis_dsp(math_lib):
+    source_dir = env.GetProjectOption("custom_cmsis_dsp_dir", "")
+    if source_dir:
+        # build from source with the active optimization flags
+        source_dir = join(env.subst("$PROJECT_DIR"), source_dir)
+        if not isdir(join(source_dir, "Source")) or not isdir(join(source_dir, "Include")):
+            sys.stderr.write(
+                "Error: custom_cmsis_dsp_dir %s needs `Source` and `Include` directories\n" % source_dir)
+            env.Exit(1)
+        include_dirs = [join(source_dir, "Include")]
+        if isdir(join(source_dir, "PrivateInclude")):
+            include_dirs.append(join(source_dir, "PrivateInclude"))
+        include_dirs.extend(
+            join(env.subst("$PROJECT_DIR"), d) for d in
+            env.GetProjectOption("custom_cmsis_dsp_include_dirs", "").replace(",", " ").split())
+        env.Prepend(CPPPATH=include_dirs)
+        # every folder has a file including all its sources
+        env.Prepend(LIBS=[env.BuildLibrary(
+            join("$BUILD_DIR", "CMSISDSP"),
+            join(source_dir, "Source"),
+            src_filter="-<*> +<*/*Functions.c> +<CommonTables/CommonTables.c>"
+        )])
+        return
+    archive = join(FRAMEWORK_DIR, BUILD_CORE, "lib%s.a" % math_lib)
+    if not isfile(archive):
+        sys.stderr.write("Error: CMSIS-DSP library %s not found\n" % archive)
+        env.Exit(1)
+    mismatch = check_cmsis_dsp_abi(archive)
+    if mismatch:
+        sys.stderr.write("Error: %s\n" % mismatch)
+        env.Exit(1)
+    env.Prepend(LIBS=[math_lib])
+
+def get_framework_libsource_dir():
+    libraries_dir = join(FRAMEWORK_DIR_LIBS, "libraries")
+    # symlinks need extra privileges on Windows
+    if "TEENSY_DISABLE_LIB_INDEX" in env['CPPDEFINES'] or "windows" in get_systype():
+        return libraries_dir
+    version = platform.get_package_version("framework-arduinoteensy")
+    index = libindex.load_index(
+        join(env.subst("$PROJECT_CORE_DIR"), ".cache", "teensy", "libindex-%s.json" % version),
+        libraries_dir, version)
+    project_dirs = [
+        "$PROJECT_SRC_DIR", "$PROJECT_INCLUDE_DIR", "$PROJECT_LIB_DIR", "$PROJECT_TEST_DIR",
+        join("$PROJECT_LIBDEPS_DIR", "$PIOENV")
+    ] + env.GetProjectOption("lib_extra_dirs", [])
+    includes = libindex.scan_dirs([env.subst(d) for d in project_dirs])
+    lib_deps = [
+        dep.split("@")[0].strip().split("/")[-1] for dep in env.GetProjectOption("lib_deps", [])
+    ]
+    try:
+        return libindex.sync_shadow_dir(
+            env.subst(join("$BUILD_DIR", "framework-libraries")), libraries_dir,
+            libindex.resolve(index, includes, lib_deps))
+    except OSError:
+        return libraries_dir
+
 env = DefaultEnvironment()
 platform = env.PioPlatform()
 
@@ -166,7 +655,7 @@ env.Append(
     ],
 
     LIBSOURCE_DIRS=[
-        join(FRAMEWORK_DIR_LIBS, "libraries")
+        get_framework_libsource_dir()
     ]
 )
 
@@ -275,6 +764,54 @@ elif "BOARD" in env and BUILD_CORE in ("teensy3", "teensy4"):
             SIZEPRINTCMD = print_size_teensy4
         )
 
+        env.AddPlatformTarget(
+            "itcm_plan",
+            join("$BUILD_DIR", "${PROGNAME}.elf"),
+            env.VerboseAction(print_itcm_plan, "Planning ITCM bank usage"),
+            "ITCM Plan",
+            "Suggest FASTRUN/FLASHMEM changes that minimize the number of ITCM banks"
+        )
+
+        env.AddPlatformTarget(
+            "itcm_profile",
+            join("$BUILD_DIR", "${PROGNAME}.elf"),
+            env.VerboseAction(generate_itcm_placement, "Selecting ITCM functions from PC samples"),
+            "ITCM Profile",
+            "Place the hottest functions of `custom_itcm_profile` in ITCM and the others in flash"
+        )
+
+    if BUILD_CORE in boot.STARTUP_TIMING:
+        env.AddPlatformTarget(
+            "boot_report",
+            join("$BUILD_DIR", "${PROGNAME}.elf"),
+            env.VerboseAction(print_boot_report, "Estimating boot time"),
+            "Boot Report",
+            "Static constructors and bytes copied and zeroed at reset, with the time to `setup()`"
+        )
+        if BUILD_CORE != "teensy4" and "TEENSY_BOOT_REPORT" in env['CPPDEFINES']:
+            env.AddPostAction(
+                join("$BUILD_DIR", "${PROGNAME}.elf"),
+                env.VerboseAction(print_boot_report, "Estimating boot time"))
+
+    env.AddMethod(build_test_bundle, "BuildTestBundle")
+
+    env.AddPlatformTarget(
+        "tune",
+        None,
+        env.VerboseAction(run_tuner, "Searching compiler flags"),
+        "Tune Compiler Flags",
+        "Build flag combinations in parallel and save the best as optimization profile"
+    )
+
+    if "TEENSY_STACK_USAGE" in env['CPPDEFINES']:
+        env.Append(CCFLAGS=["-fstack-usage"])
+        if get_compiler_major_version() >= 10:
+            env.Append(CCFLAGS=["-fcallgraph-info=su"])
+        if BUILD_CORE != "teensy4":
+            env.AddPostAction(
+                join("$BUILD_DIR", "${PROGNAME}.elf"),
+                env.VerboseAction(print_stack_usage, "Calculating stack usage"))
+
     if "SET_CURRENT_TIME" in env['CPPDEFINES']:
         env.Append(
             LINKFLAGS=["-Wl,--defsym=__rtc_localtime=$UNIX_TIME"]
@@ -284,14 +821,25 @@ elif "BOARD" in env and BUILD_CORE in ("teensy3", "teensy4"):
             LINKFLAGS=["-Wl,--defsym=__rtc_localtime=0"]
         )
         
-    if not "DISABLE_PRINTF_FLOAT" in env['CPPDEFINES']:
+    if "ENABLE_PRINTF_FLOAT" in env['CPPDEFINES']:
         env.Append(
             LINKFLAGS=["-Wl,-u,_printf_float"]
         )
+    elif not "DISABLE_PRINTF_FLOAT" in env['CPPDEFINES']:
+        # link float formatting only if a format string needs it, decided right before linking;
+        # only programs registered with add_printf_float_check get the response file
+        env.Append(
+            LINKFLAGS=["${_printf_float_flags(__env__, TARGETS)}"],
+            _printf_float_flags=get_printf_float_flags
+        )
+        add_printf_float_check(env, join("$BUILD_DIR", "${PROGNAME}.elf"))
 
     if not env.BoardConfig().get("build.ldscript", ""):
         env.Replace(LDSCRIPT_PATH=env.BoardConfig().get("build.arduino.ldscript", ""))
 
+    if BUILD_CORE == "teensy4":
+        apply_itcm_placement()
+
     if env.BoardConfig().id_ in (
         "teensy35",
         "teensy36",
@@ -320,7 +868,17 @@ elif "BOARD" in env and BUILD_CORE in ("teensy3", "teensy4"):
         )
 
     # Optimization
-    if "TEENSY_OPT_FASTER_LTO" in env['CPPDEFINES']:
+    opt_profile = get_opt_profile()
+    if opt_profile:
+        env.Append(
+            CCFLAGS=opt_profile["flags"],
+            LINKFLAGS=opt_profile["flags"]
+        )
+        if "-mpure-code" in opt_profile["flags"]:
+            env.Append(CPPDEFINES=["__PURE_CODE__"])
+        if opt_profile["lto"]:
+            append_lto_options()
+    elif "TEENSY_OPT_FASTER_LTO" in env['CPPDEFINES']:
         env.Append(
             CCFLAGS=["-O2"],
             LINKFLAGS=["-O2"]
@@ -417,7 +975,8 @@ if "cortex-m" in cpu:
     else:
         math_lib = math_lib % "M0l"
 
-    #env.Prepend(LIBS=[math_lib])
+    if "TEENSY_USE_CMSIS_DSP" in env['CPPDEFINES']:
+        use_cmsis_dsp(math_lib)
 
     if cpu.startswith(("cortex-m4", "cortex-m0")):
         env.Append(
@@ -457,6 +1016,55 @@ if BUILD_CORE == "teensy":
 else:
     env.Prepend(LIBPATH=[join(FRAMEWORK_DIR, ".", BUILD_CORE)])
 
+# include directories per translation unit, from the `-MMD` output of the previous build
+if "TEENSY_PRUNE_INCLUDES" in env['CPPDEFINES']:
+    import atexit
+
+    from SCons.Script import GetBuildFailures
+
+    FULL_INCFLAGS = env["_CPPINCFLAGS"]
+    include_cache = incprune.IncludeCache(env.subst(join("$BUILD_DIR", "include_dirs.json")))
+    macro_sysenv = environ.copy()
+    macro_sysenv["PATH"] = str(env["ENV"]["PATH"])
+    macro_cache = incprune.MacroCache(macro_sysenv)
+
+    def get_unit_macros(env, target, source):
+        """Digest of the macros the unit is preprocessed with."""
+        suffix = splitext(str(source[0]))[1] if source else ""
+        if suffix == ".c":
+            compiler, language, flags = "$CC", "c", "$CFLAGS $CCFLAGS"
+        elif suffix in (".S", ".sx"):
+            compiler, language, flags = "$CC", "assembler-with-cpp", "$ASPPFLAGS"
+        else:
+            compiler, language, flags = "$CXX", "c++", "$CXXFLAGS $CCFLAGS"
+        cmd = env.subst_list(
+            "%s %s $CPPFLAGS $_CPPDEFFLAGS" % (compiler, flags), target=target, source=source)[0]
+        cmd = [str(arg) for arg in cmd if str(arg) not in ("-MMD", "-MD", "-c")]
+        return macro_cache.digest(cmd + ["-x", language, "-dM", "-E", devnull])
+
+    def get_include_flags(env, target, source):
+        flags = [str(flag) for flag in env.subst_list(FULL_INCFLAGS, target=target, source=source)[0]]
+        prefix, suffix = env.subst("$INCPREFIX"), env.subst("$INCSUFFIX")
+        if target and "compiledb" not in COMMAND_LINE_TARGETS and all(
+                flag.startswith(prefix) and flag.endswith(suffix) for flag in flags):
+            dirs = [flag[len(prefix):len(flag) - len(suffix)] for flag in flags]
+            flags = [prefix + include_dir + suffix
+                     for include_dir in include_cache.select(
+                         abspath(str(target[0])), dirs, get_unit_macros(env, target, source))]
+        # like the default, the search path is not part of the build signature
+        return ["$("] + flags + ["$)"]
+
+    def record_include_dirs():
+        include_cache.record(set(
+            abspath(str(failure.node)) for failure in GetBuildFailures() if failure.node))
+
+    env.Append(CCFLAGS=["-MMD"])
+    env.Replace(
+        _teensy_include_flags=get_include_flags,
+        _CPPINCFLAGS="${_teensy_include_flags(__env__, TARGETS, SOURCES)}"
+    )
+    atexit.register(record_include_dirs)
+
 #
 # Target: Build Core Library
 #
@@ -481,4 +1089,26 @@ libs.append(env.BuildLibrary(
     src_filter="+<*> -<Blink.cc>"
 ))
 
+# deferred formatting of log messages, the format strings stay in the ELF file
+if "TEENSY_BINLOG" in env['CPPDEFINES'] and BUILD_CORE != "teensy":
+    BINLOG_DIR = join(platform.get_dir(), "misc", "binlog")
+    env.Append(CPPPATH=[BINLOG_DIR])
+    libs.append(env.BuildLibrary(join("$BUILD_DIR", "TeensyBinLog"), BINLOG_DIR))
+
+# interrupt and marker events over RTT, captured with the `rtt_trace` target
+if "TEENSY_RTT_TRACE" in env['CPPDEFINES'] and BUILD_CORE != "teensy":
+    TRACE_DIR = join(platform.get_dir(), "misc", "trace")
+    env.Append(CPPPATH=[TRACE_DIR])
+    libs.append(env.BuildLibrary(join("$BUILD_DIR", "TeensyTrace"), TRACE_DIR))
+
 env.Prepend(LIBS=libs)
+
+# sketch and library code built for the build machine, e.g. for benchmarks in CI
+if "windows" not in get_systype():
+    env.AddPlatformTarget(
+        "host_bench",
+        build_host_bench() if "host_bench" in COMMAND_LINE_TARGETS else None,
+        env.VerboseAction(run_host_bench, "Running host benchmarks"),
+        "Host Benchmark",
+        "Build `custom_host_sources` against a host-native core and run the benchmarks"
+    )
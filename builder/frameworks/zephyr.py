@@ -26,4 +26,12 @@ Import("env")
 
 SConscript(
     join(env.PioPlatform().get_package_dir("framework-zephyr"), "scripts",
-         "platformio", "platformio-build.py"), exports="env")
\ No newline at end of file
+         "platformio", "platformio-build.py"), exports="env")
+
+# interrupt and thread switch events over RTT, captured with the `rtt_trace` target
+if "TEENSY_RTT_TRACE" in env.get("CPPDEFINES", []):
+    TRACE_DIR = join(env.PioPlatform().get_dir(), "misc", "trace")
+    env.Append(CPPPATH=[TRACE_DIR])
+    env.Prepend(LIBS=[env.BuildLibrary(join("$BUILD_DIR", "TeensyTrace"), TRACE_DIR)])
+    # nothing references the tracing hooks, Zephyr only has weak defaults for them
+    env.Append(LINKFLAGS=["-Wl,-u,sys_trace_isr_enter_user"])
@@ -15,12 +15,12 @@
 import sys
 from platform import system
 from os import makedirs, environ
-from os.path import isdir, isfile, join
+from os.path import dirname, isdir, isfile, join
 from platformio import util
 from platformio.util import get_systype
 
-from SCons.Script import (COMMAND_LINE_TARGETS, AlwaysBuild, Builder, Default,
-                          DefaultEnvironment)
+from SCons.Script import (ARGUMENTS, COMMAND_LINE_TARGETS, AlwaysBuild, Builder,
+                          Default, DefaultEnvironment)
 
 from platformio.proc import exec_command
 
@@ -28,6 +28,9 @@ env = DefaultEnvironment()
 platform = env.PioPlatform()
 board_config = env.BoardConfig()
 
+# Helper modules shared by the build scripts
+sys.path.insert(0, join(platform.get_dir(), "builder"))
+
 # Allow user to override via pre:script
 if env.get("PROGNAME", "program") == "program":
     env.Replace(PROGNAME="firmware")
@@ -44,6 +47,7 @@ if "BOARD" in env and build_core == "teensy":
         AS="avr-as",
         CC="avr-gcc",
         CXX="avr-g++",
+        CXXFILT="avr-c++filt",
         GDB="avr-gdb",
         OBJCOPY="avr-objcopy",
         RANLIB="avr-ranlib",
@@ -94,8 +98,10 @@ elif "BOARD" in env and build_core == "teensy3":
         AS="arm-cortexm4f-eabi-as",
         CC="arm-cortexm4f-eabi-gcc",
         CXX="arm-cortexm4f-eabi-g++",
+        CXXFILT="arm-cortexm4f-eabi-c++filt",
         GDB="arm-cortexm4f-eabi-gdb",
         OBJCOPY="arm-cortexm4f-eabi-objcopy",
+        OBJDUMP="arm-cortexm4f-eabi-objdump",
         RANLIB="arm-cortexm4f-eabi-gcc-ar",
         SIZETOOL="arm-cortexm4f-eabi-size",
         SIZEPRINTCMD='$SIZETOOL -B -d $SOURCES'
@@ -107,8 +113,10 @@ elif "BOARD" in env and build_core == "teensy4":
         AS="arm-cortexm7f-eabi-as",
         CC="arm-cortexm7f-eabi-gcc",
         CXX="arm-cortexm7f-eabi-g++",
+        CXXFILT="arm-cortexm7f-eabi-c++filt",
         GDB="arm-cortexm7f-eabi-gdb",
         OBJCOPY="arm-cortexm7f-eabi-objcopy",
+        OBJDUMP="arm-cortexm7f-eabi-objdump",
         RANLIB="arm-cortexm7f-eabi-gcc-ar",
         SIZETOOL="arm-cortexm7f-eabi-size",
         SIZEPRINTCMD='$SIZETOOL -B -d $SOURCES'
@@ -146,6 +154,45 @@ if "BOARD" in env and build_core in ("teensy3", "teensy4"):
     if not env.get("PIOFRAMEWORK"):
         env.SConscript("frameworks/_bare_arm.py")
 
+# Distributed compilation: preprocess locally, compile on remote workers
+distcc_hosts = environ.get(
+    "TEENSY_DISTCC_HOSTS", env.GetProjectOption("custom_distcc_hosts", ""))
+if "BOARD" in env and build_core in ("teensy", "teensy3", "teensy4") and distcc_hosts:
+    env["ENV"]["TEENSY_DISTCC_HOSTS"] = distcc_hosts
+    env["ENV"]["TEENSY_DISTCC_TOKEN"] = environ.get(
+        "TEENSY_DISTCC_TOKEN", env.GetProjectOption("custom_distcc_token", ""))
+    # the wrapper is not part of the build signature, objects and cache keys stay the same
+    for command in ("CCCOM", "CXXCOM"):
+        env[command] = '$( "$PYTHONEXE" "%s" compile --cache-dir "%s" -- $) %s' % (
+            join(platform.get_dir(), "builder", "teensytools", "distcc.py"),
+            join("$PROJECT_WORKSPACE_DIR", "distcc"), env[command])
+
+# Shared build cache: SCons cache directory with an additional HTTP tier
+remote_cache_url = environ.get(
+    "TEENSY_REMOTE_CACHE_URL", env.GetProjectOption("custom_remote_cache_url", ""))
+if "BOARD" in env and remote_cache_url:
+    from SCons.CacheDir import CacheDir
+    from teensytools import remotecache
+
+    remote_cache_readonly = environ.get(
+        "TEENSY_REMOTE_CACHE_READONLY",
+        env.GetProjectOption("custom_remote_cache_readonly", "no"))
+    cache_salt = remotecache.get_salt(
+        board_config.id, sorted(board_config.manifest.items()), platform.version,
+        [(name, platform.get_package_version(name)) for name in sorted(platform.packages)
+         if name.startswith(("toolchain-", "framework-"))])
+    env.CacheDir(
+        env.get("BUILD_CACHE_DIR") or join("$PROJECT_WORKSPACE_DIR", "build_cache"),
+        remotecache.make_cache_class(
+            CacheDir,
+            remotecache.RemoteStore(
+                remote_cache_url,
+                readonly=remote_cache_readonly.lower() in ("1", "yes", "true"),
+                token=environ.get("TEENSY_REMOTE_CACHE_TOKEN")),
+            cache_salt,
+            remotecache.Stats(),
+            env.subst(join("$BUILD_DIR", "cache_stats.json"))))
+
 # Default GCC's size tool
 env.Replace(
     SIZECHECKCMD="$SIZETOOL -A -d $SOURCES",
@@ -155,17 +202,121 @@ env.Replace(
 
 print("PlatformIO running on " + util.get_systype())
 
+from teensytools import cycles, elf, fingerprint, sizecache
+
+
+def run_size_tool(env, cmd, firmware):
+    if not cmd:
+        return None
+    if not isinstance(cmd, list):
+        cmd = cmd.split()
+    cmd = [arg.replace("$SOURCES", firmware) for arg in cmd if arg]
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    result = exec_command(env.subst(cmd), env=sysenv)
+    if result["returncode"] != 0:
+        return None
+    return result["out"].strip()
+
+
+def get_size_report(env, firmware):
+    """Size tool output and region totals, cached in ${PROGNAME}.size.json by ELF hash."""
+    firmware = env.subst(str(firmware))
+    path = sizecache.report_path(firmware)
+    digest = elf.file_hash(firmware)
+    report = sizecache.load(path, digest)
+    # a report saved by a size check has no section table yet
+    if report is not None and (report["sections"] is not None or not env.get("SIZECHECKCMD")):
+        return report
+    checks = (report or {}).get("checks")
+    sections = run_size_tool(env, env.get("SIZECHECKCMD"), firmware)
+    summary = None
+    if isinstance(env.get("SIZEPRINTCMD"), str):
+        summary = run_size_tool(env, env.get("SIZEPRINTCMD"), firmware)
+    report = dict(elf=digest, sections=sections, summary=summary, regions={})
+    for name, pattern in (("program", "SIZEPROGREGEXP"), ("data", "SIZEDATAREGEXP"),
+                          ("ram2", "SIZERAM2REGEXP"), ("itcm", "SIZEITCMREGEXP")):
+        if env.get(pattern):
+            report["regions"][name] = sizecache.calculate(sections, env.get(pattern))
+    if checks:
+        report["checks"] = checks
+    # the section table is not available before the size command is configured
+    if sections is not None:
+        sizecache.save(path, report)
+    return report
+
+
+def print_size(target, source, env):
+    if callable(env.get("SIZEPRINTCMD")):
+        return env["SIZEPRINTCMD"](target, source, env)
+    summary = env.GetSizeReport(source[0])["summary"]
+    if summary:
+        print(summary)
+
+
+def is_enabled(value):
+    return str(value).lower() in ("1", "yes", "true")
+
+
+def print_cycle_report(target, source, env, top=None):
+    """Cycle estimates of the interrupt handlers (all functions for `top`) and regressions."""
+    sysenv = environ.copy()
+    sysenv["PATH"] = str(env["ENV"]["PATH"])
+    isr_names = env.GetProjectOption("custom_cycle_report_isrs", "").replace(",", " ").split()
+    try:
+        report, previous = cycles.get_report(
+            env.subst(str(source[0])), env.subst("$OBJDUMP"), board_config.get("build.cpu", ""),
+            sysenv, isr_names)
+    except (cycles.CyclesError, elf.ElfError, OSError) as exc:
+        sys.stderr.write("Warning! No cycle estimates: %s\n" % exc)
+        return
+    print(cycles.format_report(report, top=top or 0, isr_only=top is None))
+    changes = cycles.compare(
+        previous, report, float(env.GetProjectOption("custom_cycle_report_threshold", 5)) / 100)
+    if not changes:
+        return
+    print("Cycle estimates grown since the previous build:")
+    print(cycles.format_changes(changes))
+    regressions = sum(1 for change in changes if change[1])
+    if regressions and is_enabled(env.GetProjectOption("custom_cycle_report_strict", "no")):
+        sys.stderr.write("Error: %d interrupt handlers got slower\n" % regressions)
+        env.Exit(1)
+    elif regressions:
+        sys.stderr.write("Warning! %d interrupt handlers got slower\n" % regressions)
+
+
+env.AddMethod(get_size_report, "GetSizeReport")
+
 # Disable memory calculation and print output from custom "teensy_size" tool
 if "arduino" in env.subst("$PIOFRAMEWORK") and build_core == "teensy4":
     def teensy_check_upload_size(_, target, source, env):
-        sysenv = environ.copy()
-        sysenv["PATH"] = str(env["ENV"]["PATH"])
-        result = exec_command(["teensy_size", str(source[0])], env=sysenv)
+        firmware = env.subst(str(source[0]))
+        path = sizecache.report_path(firmware)
+        digest = elf.file_hash(firmware)
+        result = sizecache.load_check(path, digest, "teensy_size")
+        if result is None:
+            sysenv = environ.copy()
+            sysenv["PATH"] = str(env["ENV"]["PATH"])
+            result = exec_command(["teensy_size", firmware], env=sysenv)
+            result = dict(returncode=result["returncode"], err=result["err"])
+            sizecache.save_check(path, digest, "teensy_size", result)
         if result["returncode"] != 0:
             sys.stderr.write(result["err"])
             env.Exit(1)
 
     env.AddMethod(teensy_check_upload_size, "CheckUploadSize")
+else:
+    core_check_upload_size = env.CheckUploadSize
+
+    def check_upload_size(_, target, source, env):
+        # PlatformIO's check, reading the section table from the size report cache
+        report = env.GetSizeReport(source[0])
+        if report["sections"] is None:
+            return core_check_upload_size(target, source, env)
+        return core_check_upload_size(target, source, env.Override(dict(SIZECHECKCMD=[
+            "$PYTHONEXE", sizecache.__file__, sizecache.report_path(env.subst(str(source[0])))])))
+
+    env.AddMethod(check_upload_size, "CheckUploadSize")
 
 #
 # Target: Build executable and linkable firmware
@@ -178,34 +329,85 @@ if "zephyr" in env.get("PIOFRAMEWORK", []):
         exports={"env": env}
     )
 
+# Firmware formats needed by each upload protocol, the first one is uploaded
+UPLOAD_FORMATS = {
+    "teensy-cli": ["hex"],
+    "teensy-gui": ["hex"],
+    "jlink": ["elf"],
+    "jlink-jtag": ["elf"],
+}
+
+
+def get_firmware_formats():
+    """Formats required by the upload protocol followed by `custom_firmware_formats`."""
+    formats = list(UPLOAD_FORMATS.get(env.subst("$UPLOAD_PROTOCOL"), []))
+    for fmt in env.GetProjectOption("custom_firmware_formats", "").replace(",", " ").split():
+        if fmt.lower() not in formats:
+            formats.append(fmt.lower())
+    return formats or ["hex"]
+
+
+firmware_formats = get_firmware_formats()
+firmware_builders = dict(elf=None)
+for fmt, builder in (("hex", "ElfToHex"), ("bin", "ElfToBin"), ("eep", "ElfToEep")):
+    if builder in env["BUILDERS"]:
+        firmware_builders[fmt] = env["BUILDERS"][builder]
+for fmt in firmware_formats:
+    if fmt not in firmware_builders:
+        sys.stderr.write("Error: Firmware format `%s` is not available for this board, use one of %s\n" % (
+            fmt, ", ".join(sorted(firmware_builders))))
+        env.Exit(1)
+
 target_elf = None
+firmware_files = []
 if "nobuild" in COMMAND_LINE_TARGETS:
     target_elf = join("$BUILD_DIR", "${PROGNAME}.elf")
-    target_firm = join("$BUILD_DIR", "${PROGNAME}.hex")
+    firmware_files = [join("$BUILD_DIR", "${PROGNAME}.%s" % fmt) for fmt in firmware_formats]
 else:
     target_elf = env.BuildProgram()
-    target_firm = env.ElfToHex(join("$BUILD_DIR", "${PROGNAME}"), target_elf)
-    env.Depends(target_firm, "checkprogsize")
-
+    # conversions only depend on the ELF file and run in parallel
+    conversions = []
+    for fmt in firmware_formats:
+        if fmt == "elf":
+            firmware_files.append(target_elf)
+            continue
+        conversions.append(firmware_builders[fmt](env, join("$BUILD_DIR", "${PROGNAME}"), target_elf))
+        firmware_files.append(conversions[-1])
+
+target_firm = firmware_files[0]
 AlwaysBuild(env.Alias("nobuild", target_firm))
-target_buildprog = env.Alias("buildprog", target_firm, target_firm)
+target_buildprog = env.Alias("buildprog", firmware_files, firmware_files)
+
+# the ELF file cannot wait for its own size check, the aliases using it can
+check_size = "nobuild" not in COMMAND_LINE_TARGETS
+if check_size:
+    env.Depends(conversions + target_buildprog, env.Alias("checkprogsize"))
 
 #
 # Target: Print binary size
 #
 
-if env.BoardConfig().get("build.core") == "teensy4":
-    target_size = env.Alias(
-        "checkprogsize", target_elf,
-        env.VerboseAction("$SIZEPRINTCMD", " ")
-    )
-else:
-    target_size = env.Alias(
-        "size", target_elf,
-        env.VerboseAction("$SIZEPRINTCMD", "Calculating size $SOURCE")
-    )
+size_actions = [
+    env.VerboseAction(print_size, " " if build_core == "teensy4" else "Calculating size $SOURCE")
+]
+if is_enabled(environ.get(
+        "TEENSY_CYCLE_REPORT", env.GetProjectOption("custom_cycle_report", "no"))):
+    size_actions.append(env.VerboseAction(print_cycle_report, "Estimating cycles"))
+target_size = env.Alias(
+    "checkprogsize" if build_core == "teensy4" else "size", target_elf, size_actions)
 AlwaysBuild(target_size)
 
+if board_config.get("build.cpu", "") in cycles.TIMINGS:
+    env.AddPlatformTarget(
+        "cycle_report",
+        target_elf,
+        env.VerboseAction(
+            lambda target, source, env: print_cycle_report(target, source, env, top=40),
+            "Estimating cycles"),
+        "Cycle Report",
+        "Best case cycle estimates per function and changes since the previous build"
+    )
+
 #
 # Target: Upload by default firmware file
 #
@@ -284,7 +486,204 @@ elif upload_protocol == "custom":
 else:
     sys.stderr.write("Warning! Unknown upload protocol %s\n" % upload_protocol)
 
-AlwaysBuild(env.Alias("upload", target_firm, upload_actions))
+# Upload through a running upload daemon, fall back to the regular tools
+upload_daemon = environ.get(
+    "TEENSY_UPLOAD_DAEMON", env.GetProjectOption("custom_upload_daemon", ""))
+if upload_protocol in ("teensy-cli", "teensy-gui") and upload_daemon:
+    from teensytools import uploadd
+
+    def upload_via_daemon(target, source, env, fallback_actions=upload_actions):
+        def print_progress(percent, message):
+            print("%3d%% %s" % (percent, message))
+
+        result = uploadd.request_upload(
+            uploadd.parse_address(upload_daemon), board_config.id,
+            str(source[0]), env.subst("$UPLOAD_PORT") or None, print_progress,
+            mcu=env.subst("$BOARD_MCU"))
+        if result is None:
+            print("Upload daemon not reachable, using %s" % upload_protocol)
+            for action in fallback_actions:
+                if action(target, source, env):
+                    env.Exit(1)
+        elif not result[0]:
+            sys.stderr.write("Error: %s\n" % result[1])
+            env.Exit(1)
+
+    upload_actions = [
+        env.VerboseAction(upload_via_daemon, "Uploading $SOURCE (upload daemon)")
+    ]
+
+target_upload = env.Alias("upload", target_firm, upload_actions)
+AlwaysBuild(target_upload)
+if check_size:
+    env.Depends(target_upload, env.Alias("checkprogsize"))
+
+#
+# Target: All unit test suites in one firmware, uploaded once
+#
+
+
+def run_test_bundle(target, source, env):
+    from teensytools import testbundle
+
+    if not is_enabled(env.GetProjectOption("custom_test_bundle_upload", "yes")):
+        print("Test bundle %s built, not uploaded" % source[0])
+        return
+    bundle_env = env.Override(dict(BUILD_DIR=dirname(source[0].get_abspath())))
+    for action in upload_actions:
+        if action(target, source, bundle_env):
+            env.Exit(1)
+    port = env.GetProjectOption("test_port", None) or env.GetProjectOption("monitor_port", None)
+    verbose = int(ARGUMENTS.get("PIOVERBOSE", 0))
+    try:
+        output = testbundle.capture(
+            port, float(env.GetProjectOption("custom_test_bundle_timeout", 300)),
+            echo=print if verbose else None)
+    except testbundle.BundleError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+    bundle_dir = bundle_env.subst("$BUILD_DIR")
+    with open(join(bundle_dir, "output.txt"), "w") as fp:
+        fp.write(output)
+    results = testbundle.parse_output(output)
+    testbundle.save(join(bundle_dir, "results.json"), results)
+    suites = env["TEST_BUNDLE_SUITES"]
+    print(testbundle.format_results(results, suites))
+    if testbundle.succeeded(results, suites):
+        return
+    passed = sum(1 for suite in results["suites"] if suite["ok"])
+    if passed < len(suites):
+        sys.stderr.write("Error: %d of %d test suites failed or did not run\n" % (
+            len(suites) - passed, len(suites)))
+    else:
+        sys.stderr.write("Error: The test bundle did not finish\n")
+    env.Exit(1)
+
+
+if hasattr(env, "BuildTestBundle"):
+    test_bundle = None
+    if "test_bundle" in COMMAND_LINE_TARGETS:
+        bundle_elf, bundle_suites = env.BuildTestBundle()
+        env.Replace(TEST_BUNDLE_SUITES=bundle_suites)
+        test_bundle = bundle_elf
+        if firmware_formats[0] != "elf":
+            test_bundle = firmware_builders[firmware_formats[0]](
+                env, join("$BUILD_DIR", "test_bundle", "${PROGNAME}"), bundle_elf)
+    env.AddPlatformTarget(
+        "test_bundle",
+        test_bundle,
+        env.VerboseAction(run_test_bundle, "Running test suites"),
+        "Test Bundle",
+        "Link all unit test suites into one firmware, upload it once and report per suite"
+    )
+
+#
+# Target: Capture TeensyTrace events over RTT into a Perfetto trace
+#
+
+
+def start_jlink_rtt_server(port):
+    import subprocess
+    import time
+
+    from teensytools import rtttrace
+
+    device = board_config.get("debug", {}).get("jlink_device")
+    package_dir = platform.get_package_dir("tool-jlink")
+    if not package_dir:
+        sys.stderr.write(
+            "Error: No RTT telnet server on port %d. Use `debug_tool = jlink` or "
+            "`upload_protocol = jlink` to start it automatically, or start "
+            "JLinkGDBServer yourself.\n" % port)
+        env.Exit(1)
+    server = subprocess.Popen([
+        join(package_dir, "JLinkGDBServerCL.exe" if system() == "Windows" else "JLinkGDBServer"),
+        "-if", "JTAG" if upload_protocol == "jlink-jtag" else "SWD",
+        "-select", "USB",
+        "-device", device,
+        "-speed", env.GetProjectOption("debug_speed", "4000"),
+        "-port", "2331",
+        "-RTTTelnetPort", str(port),
+        "-nohalt", "-noir", "-silent"
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while not rtttrace.is_listening(("127.0.0.1", port)):
+        if server.poll() is not None or time.time() > deadline:
+            server.kill()
+            sys.stderr.write("Error: JLinkGDBServer could not connect to the board\n")
+            env.Exit(1)
+        time.sleep(0.2)
+    return server
+
+
+def capture_rtt_trace(target, source, env):
+    from teensytools import rtttrace
+
+    address = rtttrace.parse_address(environ.get(
+        "TEENSY_RTT_ADDRESS", env.GetProjectOption(
+            "custom_rtt_address", "127.0.0.1:%d" % rtttrace.DEFAULT_PORT)))
+    duration = float(environ.get(
+        "TEENSY_RTT_DURATION", env.GetProjectOption("custom_rtt_duration", 0)))
+    svd_path = join(platform.get_dir(), "misc", "svd",
+                    board_config.get("debug", {}).get("svd_path", ""))
+    output = join(env.subst("$BUILD_DIR"), "trace.perfetto-trace")
+    server = None
+    if not rtttrace.is_listening(address):
+        server = start_jlink_rtt_server(address[1])
+    print("Capturing %s, press Ctrl+C to stop" % (
+        "for %g s" % duration if duration else "until the stream ends"))
+    try:
+        with rtttrace.Capture(
+                output, int(env.subst("$BOARD_F_CPU").rstrip("L") or 0) or 600000000,
+                rtttrace.load_strings(str(source[0])),
+                rtttrace.load_irq_names(svd_path) if isfile(svd_path) else None,
+                join(env.subst("$BUILD_DIR"), "trace.rtt"), board_config.id) as capture:
+            rtttrace.capture_socket(address, capture, duration or None)
+    except rtttrace.TraceError as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        env.Exit(1)
+    finally:
+        if server:
+            server.terminate()
+    rtttrace.print_summary(capture, output)
+    if not capture.decoder.records:
+        print("No records received, is the firmware built with `-DTEENSY_RTT_TRACE`?")
+
+
+if board_config.get("debug", {}).get("jlink_device"):
+    env.AddPlatformTarget(
+        "rtt_trace",
+        target_elf,
+        env.VerboseAction(capture_rtt_trace, "Capturing RTT trace"),
+        "RTT Trace",
+        "Record TeensyTrace events over J-Link RTT into a Perfetto trace"
+    )
+
+#
+# Store the build fingerprint for the no-op fast path of the platform
+#
+
+build_fingerprint = environ.get("TEENSY_BUILD_FINGERPRINT")
+if build_fingerprint and set(COMMAND_LINE_TARGETS) <= set(fingerprint.BUILD_TARGETS):
+    import atexit
+    import hashlib
+
+    from SCons.Script import GetBuildFailures
+
+    def save_build_fingerprint():
+        if GetBuildFailures():
+            return
+        outputs = [target_elf[0].get_abspath()] + [
+            f[0].get_abspath() for f in firmware_files if f is not target_elf]
+        if not all(isfile(path) for path in outputs):
+            return
+        flags = env.subst("$CCFLAGS $CFLAGS $CXXFLAGS $_CPPDEFFLAGS $LINKFLAGS $_LIBFLAGS")
+        fingerprint.save(
+            env.subst("$BUILD_DIR"), build_fingerprint,
+            hashlib.sha256(flags.encode()).hexdigest(), outputs,
+            sizecache.report_path(outputs[0]))
+
+    atexit.register(save_build_fingerprint)
 
 #
 # Default targets
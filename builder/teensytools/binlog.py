@@ -0,0 +1,405 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Host side decoder for TeensyBinLog records
+
+A record is the sync byte 0xB7, the length of the rest of the record, the
+format ID as unsigned LEB128 and the raw arguments. The format ID is the
+address of the format string in the `.binlog_fmt` section, which is kept in
+the ELF file but never loaded onto the target.
+
+Argument encoding, derived from the conversion in the format string:
+  * integer conversions, %c and %p: 4 bytes little-endian, 8 bytes with
+    the `ll` or `j` length modifier
+  * floating point conversions: 8 byte double
+  * %s: one length byte followed by the characters
+  * `*` width or precision: 4 byte integer
+Bytes outside of records are passed through as text, so regular Serial
+output can be mixed with binary records. The sync byte also occurs in UTF-8
+text (e.g. "\u00b7" is C2 B7), such text is taken as the start of a record.
+
+The decoder handles about 70 Mbit/s of small records (`--bench` measures it
+for a capture), much less than the 480 Mbit/s of the Teensy USB port, and
+formatting every record in Python cannot get close to it. `decode_stream`
+therefore keeps reading on its own thread and buffers what the decoder has
+not reached yet: nothing is lost, the text lags behind instead, and a
+growing backlog is reported.
+"""
+
+import argparse
+import collections
+import re
+import struct
+import sys
+import threading
+import time
+
+from . import elf
+
+SYNC = 0xB7
+SECTION = ".binlog_fmt"
+# reported when the decoder is this far behind the stream, then at every doubling
+BACKLOG_WARNING = 8 << 20
+
+_CONVERSION_RE = re.compile(
+    r"%(?P<flags>[-+ #0]*)(?P<width>\*|\d+)?(?:\.(?P<precision>\*|\d*))?"
+    r"(?P<length>hh|h|ll|l|L|q|j|z|t)?(?P<conv>[diouxXeEfFgGaAcspn%])")
+
+
+class Format(object):
+    """A format string compiled into an argument reader and a Python format."""
+
+    def __init__(self, text):
+        self.text = text
+        self.readers = []
+        parts = []
+        pos = 0
+        for match in _CONVERSION_RE.finditer(text):
+            parts.append(text[pos:match.start()].replace("%", "%%"))
+            pos = match.end()
+            conv = match.group("conv")
+            if conv == "%":
+                parts.append("%%")
+                continue
+            spec = "%" + match.group("flags")
+            for key in ("width", "precision"):
+                value = match.group(key)
+                if value == "*":
+                    self.readers.append("i")
+                    value = "*"
+                if value is not None:
+                    spec += ("." if key == "precision" else "") + value
+            wide = match.group("length") in ("ll", "q", "j")
+            if conv in "di":
+                self.readers.append("q" if wide else "i")
+            elif conv in "ouxX":
+                self.readers.append("Q" if wide else "I")
+            elif conv in "eEfFgG":
+                self.readers.append("d")
+            elif conv in "aA":
+                self.readers.append("d")
+                spec, conv = "%", "s"
+            elif conv == "c":
+                self.readers.append("I")
+            elif conv == "p":
+                self.readers.append("I")
+                spec, conv = "0x%", "x"
+            elif conv == "s":
+                self.readers.append("s")
+            else:  # %n writes nothing useful
+                continue
+            parts.append(spec + conv)
+        parts.append(text[pos:].replace("%", "%%"))
+        self.pyformat = "".join(parts)
+        self.hex_floats = any(conv in "aA" for conv in _conversions(text))
+        # precompiled layouts: the runs of fixed size arguments between strings
+        self.layouts = []
+        for index, run in enumerate("".join(self.readers).split("s")):
+            if index:
+                self.layouts.append(None)
+            if run:
+                self.layouts.append(struct.Struct("<" + run))
+        self.struct = None
+        if "s" not in self.readers:
+            self.struct = struct.Struct("<" + "".join(self.readers))
+
+    def decode(self, payload, offset=0, end=None):
+        """Formats the arguments in payload[offset:end]."""
+        if end is None:
+            end = len(payload)
+        if self.struct is not None:
+            if end - offset < self.struct.size:
+                raise ValueError("short record")
+            args = self.struct.unpack_from(payload, offset)
+        else:
+            args = []
+            for layout in self.layouts:
+                if layout is None:
+                    if offset >= end or offset + 1 + payload[offset] > end:
+                        raise ValueError("short record")
+                    length = payload[offset]
+                    args.append(bytes(payload[offset + 1:offset + 1 + length]).decode(
+                        "utf-8", "replace"))
+                    offset += 1 + length
+                else:
+                    if end - offset < layout.size:
+                        raise ValueError("short record")
+                    args.extend(layout.unpack_from(payload, offset))
+                    offset += layout.size
+        if self.hex_floats:
+            args = _hex_floats(self.text, args)
+        return self.pyformat % tuple(args)
+
+
+def _conversions(text):
+    return [m.group("conv") for m in _CONVERSION_RE.finditer(text)
+            if m.group("conv") not in "%n"]
+
+
+def _hex_floats(text, args):
+    args = list(args)
+    index = 0
+    for match in _CONVERSION_RE.finditer(text):
+        for key in ("width", "precision"):
+            if match.group(key) == "*":
+                index += 1
+        conv = match.group("conv")
+        if conv in "%n":
+            continue
+        if conv in "aA":
+            args[index] = float(args[index]).hex()
+        index += 1
+    return args
+
+
+def load_formats(firmware):
+    """Returns {format id: Format} from the `.binlog_fmt` section."""
+    if not isinstance(firmware, elf.ElfFile):
+        firmware = elf.ElfFile(firmware)
+    section = firmware.section(SECTION)
+    if section is None:
+        return {}
+    data = firmware.read_section(section)
+    formats = {}
+    pos = 0
+    while pos < len(data):
+        if data[pos] == 0:
+            pos += 1
+            continue
+        end = data.index(b"\x00", pos)
+        formats[section.addr + pos] = Format(data[pos:end].decode("utf-8", "replace"))
+        pos = end + 1
+    return formats
+
+
+class Decoder(object):
+
+    def __init__(self, formats):
+        self.formats = formats
+        # format ID -> (Python format, unpack_from, size) for records without strings
+        self.fixed = dict(
+            (ident, (fmt.pyformat, fmt.struct.unpack_from, fmt.struct.size))
+            for ident, fmt in formats.items()
+            if fmt.struct is not None and not fmt.hex_floats)
+        self.buffer = bytearray()
+        self.records = 0
+        self.errors = 0
+
+    def feed(self, data):
+        """Decode as much of the stream as possible, returns the text."""
+        buf = self.buffer
+        buf += data
+        out = []
+        append = out.append
+        pos = 0
+        end = len(buf)
+        formats = self.formats
+        fixed = self.fixed
+        records = 0
+        while pos < end:
+            # records usually follow each other directly
+            if buf[pos] == SYNC:
+                sync = pos
+            else:
+                sync = buf.find(SYNC, pos)
+                if sync < 0:
+                    append(buf[pos:].decode("utf-8", "replace"))
+                    pos = end
+                    break
+                append(buf[pos:sync].decode("utf-8", "replace"))
+            if sync + 2 > end or sync + 2 + buf[sync + 1] > end:
+                pos = sync
+                break
+            record_end = sync + 2 + buf[sync + 1]
+            index = sync + 2
+            ident = buf[index] if index < record_end else 0
+            index += 1
+            if ident & 0x80:
+                ident &= 0x7F
+                shift = 7
+                while index < record_end:
+                    byte = buf[index]
+                    index += 1
+                    ident |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+            pos = record_end
+            layout = fixed.get(ident)
+            if layout is not None and record_end - index >= layout[2]:
+                append(layout[0] % layout[1](buf, index))
+                records += 1
+                continue
+            fmt = formats.get(ident)
+            try:
+                if fmt is None:
+                    raise ValueError("unknown format id 0x%x" % ident)
+                append(fmt.decode(buf, index, record_end))
+                records += 1
+            except (ValueError, IndexError, TypeError) as exc:
+                self.errors += 1
+                append("<binlog: %s>\n" % exc)
+        self.records += records
+        del buf[:pos]
+        return "".join(out)
+
+
+def decode_file(firmware, path, output, chunk_size=1 << 20):
+    decoder = Decoder(load_formats(firmware))
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            output.write(decoder.feed(chunk))
+    return decoder
+
+
+class StreamBuffer(object):
+    """Chunks passed from the reader thread to the decoder, without a size limit."""
+
+    def __init__(self):
+        self.chunks = collections.deque()
+        self.size = 0
+        self.closed = False
+        self.error = None
+        self.changed = threading.Condition()
+
+    def put(self, data):
+        with self.changed:
+            self.chunks.append(data)
+            self.size += len(data)
+            self.changed.notify()
+
+    def close(self, error=None):
+        with self.changed:
+            self.closed = True
+            self.error = self.error or error
+            self.changed.notify()
+
+    def get(self, limit=1 << 20):
+        """Returns the pending data (about `limit` bytes at most), b"" at the end."""
+        with self.changed:
+            while not self.chunks and not self.closed:
+                self.changed.wait()
+            data = bytearray()
+            while self.chunks and len(data) < limit:
+                data += self.chunks.popleft()
+            self.size -= len(data)
+            return bytes(data)
+
+
+def decode_stream(read, decoder, output, raw=None, backlog_warning=BACKLOG_WARNING):
+    """Decodes the data returned by `read()` until it returns b"" or Ctrl+C.
+
+    `read` runs on its own thread that only queues the data (and copies it to
+    `raw`), so a decoder slower than the stream never holds up the reader.
+    """
+    buffer = StreamBuffer()
+
+    def reader():
+        try:
+            while not buffer.closed:
+                data = read()
+                if not data:
+                    break
+                if raw is not None:
+                    raw.write(data)
+                buffer.put(data)
+        except (OSError, ValueError) as exc:
+            buffer.close(exc)
+        buffer.close()
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    warn_at = backlog_warning
+    while True:
+        try:
+            data = buffer.get()
+            if not data:
+                break
+            # an interrupted feed() keeps the data and decodes it with the next one
+            output.write(decoder.feed(data))
+        except KeyboardInterrupt:
+            # stop reading, decode what has been received
+            buffer.close()
+            continue
+        if buffer.size >= warn_at:
+            sys.stderr.write(
+                "Warning! binlog decoder is %.1f MiB behind the stream, "
+                "the data is buffered until it catches up\n" % (buffer.size / float(1 << 20)))
+            warn_at *= 2
+    if buffer.error is not None:
+        sys.stderr.write("Warning! Reading the stream failed: %s\n" % buffer.error)
+    return decoder
+
+
+def benchmark(firmware, path, repeat=3, chunk_size=1 << 16):
+    formats = load_formats(firmware)
+    with open(path, "rb") as fp:
+        data = fp.read()
+    best = None
+    for _ in range(repeat):
+        decoder = Decoder(formats)
+        start = time.perf_counter()
+        for offset in range(0, len(data), chunk_size):
+            decoder.feed(data[offset:offset + chunk_size])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return dict(
+        bytes=len(data), records=decoder.records, errors=decoder.errors,
+        seconds=best,
+        mbit_per_s=len(data) * 8 / best / 1e6 if best else 0.0,
+        records_per_s=decoder.records / best if best else 0.0,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode TeensyBinLog streams")
+    parser.add_argument("elf", help="firmware the stream was recorded with")
+    parser.add_argument("capture", nargs="?", help="raw serial capture")
+    parser.add_argument("--port", help="read and decode a serial port until Ctrl+C")
+    parser.add_argument("--raw", help="with --port, also save the raw stream to this file")
+    parser.add_argument("--bench", action="store_true",
+                        help="measure decoder throughput instead of printing")
+    args = parser.parse_args(argv)
+    if bool(args.capture) == bool(args.port):
+        parser.error("either a capture file or --port is required")
+    if args.bench:
+        result = benchmark(args.elf, args.capture)
+        print("%(bytes)d bytes, %(records)d records, %(errors)d errors in "
+              "%(seconds).3f s: %(mbit_per_s).1f Mbit/s, %(records_per_s).0f records/s" % result)
+        return 0
+    if args.port:
+        try:
+            import serial
+        except ImportError:
+            sys.stderr.write("Error: pyserial is required to read a serial port\n")
+            return 1
+        connection = serial.Serial(args.port, 115200)
+        raw = open(args.raw, "wb") if args.raw else None
+        try:
+            decode_stream(lambda: connection.read(connection.in_waiting or 1),
+                          Decoder(load_formats(args.elf)), sys.stdout, raw)
+        finally:
+            connection.close()
+            if raw is not None:
+                raw.close()
+        return 0
+    decode_file(args.elf, args.capture, sys.stdout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""
+Boot time analysis
+
+Estimates the time from reset to `setup()`:
+  * sections copied from flash to RAM, i.e. whose load address differs from
+    the run address (`.text.itcm`, `.data`, ...)
+  * sections zeroed at reset, `.bss` between `_sbss` and `_ebss`
+  * the fixed delays of the core for the USB initialization
+  * the constructors in `.preinit_array` and `.init_array`, with their size,
+    the source file from the symbol table and the `max` cycle estimate
+    without callees if a cycle report is available (see cycles.py)
+
+Copy and clear loops are estimated with fixed cycles per word at `f_cpu`.
+The cores copy before the caches are enabled, so these are approximations.
+"""
+
+import argparse
+import math
+import re
+import sys
+
+from . import cycles, elf
+
+# cycles per 32 bit word of the startup copy and clear loops
+STARTUP_TIMING = {
+    "teensy4": dict(copy=8, zero=1, source="startup.c"),
+    "teensy3": dict(copy=4, zero=2, source="mk20dx128.c"),
+}
+DELAY_DEFINES = ("TEENSY_INIT_USB_DELAY_BEFORE", "TEENSY_INIT_USB_DELAY_AFTER")
+_DELAY_RE = re.compile(r"^\s*#\s*define\s+(%s)\s+\(?(\d+)" % "|".join(DELAY_DEFINES), re.M)
+
+
+def read_startup_delays(path):
+    """Returns {define: milliseconds} of the USB delays in the startup code of the core."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as fp:
+            source = fp.read()
+    except OSError:
+        return {}
+    return {name: int(value) for name, value in _DELAY_RE.findall(source)}
+
+
+def _words(size):
+    return int(math.ceil(size / 4.0))
+
+
+def region(cpu, addr):
+    for start, end, name, _, _ in cycles.REGIONS.get(cpu, ()):
+        if start <= addr < end:
+            return name
+    return "?"
+
+
+def analyze(firmware_path, core, cpu, f_cpu, delays=None, cycle_report=None):
+    """Bytes copied and zeroed per section, the constructors and the estimated time in us."""
+    if core not in STARTUP_TIMING:
+        raise elf.ElfError("no startup model for the %s core" % core)
+    timing = STARTUP_TIMING[core]
+    firmware = elf.ElfFile(firmware_path)
+    symbols = {s.name: s.value for s in firmware.symbols}
+    bss = (symbols.get("_sbss"), symbols.get("_ebss"))
+
+    copied = []
+    zeroed = []
+    for section in firmware.sections:
+        if not section.flags & elf.SHF_ALLOC or not section.size:
+            continue
+        where = region(cpu, section.addr)
+        if section.type == elf.SHT_NOBITS:
+            if None not in bss:
+                start = max(section.addr, bss[0])
+                size = min(section.addr + section.size, bss[1]) - start
+            else:
+                size = section.size if section.name.startswith(".bss") else 0
+            if size > 0:
+                zeroed.append((section.name, where, size))
+        elif section.lma != section.addr:
+            copied.append((section.name, where, section.size))
+
+    functions = {}
+    for fn in firmware.functions():
+        functions.setdefault(fn.value, fn)
+    estimates = {}
+    if cycle_report:
+        estimates = {f["addr"]: f["max"] for f in cycle_report["functions"].values()}
+    constructors = []
+    for name in (".preinit_array", ".init_array"):
+        data = firmware.read_section(name)
+        for pos in range(0, len(data) - 3, 4):
+            addr = int.from_bytes(data[pos:pos + 4], "little") & ~1
+            fn = functions.get(addr)
+            constructors.append(dict(
+                addr=addr, name=fn.name if fn else "0x%x" % addr, size=fn.size if fn else 0,
+                file=fn.file if fn else None, cycles=estimates.get(addr)))
+
+    copy_cycles = sum(_words(size) for _, _, size in copied) * timing["copy"]
+    zero_cycles = sum(_words(size) for _, _, size in zeroed) * timing["zero"]
+    constructor_cycles = sum(c["cycles"] or 0 for c in constructors)
+    delays = delays or {}
+    delay_us = 1000 * sum(delays.values())
+    total_us = delay_us + 1e6 * (copy_cycles + zero_cycles + constructor_cycles) / f_cpu
+    return dict(
+        f_cpu=f_cpu, copied=copied, zeroed=zeroed, constructors=constructors, delays=delays,
+        copy_cycles=copy_cycles, zero_cycles=zero_cycles,
+        constructor_cycles=constructor_cycles, total_us=total_us)
+
+
+def _us(report, cycles_count):
+    return 1e6 * cycles_count / report["f_cpu"]
+
+
+def format_report(report, names=None):
+    names = names or {}
+    lines = ["Boot time estimate at %g MHz:" % (report["f_cpu"] / 1e6)]
+    for title, key, cycles_key in (("copied", "copied", "copy_cycles"),
+                                   ("zeroed", "zeroed", "zero_cycles")):
+        total = sum(size for _, _, size in report[key])
+        lines.append("  %-8s %8d bytes %10.1f us" % (title, total, _us(report, report[cycles_key])))
+        for name, where, size in report[key]:
+            lines.append("    %-24s %-7s %8d bytes" % (name, where, size))
+    for name, value in sorted(report["delays"].items()):
+        lines.append("  %-30s %4d ms" % (name, value))
+    unknown = sum(1 for c in report["constructors"] if c["cycles"] is None)
+    lines.append("  constructors %4d %10s %10.1f us%s" % (
+        len(report["constructors"]), "", _us(report, report["constructor_cycles"]),
+        " (%d without estimate)" % unknown if unknown else ""))
+    for ctor in sorted(report["constructors"], key=lambda c: -c["size"]):
+        lines.append("    %-40s %6d bytes %8s  %s" % (
+            names.get(ctor["name"], ctor["name"]), ctor["size"],
+            "-" if ctor["cycles"] is None else "%g cyc" % ctor["cycles"], ctor["file"] or ""))
+    lines.append("  reset to setup(): %.1f ms (callees of constructors not included)" % (
+        report["total_us"] / 1000.0))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate the time from reset to setup()")
+    parser.add_argument("firmware", help="ELF file")
+    parser.add_argument("--core", choices=sorted(STARTUP_TIMING), default="teensy4")
+    parser.add_argument("--cpu", default="cortex-m7", help="memory map for the region names")
+    parser.add_argument("--f-cpu", type=float, default=600e6, help="core clock in Hz")
+    parser.add_argument("--startup", help="startup source of the core for the USB delays")
+    parser.add_argument("--cycles", action="store_true",
+                        help="estimate the constructors with cycles.py (needs objdump)")
+    parser.add_argument("--objdump", default="arm-none-eabi-objdump")
+    args = parser.parse_args(argv)
+    delays = read_startup_delays(args.startup) if args.startup else {}
+    try:
+        cycle_report = None
+        if args.cycles:
+            cycle_report = cycles.get_report(args.firmware, args.objdump, args.cpu)[0]
+        report = analyze(args.firmware, args.core, args.cpu, args.f_cpu, delays, cycle_report)
+    except (cycles.CyclesError, elf.ElfError, OSError) as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        return 1
+    print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,617 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""
+Static cycle estimates for Cortex-M4 and Cortex-M7 firmware
+
+The firmware is disassembled with objdump and split into basic blocks. Each
+block gets two estimates from a per-core instruction timing table:
+
+  * `warm`: best case with all caches hit; accesses to peripherals are
+    never cached and always pay the bus bridge
+  * `cold`: first execution, every code line fetched from flash and every
+    load from a cached region misses
+
+Load and store addresses are known when the base register comes from a
+literal pool or movw/movt in the same block, otherwise the access is assumed
+to hit (DTCM, stack). Calls only count the branch, not the callee. Per
+function, `min` is the cheapest path from the entry to a return and `max`
+the most expensive path without loops.
+
+The numbers are approximations for comparing builds; they ignore stalls
+from data dependencies, bus contention and branch mispredictions.
+
+Reports are stored in `<firmware>.cycles.json` with the SHA-256 of the ELF
+file. When the firmware changes, the previous report is kept in
+`<firmware>.cycles.prev.json` for the comparison.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import re
+import subprocess
+import sys
+
+from . import elf
+
+REPORT_FORMAT = 2
+
+_FUNCTION_RE = re.compile(r"^([0-9a-f]+) <(.+)>:$")
+_INSN_RE = re.compile(r"^\s*([0-9a-f]+):\s+([a-z][\w.]*)(?:\s+([^@;]*?))?\s*(?:[@;]\s*(.*))?$")
+_COMMENT_ADDR_RE = re.compile(r"\(?([0-9a-f]+)\s*<")
+_TARGET_RE = re.compile(r"(?:^|,\s*)([0-9a-f]+)(?:\s+<|$)")
+_REGISTER_RE = re.compile(r"\b(r1[0-5]|r[0-9]|sp|lr|pc|ip|fp|sl|sb|[sd][0-9]+)\b")
+_IMMEDIATE_RE = re.compile(r"#(-?(?:0x[0-9a-f]+|\d+))")
+_IT_RE = re.compile(r"^it[te]{0,3}$")
+
+_ALIASES = {"ip": "r12", "fp": "r11", "sl": "r10", "sb": "r9"}
+_CONDITIONS = frozenset((
+    "eq", "ne", "cs", "hs", "cc", "lo", "mi", "pl", "vs", "vc", "hi", "ls", "ge", "lt", "gt",
+    "le", "al"))
+
+_CLASSES = {}
+for _class, _names in (
+        ("alu", "add adc sub sbc rsb and orr orn eor bic mov mvn lsl lsr asr ror rrx neg adr "
+                "ubfx sbfx bfi bfc uxtb uxth sxtb sxth uxtab uxtah sxtab sxtah rev rev16 revsh "
+                "rbit clz ssat usat movw movt nop sel qadd qsub qdadd qdsub cpy"),
+        ("compare", "cmp cmn tst teq"),
+        ("mul", "mul"),
+        ("mac", "mla mls smulbb smulbt smultb smultt smulwb smulwt smlabb smlabt smlatb smlatt "
+                "smlawb smlawt smmul smmla smmls smuad smusd smlad smlsd usad8 usada8"),
+        ("mull", "umull smull umlal smlal umaal smlalbb smlald smlsld"),
+        ("div", "sdiv udiv"),
+        ("load", "ldr ldrb ldrh ldrsb ldrsh ldrex ldrexb ldrexh ldrt ldrbt ldrht ldrsbt ldrsht"),
+        ("load2", "ldrd"),
+        ("store", "str strb strh strex strexb strexh strt strbt strht"),
+        ("store2", "strd"),
+        ("ldm", "ldm ldmia ldmfd ldmdb ldmea pop"),
+        ("stm", "stm stmia stmea stmdb stmfd push"),
+        ("branch", "b cbz cbnz"),
+        ("table", "tbb tbh"),
+        ("bx", "bx"),
+        ("call", "bl blx"),
+        ("fp", "vadd vsub vmul vnmul vneg vabs vmov vcvt vcvtr vcvta vcvtn vcvtp vcvtm vcmp "
+               "vcmpe vmrs vmsr vsel vmaxnm vminnm vrinta vrintn vrintp vrintm vrintx vrintz "
+               "vrintr"),
+        ("fpmac", "vmla vmls vnmla vnmls vfma vfms vfnma vfnms"),
+        ("fpdiv", "vdiv vsqrt"),
+        ("fpload", "vldr"),
+        ("fpstore", "vstr"),
+        ("fpldm", "vldm vldmia vldmdb vpop"),
+        ("fpstm", "vstm vstmia vstmdb vpush"),
+        ("barrier", "dmb dsb isb"),
+        ("system", "mrs msr cpsid cpsie wfi wfe sev svc bkpt udf")):
+    for _name in _names.split():
+        _CLASSES[_name] = _class
+
+# Issue cycles of the best case per instruction class. `+n` classes add one
+# cycle per transferred register (two per cycle on the 64 bit Cortex-M7 bus).
+TIMINGS = {
+    "cortex-m4": dict(
+        alu=1, compare=1, mul=1, mac=1, mull=1, div=2, load=2, load2=3, store=1, store2=3,
+        ldm=1, stm=1, per_register=1.0, branch=1, taken=1, table=3, bx=2, call=2, fp=1,
+        fp64=None, fpmac=3, fpdiv=14, fpdiv64=None, fpload=2, fpstore=2, fpldm=1, fpstm=1,
+        barrier=2, system=2, it=0, dual_issue=False, pipelined_loads=True),
+    "cortex-m7": dict(
+        alu=1, compare=1, mul=1, mac=1, mull=1, div=3, load=1, load2=1, store=1, store2=1,
+        ldm=1, stm=1, per_register=0.5, branch=1, taken=0, table=3, bx=1, call=1, fp=1,
+        fp64=1, fpmac=1, fpdiv=14, fpdiv64=29, fpload=1, fpstore=1, fpldm=1, fpstm=1,
+        barrier=4, system=2, it=0, dual_issue=True, pipelined_loads=False),
+}
+
+# Memory map: (start, end, name, extra cycles per access when warm, extra
+# cycles per access or code line when cold, code line size)
+REGIONS = {
+    "cortex-m7": (  # i.MX RT1062, Teensy 4.x
+        (0x00000000, 0x00080000, "itcm", 0, 0),
+        (0x20000000, 0x20080000, "dtcm", 0, 0),
+        (0x20200000, 0x20280000, "ocram", 0, 24),
+        (0x40000000, 0x60000000, "periph", 12, 12),
+        (0x60000000, 0x70000000, "flash", 0, 100),
+        (0x70000000, 0x80000000, "extmem", 0, 200),
+    ),
+    "cortex-m4": (  # Kinetis K20/K64/K66, Teensy 3.x
+        (0x00000000, 0x10000000, "flash", 0, 4),
+        (0x14000000, 0x14004000, "flexram", 1, 1),
+        (0x1FFF0000, 0x20000000, "sram_l", 0, 0),
+        (0x20000000, 0x20040000, "sram_u", 0, 0),
+        (0x40000000, 0x60000000, "periph", 2, 2),
+        (0xE0000000, 0xE0100000, "ppb", 0, 0),
+    ),
+}
+LINE_SIZE = {"cortex-m7": 32, "cortex-m4": 16}
+
+_ISR_RE = re.compile(r"(?:^|_|::)isr\d*$|_isr_|IRQHandler$|_handler$|^(?:SysTick|PendSV)_Handler$")
+
+
+class CyclesError(Exception):
+    pass
+
+
+class Instruction(object):
+    __slots__ = ("addr", "mnemonic", "operands", "comment", "name", "cls", "conditional",
+                 "registers")
+
+    def __init__(self, addr, mnemonic, operands, comment):
+        self.addr = addr
+        self.mnemonic = mnemonic
+        self.operands = operands
+        self.comment = comment
+        self.name, self.cls, self.conditional = classify(mnemonic)
+        self.registers = [_ALIASES.get(r, r) for r in _REGISTER_RE.findall(operands)]
+
+    @property
+    def target(self):
+        """Branch target address or None."""
+        match = _TARGET_RE.search(self.operands)
+        return int(match.group(1), 16) if match else None
+
+    @property
+    def register_list(self):
+        """Registers in {...}, ranges like {d8-d15} expanded."""
+        start, end = self.operands.find("{"), self.operands.find("}")
+        if start < 0 or end < start:
+            return []
+        result = []
+        for item in self.operands[start + 1:end].split(","):
+            first, _, last = item.strip().partition("-")
+            if last and first[:1] == last[:1] and first[1:].isdigit() and last[1:].isdigit():
+                result.extend("%s%d" % (first[0], n) for n in range(int(first[1:]), int(last[1:]) + 1))
+            elif first:
+                result.append(_ALIASES.get(first, first))
+        return result
+
+    @property
+    def returns(self):
+        return (self.cls == "bx"
+                or self.cls == "load" and self.registers[:1] == ["pc"]
+                or self.cls == "ldm" and "pc" in self.register_list)
+
+
+def classify(mnemonic):
+    """Returns (base mnemonic, instruction class, conditional)."""
+    name = mnemonic.lower().split(".", 1)[0]
+    if _IT_RE.match(name):
+        return name, "it", False
+    candidates = [(name, False)]
+    if name[-2:] in _CONDITIONS:
+        candidates.append((name[:-2], True))
+    if name.endswith("s"):
+        candidates.append((name[:-1], False))
+    if name[-2:] in _CONDITIONS and name[-3:-2] == "s":
+        candidates.append((name[:-3], True))
+    for candidate, conditional in candidates:
+        if candidate in _CLASSES:
+            return candidate, _CLASSES[candidate], conditional or candidate in ("cbz", "cbnz")
+    return name, "alu", False
+
+
+def disassemble(firmware, objdump, sysenv=None):
+    try:
+        proc = subprocess.run(
+            [objdump, "-d", "-C", "--no-show-raw-insn", firmware], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True, env=sysenv)
+    except OSError as exc:
+        raise CyclesError("cannot run %s: %s" % (objdump, exc))
+    if proc.returncode != 0:
+        raise CyclesError("%s failed: %s" % (objdump, proc.stderr.strip()))
+    return proc.stdout
+
+
+def parse_objdump(text):
+    """Returns [(name, address, [Instruction])] for all functions."""
+    functions = []
+    current = None
+    for line in text.splitlines():
+        match = _FUNCTION_RE.match(line)
+        if match:
+            current = (match.group(2), int(match.group(1), 16), [])
+            functions.append(current)
+            continue
+        if current is None:
+            continue
+        match = _INSN_RE.match(line)
+        # literal pools are shown as .word/.short data
+        if not match or match.group(2).startswith("."):
+            continue
+        current[2].append(Instruction(
+            int(match.group(1), 16), match.group(2), match.group(3) or "", match.group(4) or ""))
+    return [f for f in functions if f[2]]
+
+
+class Model(object):
+    """Instruction timings and memory map of one core."""
+
+    def __init__(self, cpu, firmware=None):
+        if cpu not in TIMINGS:
+            raise CyclesError("no timing model for %s, supported: %s" % (
+                cpu, ", ".join(sorted(TIMINGS))))
+        self.cpu = cpu
+        self.timing = TIMINGS[cpu]
+        self.regions = REGIONS[cpu]
+        self.line_size = LINE_SIZE[cpu]
+        self.firmware = firmware
+
+    def region(self, addr):
+        for start, end, name, warm, cold in self.regions:
+            if start <= addr < end:
+                return name, warm, cold
+        return None, 0, 0
+
+    def word(self, addr):
+        if self.firmware is None:
+            return None
+        data = self.firmware.read(addr, 4)
+        return int.from_bytes(data, "little") if data and len(data) == 4 else None
+
+    def instruction_cost(self, insn):
+        t = self.timing
+        cls = insn.cls
+        if cls in ("ldm", "stm", "fpldm", "fpstm"):
+            registers = insn.register_list
+            # double precision registers are transferred as two words
+            count = sum(2 if r.startswith("d") else 1 for r in registers)
+            cost = t[cls] + count * t["per_register"]
+            if cls == "ldm" and "pc" in registers:
+                cost += t["bx"]
+            return cost
+        if cls in ("fp", "fpdiv") and ".f64" in insn.mnemonic:
+            key = "fp64" if cls == "fp" else "fpdiv64"
+            return t[key] if t[key] is not None else t[cls]
+        if cls == "load" and "pc" in insn.registers[:1]:
+            return t["load"] + t["bx"]
+        return t[cls]
+
+    def block_costs(self, instructions):
+        """(warm, cold) cycles of a straight instruction sequence."""
+        t = self.timing
+        warm = 0.0
+        memory = 0
+        constants = {}
+        previous = None  # (class, destination) of an instruction that can pair
+        previous_load = False
+        for insn in instructions:
+            cost = self.instruction_cost(insn)
+            registers = insn.registers
+            destination = registers[0] if registers and insn.cls not in (
+                "store", "store2", "stm", "compare", "branch", "bx", "fpstore", "fpstm") else None
+            address = self._access_address(insn, constants)
+            if address is not None:
+                _, penalty_warm, penalty_cold = self.region(address)
+                warm += penalty_warm
+                memory += penalty_cold - penalty_warm
+            # Cortex-M4: LDR after LDR overlaps the address phase
+            if t["pipelined_loads"] and insn.cls == "load" and previous_load:
+                cost -= 1
+            previous_load = insn.cls == "load"
+            # Cortex-M7: two independent simple instructions issue together
+            if t["dual_issue"] and previous is not None and cost == 1 and not (
+                    previous[0] in ("load", "store", "fpload", "fpstore")
+                    and insn.cls in ("load", "store", "fpload", "fpstore")) and (
+                    previous[1] is None or previous[1] not in registers):
+                cost = 0
+                previous = None
+            elif cost == 1 and insn.cls not in ("branch", "bx", "call", "table"):
+                previous = (insn.cls, destination)
+            else:
+                previous = None
+            warm += cost
+            self._track_constants(insn, constants, registers, destination)
+        return warm, warm + memory
+
+    def _access_address(self, insn, constants):
+        if insn.cls not in ("load", "load2", "store", "store2", "fpload", "fpstore"):
+            return None
+        match = re.search(r"\[(\w+)(?:,\s*#(-?\d+))?\]", insn.operands)
+        if not match:
+            return None
+        base = _ALIASES.get(match.group(1), match.group(1))
+        if base == "pc":
+            addr = _COMMENT_ADDR_RE.search(insn.comment)
+            return int(addr.group(1), 16) if addr else None
+        if base in constants:
+            return (constants[base] + int(match.group(2) or 0)) & 0xFFFFFFFF
+        return None
+
+    def _track_constants(self, insn, constants, registers, destination):
+        if insn.cls == "call":
+            for reg in ("r0", "r1", "r2", "r3", "r12", "lr"):
+                constants.pop(reg, None)
+            return
+        if destination is None:
+            return
+        immediate = _IMMEDIATE_RE.search(insn.operands)
+        value = None
+        if insn.name == "ldr" and "[pc" in insn.operands:
+            addr = self._access_address(insn, {})
+            value = self.word(addr) if addr is not None else None
+        elif insn.name in ("mov", "movw") and immediate and len(registers) == 1:
+            value = int(immediate.group(1), 0) & 0xFFFFFFFF
+        elif insn.name == "movt" and immediate and destination in constants:
+            value = (constants[destination] & 0xFFFF) | (int(immediate.group(1), 0) << 16)
+        if value is None:
+            constants.pop(destination, None)
+        else:
+            constants[destination] = value
+
+    def code_lines(self, instructions, previous=None):
+        """Cache lines of a block, without the line it shares with the block before it."""
+        lines = set(insn.addr // self.line_size for insn in instructions)
+        if previous:
+            lines.discard(previous[-1].addr // self.line_size)
+        return len(lines)
+
+    def analyze_function(self, name, addr, instructions):
+        t = self.timing
+        end = instructions[-1].addr
+        leaders = {instructions[0].addr}
+        for i, insn in enumerate(instructions):
+            if insn.cls in ("branch", "table") or insn.returns:
+                if i + 1 < len(instructions):
+                    leaders.add(instructions[i + 1].addr)
+                target = insn.target if insn.cls == "branch" else None
+                if target is not None and addr <= target <= end:
+                    leaders.add(target)
+        blocks = []
+        for insn in instructions:
+            if insn.addr in leaders or not blocks:
+                blocks.append([])
+            blocks[-1].append(insn)
+        index = {block[0].addr: i for i, block in enumerate(blocks)}
+
+        region_name, _, fetch_penalty = self.region(addr)
+        costs = []
+        edges = []
+        for i, block in enumerate(blocks):
+            warm, cold = self.block_costs(block)
+            cold += self.code_lines(block, blocks[i - 1] if i else None) * fetch_penalty
+            costs.append((warm, cold))
+            last = block[-1]
+            successors = []
+            returns = last.returns
+            if last.cls == "branch":
+                target = last.target
+                if target in index:
+                    successors.append((index[target], t["taken"]))
+                # a branch out of the function is a tail call
+                else:
+                    returns = True
+            elif last.cls == "table":
+                successors.extend((j, t["taken"]) for j in range(i + 1, len(blocks)))
+            falls_through = last.conditional or (last.cls not in ("branch", "table") and not returns)
+            if falls_through and i + 1 < len(blocks):
+                successors.append((i + 1, 0))
+            edges.append((successors, returns))
+
+        result = dict(
+            addr=addr, region=region_name, isr=bool(_ISR_RE.search(name.split("(")[0])),
+            blocks=[[b[0].addr, len(b), round(c[0], 1), round(c[1], 1)] for b, c in zip(blocks, costs)])
+        for key, column in (("min", 0), ("cold_min", 1)):
+            result[key] = _shortest_path(costs, edges, column)
+        for key, column in (("max", 0), ("cold_max", 1)):
+            result[key] = _longest_path(costs, edges, column)
+        return result
+
+
+def _shortest_path(costs, edges, column):
+    """Cheapest entry to return path, None without a reachable return."""
+    best = {0: costs[0][column]}
+    queue = [(costs[0][column], 0)]
+    while queue:
+        cost, node = heapq.heappop(queue)
+        if cost > best.get(node, float("inf")):
+            continue
+        successors, returns = edges[node]
+        if returns:
+            return round(cost, 1)
+        for succ, penalty in successors:
+            new_cost = cost + penalty + costs[succ][column]
+            if new_cost < best.get(succ, float("inf")):
+                best[succ] = new_cost
+                heapq.heappush(queue, (new_cost, succ))
+    return None
+
+
+def _longest_path(costs, edges, column):
+    """Most expensive path from the entry without repeating a loop."""
+    # iterative DFS for a post order, edges to nodes on the stack are loops
+    order = []
+    state = {0: 1}
+    stack = [(0, iter(edges[0][0]))]
+    back_edges = set()
+    while stack:
+        node, successors = stack[-1]
+        for succ, _ in successors:
+            if state.get(succ) == 1:
+                back_edges.add((node, succ))
+            elif succ not in state:
+                state[succ] = 1
+                stack.append((succ, iter(edges[succ][0])))
+                break
+        else:
+            state[node] = 2
+            order.append(node)
+            stack.pop()
+    longest = {}
+    for node in order:
+        tail = 0.0
+        for succ, penalty in edges[node][0]:
+            if (node, succ) not in back_edges:
+                tail = max(tail, penalty + longest[succ])
+        longest[node] = costs[node][column] + tail
+    return round(longest[0], 1)
+
+
+def vector_handlers(firmware, count=256):
+    """Handler addresses from a vector table in flash (Teensy 3.x)."""
+    symbol = next((s for s in firmware.symbols if s.name == "_VectorsFlash"), None)
+    if symbol is None:
+        return set()
+    data = firmware.read(symbol.value, min(symbol.size or count * 4, count * 4)) or b""
+    return set(int.from_bytes(data[i:i + 4], "little") & ~1 for i in range(8, len(data) - 3, 4))
+
+
+def analyze(firmware_path, objdump, cpu, sysenv=None):
+    firmware = elf.ElfFile(firmware_path)
+    model = Model(cpu, firmware)
+    handlers = vector_handlers(firmware)
+    functions = {}
+    for name, addr, instructions in parse_objdump(disassemble(firmware_path, objdump, sysenv)):
+        result = model.analyze_function(name, addr, instructions)
+        result["isr"] = result["isr"] or addr in handlers
+        key = name if name not in functions else "%s@%x" % (name, addr)
+        functions[key] = result
+    return dict(format=REPORT_FORMAT, elf=elf.file_hash(firmware_path), cpu=cpu, functions=functions)
+
+
+def report_path(firmware):
+    return os.path.splitext(firmware)[0] + ".cycles.json"
+
+
+def previous_path(firmware):
+    return os.path.splitext(firmware)[0] + ".cycles.prev.json"
+
+
+def _load(path):
+    try:
+        with open(path) as fp:
+            report = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    return report if report.get("format") == REPORT_FORMAT else None
+
+
+def _save(path, report):
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as fp:
+        json.dump(report, fp, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def mark_isrs(report, isr_names):
+    """Flags the functions in `isr_names` as interrupt handlers."""
+    if report is None or not isr_names:
+        return report
+    for key, function in report["functions"].items():
+        if re.sub(r"@[0-9a-f]+$", "", key).split("(")[0] in isr_names:
+            function["isr"] = True
+    return report
+
+
+def get_report(firmware, objdump, cpu, sysenv=None, isr_names=()):
+    """Returns (report, previous report or None), analyzes only new firmware.
+
+    The cached reports do not depend on `isr_names`, the names are applied
+    to the returned copies.
+    """
+    path = report_path(firmware)
+    digest = elf.file_hash(firmware)
+    report = _load(path)
+    if report is not None and report["elf"] == digest and report["cpu"] == cpu:
+        return mark_isrs(report, isr_names), mark_isrs(_load(previous_path(firmware)), isr_names)
+    if report is not None:
+        os.replace(path, previous_path(firmware))
+    new_report = analyze(firmware, objdump, cpu, sysenv)
+    _save(path, new_report)
+    return mark_isrs(new_report, isr_names), mark_isrs(report, isr_names)
+
+
+def compare(previous, report, threshold=0.05, min_cycles=2):
+    """Functions whose `min` or `max` estimate grew, as (name, isr, key, old, new)."""
+    changes = []
+    if not previous or previous.get("cpu") != report.get("cpu"):
+        return changes
+    old_functions = previous["functions"]
+    for name, function in report["functions"].items():
+        old = old_functions.get(name)
+        if old is None:
+            continue
+        for key in ("max", "min"):
+            if old[key] is None or function[key] is None:
+                continue
+            growth = function[key] - old[key]
+            if growth >= min_cycles and growth > old[key] * threshold:
+                changes.append((name, function["isr"], key, old[key], function[key]))
+                break
+    changes.sort(key=lambda c: (not c[1], c[3] - c[4]))
+    return changes
+
+
+def _format_cycles(value):
+    return "-" if value is None else "%g" % value
+
+
+def format_report(report, top=20, isr_only=False):
+    functions = [(name, f) for name, f in report["functions"].items() if f["isr"] or not isr_only]
+    functions.sort(key=lambda item: -(item[1]["max"] or 0))
+    lines = ["%-40s %-7s %8s %8s %9s %9s %6s" % (
+        "Function (%s)" % report["cpu"], "Memory", "Min", "Max", "Cold min", "Cold max", "Blocks")]
+    for name, f in functions[:top] if top else functions:
+        lines.append("%-40s %-7s %8s %8s %9s %9s %6d" % (
+            (name if len(name) <= 40 else name[:37] + "...") + (" *" if f["isr"] else ""),
+            f["region"] or "?", _format_cycles(f["min"]), _format_cycles(f["max"]),
+            _format_cycles(f["cold_min"]), _format_cycles(f["cold_max"]), len(f["blocks"])))
+    return "\n".join(lines)
+
+
+def format_changes(changes, limit=10):
+    lines = []
+    for name, isr, key, old, new in changes[:limit]:
+        lines.append("%s %s: %s %g -> %g cycles (%+.0f%%)" % (
+            "ISR" if isr else "Function", name, key, old, new, 100.0 * (new - old) / old if old else 100))
+    return "\n".join(lines)
+
+
+def format_blocks(report, name):
+    function = report["functions"].get(name)
+    if function is None:
+        raise CyclesError("unknown function %s" % name)
+    lines = ["%-10s %6s %8s %8s" % ("Block", "Insns", "Warm", "Cold")]
+    for addr, count, warm, cold in function["blocks"]:
+        lines.append("%08x   %6d %8g %8g" % (addr, count, warm, cold))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estimate cycles per function and basic block")
+    parser.add_argument("firmware", help="ELF file")
+    parser.add_argument("--cpu", choices=sorted(TIMINGS), default="cortex-m7")
+    parser.add_argument("--objdump", default="arm-none-eabi-objdump")
+    parser.add_argument("--top", type=int, default=30, help="0 lists all functions")
+    parser.add_argument("--isr", action="store_true", help="only interrupt handlers")
+    parser.add_argument("--function", help="list the basic blocks of a function")
+    parser.add_argument("--threshold", type=float, default=5.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+    try:
+        report, previous = get_report(args.firmware, args.objdump, args.cpu)
+        if args.function:
+            print(format_blocks(report, args.function))
+            return 0
+    except (CyclesError, elf.ElfError, OSError) as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        return 1
+    print(format_report(report, args.top, args.isr))
+    changes = compare(previous, report, args.threshold / 100.0)
+    if changes:
+        print("\nChanges since the previous build:")
+        print(format_changes(changes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,461 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Distributed compilation for the Teensy toolchains
+
+`compile` wraps a compiler invocation: the source is preprocessed locally
+and the preprocessed unit is compiled by one of the workers listed in
+TEENSY_DISTCC_HOSTS (`host:port,host:port`). Whenever no worker is
+reachable, the worker has a different toolchain build or the command line
+is not a plain single-source compile, the original command runs locally.
+
+`serve` starts a worker, by default on 127.0.0.1 only. Requests and
+responses carry an HMAC of their content with a shared token
+(TEENSY_DISTCC_TOKEN), and a worker only accepts compiler options from an
+allowlist, so clients cannot make it read or write files outside of its
+temporary directory.
+
+Messages are a 4-byte big-endian length, a JSON header and `size` bytes of
+payload. The script has no dependencies besides the standard library so
+SCons can run it directly.
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import re
+import os
+import random
+import shutil
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+PROTOCOL_VERSION = 2
+DEFAULT_PORT = 3632
+CONNECT_TIMEOUT = 3
+COMPILE_TIMEOUT = 600
+
+ALLOWED_PREFIXES = ("arm-cortexm7f-eabi-", "arm-cortexm4f-eabi-", "avr-")
+ALLOWED_DRIVERS = ("gcc", "g++", "c++", "cc")
+SOURCE_LANGUAGES = {
+    ".c": "cpp-output",
+    ".cc": "c++-cpp-output",
+    ".cpp": "c++-cpp-output",
+    ".cxx": "c++-cpp-output",
+}
+# preprocessor options and the number of values they take
+PREPROCESSOR_OPTIONS = {
+    "-D": 1, "-U": 1, "-I": 1, "-include": 1, "-imacros": 1, "-isystem": 1,
+    "-iquote": 1, "-idirafter": 1, "-MF": 1, "-MT": 1, "-MQ": 1,
+    "-MD": 0, "-MMD": 0, "-MP": 0,
+}
+# code generation and diagnostic options a worker runs, none of them names a file
+ALLOWED_OPTION_RE = re.compile(
+    r"^(?:-O(?:[0-3sgz]|fast)?|-g[a-z0-9-]*|-w|-W[a-z][a-z0-9+-]*(?:=[a-z0-9-]+)?"
+    r"|-m[a-z0-9][a-z0-9=.+-]*|-f[a-z0-9][a-z0-9+-]*(?:=[a-z0-9_.+-]+)?|-std=[a-z0-9+]+"
+    r"|-pedantic(?:-errors)?|-ansi|-nostdinc(?:\+\+)?|-nostdlib|--param=[a-z0-9-]+=\d+)$")
+# -f options that load or write files
+FORBIDDEN_OPTIONS = ("-fplugin", "-fprofile", "-fauto-profile", "-fdump")
+# driver options only used for preprocessing and linking (nano.specs adds the
+# newlib-nano include directory), kept for the local step only
+LOCAL_OPTIONS = ("--specs=",)
+
+_identity_lock = threading.Lock()
+_identities = {}
+
+
+def log(message):
+    if os.environ.get("TEENSY_DISTCC_VERBOSE"):
+        sys.stderr.write("distcc: %s\n" % message)
+
+
+def send_message(sock, header, payload=b""):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(sock):
+    (length,) = struct.unpack(">I", _recv_exact(sock, 4))
+    header = json.loads(_recv_exact(sock, length).decode("utf-8"))
+    return header, _recv_exact(sock, header.get("size", 0))
+
+
+def is_allowed_option(arg):
+    return bool(ALLOWED_OPTION_RE.match(arg)) and not arg.startswith(FORBIDDEN_OPTIONS)
+
+
+def request_digest(token, header, payload):
+    message = json.dumps([header.get(key) for key in ("compiler", "identity", "args", "language")])
+    return hmac.new(token.encode("utf-8"), message.encode("utf-8") + hashlib.sha256(payload).digest(),
+                    hashlib.sha256).hexdigest()
+
+
+def response_digest(token, header, payload):
+    message = json.dumps([header.get(key) for key in ("status", "returncode", "stderr", "files")])
+    return hmac.new(token.encode("utf-8"), message.encode("utf-8") + hashlib.sha256(payload).digest(),
+                    hashlib.sha256).hexdigest()
+
+
+def toolchain_identity(compiler, sysenv=None):
+    """Hash of target triple, version and the compiler proper (cc1/cc1plus)."""
+    with _identity_lock:
+        if compiler in _identities:
+            return _identities[compiler]
+    digest = hashlib.sha256()
+    try:
+        for args in (["-dumpmachine"], ["-dumpfullversion"]):
+            digest.update(subprocess.check_output(
+                [compiler] + args, env=sysenv, stderr=subprocess.DEVNULL))
+        for prog in ("cc1", "cc1plus"):
+            path = subprocess.check_output(
+                [compiler, "-print-prog-name=%s" % prog], env=sysenv,
+                stderr=subprocess.DEVNULL).decode().strip()
+            if os.path.isfile(path):
+                with open(path, "rb") as fp:
+                    for chunk in iter(lambda: fp.read(1 << 20), b""):
+                        digest.update(chunk)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    identity = digest.hexdigest()
+    with _identity_lock:
+        _identities[compiler] = identity
+    return identity
+
+
+def cached_toolchain_identity(compiler, cache_dir):
+    """Client side identity, cached on disk since every compile is a new process."""
+    path = shutil.which(compiler)
+    if not path:
+        return None
+    stat = os.stat(path)
+    key = hashlib.sha1(("%s|%d|%d" % (path, stat.st_mtime, stat.st_size)).encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, "toolchain-%s" % key)
+    if os.path.isfile(cache_path):
+        with open(cache_path) as fp:
+            return fp.read().strip()
+    identity = toolchain_identity(compiler)
+    if identity:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w") as fp:
+            fp.write(identity)
+    return identity
+
+
+def is_allowed_compiler(compiler):
+    name = os.path.basename(compiler)
+    return name.startswith(ALLOWED_PREFIXES) and name.endswith(ALLOWED_DRIVERS)
+
+
+def split_command(args):
+    """Split a compiler command line for remote compilation.
+
+    Returns (remote args, source, output) or None when the command is not a
+    single-source compile of a C/C++ file.
+    """
+    if "-c" not in args or "-E" in args or "-S" in args:
+        return None
+    remote = []
+    sources = []
+    output = None
+    index = 1
+    while index < len(args):
+        arg = args[index]
+        if arg == "-o" and index + 1 < len(args):
+            output = args[index + 1]
+            index += 2
+            continue
+        if arg in PREPROCESSOR_OPTIONS:
+            index += 1 + PREPROCESSOR_OPTIONS[arg]
+            continue
+        if arg.startswith(("-D", "-U", "-I", "-MF", "-MT", "-MQ")):
+            index += 1
+            continue
+        if arg.startswith("-x"):
+            return None  # explicit language, keep it local
+        if arg.startswith(LOCAL_OPTIONS):
+            index += 1
+            continue
+        if arg == "-c":
+            index += 1
+            continue
+        if not arg.startswith("-"):
+            sources.append(arg)
+        else:
+            if not is_allowed_option(arg):
+                return None
+            remote.append(arg)
+        index += 1
+    if len(sources) != 1 or not output:
+        return None
+    if os.path.splitext(sources[0])[1] not in SOURCE_LANGUAGES:
+        return None
+    return remote, sources[0], output
+
+
+def preprocess_command(args, output, preprocessed):
+    result = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg == "-o":
+            index += 2
+            continue
+        result.append("-E" if arg == "-c" else arg)
+        index += 1
+    result += ["-o", preprocessed]
+    if ("-MMD" in args or "-MD" in args) and "-MF" not in args:
+        # keep the dependency file where a regular compile would put it
+        result += ["-MF", os.path.splitext(output)[0] + ".d", "-MT", output]
+    return result
+
+
+def parse_hosts(value):
+    hosts = []
+    for item in (value or "").replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":")
+        if not host:
+            host, port = item, DEFAULT_PORT
+        hosts.append((host, int(port)))
+    return hosts
+
+
+def remote_compile(host, token, compiler, identity, remote_args, language, source_data):
+    request = dict(
+        version=PROTOCOL_VERSION, op="compile", compiler=os.path.basename(compiler),
+        identity=identity, args=remote_args, language=language)
+    request["auth"] = request_digest(token, request, source_data)
+    with socket.create_connection(host, timeout=CONNECT_TIMEOUT) as sock:
+        sock.settimeout(COMPILE_TIMEOUT)
+        send_message(sock, request, source_data)
+        header, payload = recv_message(sock)
+    if header.get("status") == "ok" and not hmac.compare_digest(
+            str(header.get("auth", "")), response_digest(token, header, payload)):
+        header = dict(status="unauthenticated response")
+    return header, payload
+
+
+def run_local(args):
+    return subprocess.call(args)
+
+
+def client_compile(args, hosts, cache_dir, token):
+    compiler = args[0]
+    split = split_command(args)
+    if not hosts or not token or split is None or not is_allowed_compiler(compiler):
+        return run_local(args)
+    remote_args, source, output = split
+    identity = cached_toolchain_identity(compiler, cache_dir)
+    if not identity:
+        return run_local(args)
+
+    language = SOURCE_LANGUAGES[os.path.splitext(source)[1]]
+    tmp_dir = tempfile.mkdtemp(prefix="teensy-distcc-")
+    try:
+        preprocessed = os.path.join(
+            tmp_dir, "unit" + (".ii" if language.startswith("c++") else ".i"))
+        returncode = subprocess.call(preprocess_command(args, output, preprocessed))
+        if returncode != 0:
+            return returncode
+        with open(preprocessed, "rb") as fp:
+            source_data = fp.read()
+
+        candidates = list(hosts)
+        random.shuffle(candidates)
+        for host in candidates:
+            try:
+                header, payload = remote_compile(
+                    host, token, compiler, identity, remote_args, language, source_data)
+            except (OSError, ValueError) as exc:
+                log("%s:%d unavailable (%s)" % (host[0], host[1], exc))
+                continue
+            if header.get("status") == "identity":
+                log("%s:%d has a different toolchain build" % host)
+                continue
+            if header.get("status") != "ok":
+                log("%s:%d failed: %s" % (host[0], host[1], header.get("status")))
+                continue
+            sys.stderr.write(header.get("stderr", ""))
+            if header.get("returncode", 1) != 0:
+                return header["returncode"]
+            write_outputs(output, header, payload)
+            return 0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    log("compiling %s locally" % source)
+    return run_local(args)
+
+
+def write_outputs(output, header, payload):
+    offset = 0
+    base = os.path.splitext(output)[0]
+    for name, size in header["files"]:
+        data = payload[offset:offset + size]
+        offset += size
+        ext = name[len("unit"):] if name.startswith("unit") else os.path.splitext(name)[1]
+        path = output if ext == ".o" else base + ext
+        with open(path, "wb") as fp:
+            fp.write(data)
+
+
+def find_compiler(name, search_path):
+    if not is_allowed_compiler(name) or os.path.basename(name) != name:
+        return None
+    return shutil.which(name, path=search_path)
+
+
+class CompileHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            header, payload = recv_message(self.request)
+        except (OSError, ValueError):
+            return
+        if header.get("version") != PROTOCOL_VERSION or header.get("op") != "compile":
+            send_message(self.request, dict(status="protocol"))
+            return
+        server = self.server
+        if not hmac.compare_digest(
+                str(header.get("auth", "")), request_digest(server.token, header, payload)):
+            send_message(self.request, dict(status="auth"))
+            return
+        compiler = find_compiler(header.get("compiler", ""), server.search_path)
+        args = header.get("args")
+        if not compiler or not isinstance(args, list) or header.get("language") not in \
+                SOURCE_LANGUAGES.values() or not all(
+                    isinstance(arg, str) and is_allowed_option(arg) for arg in args):
+            send_message(self.request, dict(status="compiler"))
+            return
+        if toolchain_identity(compiler, server.sysenv) != header.get("identity"):
+            send_message(self.request, dict(status="identity"))
+            return
+        with server.slots:
+            response, data = self.compile(compiler, header, payload)
+        response["auth"] = response_digest(server.token, response, data)
+        send_message(self.request, response, data)
+
+    def compile(self, compiler, header, source_data):
+        tmp_dir = tempfile.mkdtemp(prefix="teensy-distcc-worker-")
+        try:
+            source = os.path.join(
+                tmp_dir, "unit.ii" if header["language"].startswith("c++") else "unit.i")
+            with open(source, "wb") as fp:
+                fp.write(source_data)
+            output = os.path.join(tmp_dir, "unit.o")
+            proc = subprocess.run(
+                [compiler] + header["args"] + ["-x", header["language"], "-c", source,
+                                               "-o", output],
+                cwd=tmp_dir, env=self.server.sysenv, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, timeout=COMPILE_TIMEOUT)
+            files = []
+            data = []
+            if proc.returncode == 0:
+                for name in sorted(os.listdir(tmp_dir)):
+                    path = os.path.join(tmp_dir, name)
+                    if path == source:
+                        continue
+                    with open(path, "rb") as fp:
+                        content = fp.read()
+                    files.append((name, len(content)))
+                    data.append(content)
+            return dict(status="ok", returncode=proc.returncode,
+                        stderr=proc.stderr.decode("utf-8", "replace"),
+                        files=files), b"".join(data)
+        except subprocess.TimeoutExpired:
+            return dict(status="timeout"), b""
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, jobs, token, search_path=None):
+        socketserver.TCPServer.__init__(self, address, CompileHandler)
+        self.token = token
+        self.slots = threading.BoundedSemaphore(jobs)
+        self.search_path = search_path or os.environ.get("PATH", "")
+        self.sysenv = dict(os.environ, PATH=self.search_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed Teensy compilation")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="run a compile worker")
+    serve.add_argument("--bind", default="127.0.0.1",
+                       help="address to listen on, e.g. 0.0.0.0 for all interfaces")
+    serve.add_argument("--token", default=os.environ.get("TEENSY_DISTCC_TOKEN", ""),
+                       help="shared secret of workers and clients (default TEENSY_DISTCC_TOKEN)")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    serve.add_argument("--toolchain", action="append", default=[],
+                       help="toolchain bin directory, may be repeated")
+    compile_ = commands.add_parser("compile", help="compile through the workers")
+    compile_.add_argument("--cache-dir", default=os.path.join(
+        tempfile.gettempdir(), "teensy-distcc"))
+    compile_.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        if not args.token:
+            parser.error("a shared token is required, pass --token or set TEENSY_DISTCC_TOKEN")
+        search_path = os.pathsep.join(
+            args.toolchain + [os.environ.get("PATH", "")])
+        server = WorkerServer((args.bind, args.port), args.jobs, args.token, search_path)
+        print("Compile worker listening on %s:%d with %d jobs" % (
+            args.bind, args.port, args.jobs))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.command == "compile":
+        command = args.args[1:] if args.args[:1] == ["--"] else args.args
+        if not command:
+            parser.error("missing compiler command")
+        hosts = parse_hosts(os.environ.get("TEENSY_DISTCC_HOSTS"))
+        token = os.environ.get("TEENSY_DISTCC_TOKEN", "")
+        if hosts and not token:
+            log("TEENSY_DISTCC_TOKEN is not set, compiling locally")
+        return client_compile(command, hosts, args.cache_dir, token)
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
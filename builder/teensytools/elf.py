@@ -0,0 +1,282 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Minimal ELF reader
+
+Reads section headers, program headers and the symbol table of 32-bit and
+64-bit little-endian ELF files without requiring a toolchain.
+"""
+
+import hashlib
+import struct
+import subprocess
+from collections import namedtuple
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+PT_LOAD = 1
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_FILE = 4
+STB_LOCAL = 0
+STB_GLOBAL = 1
+ATTR_FILE = 1
+TAG_FP_ARCH = 10
+TAG_ABI_HARDFP_USE = 27
+TAG_ABI_VFP_ARGS = 28
+
+Section = namedtuple(
+    "Section", "index name type flags addr offset size link info lma")
+Segment = namedtuple(
+    "Segment", "type offset vaddr paddr filesz memsz flags")
+Symbol = namedtuple(
+    "Symbol", "name value size type bind section file")
+
+
+class ElfError(Exception):
+    pass
+
+
+class ElfFile(object):
+
+    def __init__(self, path, data=None):
+        self.path = path
+        if data is None:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        self.data = data
+        if self.data[:4] != b"\x7fELF":
+            raise ElfError("%s is not an ELF file" % path)
+        if self.data[5] != 1:
+            raise ElfError("%s: only little-endian ELF files are supported" % path)
+        self.is64 = self.data[4] == 2
+        self._symbols = None
+        self._parse_headers()
+
+    def _parse_headers(self):
+        if self.is64:
+            fmt_hdr, fmt_sh, fmt_ph = "<HHIQQQIHHHHHH", "<IIQQQQIIQQ", "<IIQQQQQQ"
+        else:
+            fmt_hdr, fmt_sh, fmt_ph = "<HHIIIIIHHHHHH", "<IIIIIIIIII", "<IIIIIIII"
+        (_, self.machine, _, self.entry, phoff, shoff, _, _, phentsize, phnum,
+         shentsize, shnum, shstrndx) = struct.unpack_from(fmt_hdr, self.data, 16)
+
+        self.segments = []
+        for i in range(phnum):
+            fields = struct.unpack_from(fmt_ph, self.data, phoff + i * phentsize)
+            if self.is64:
+                p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, _ = fields
+            else:
+                p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, _ = fields
+            self.segments.append(
+                Segment(p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags))
+
+        raw = [struct.unpack_from(fmt_sh, self.data, shoff + i * shentsize)
+               for i in range(shnum)]
+        strtab = raw[shstrndx] if shnum else None
+        self.sections = []
+        for index, (name, sh_type, flags, addr, offset, size, link, info, _, _) \
+                in enumerate(raw):
+            name = self._string(strtab[4], name) if strtab else ""
+            self.sections.append(Section(
+                index, name, sh_type, flags, addr, offset, size, link, info,
+                self._load_address(sh_type, flags, addr, offset)))
+
+    def _load_address(self, sh_type, flags, addr, offset):
+        if not flags & SHF_ALLOC or sh_type == SHT_NOBITS:
+            return addr
+        for seg in self.segments:
+            if seg.type != PT_LOAD or not seg.filesz:
+                continue
+            if seg.offset <= offset < seg.offset + seg.filesz:
+                return seg.paddr + (offset - seg.offset)
+        return addr
+
+    def _string(self, table_offset, index):
+        end = self.data.index(b"\x00", table_offset + index)
+        return self.data[table_offset + index:end].decode("utf-8", "replace")
+
+    def section(self, name):
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def section_at(self, addr):
+        for section in self.sections:
+            if (section.flags & SHF_ALLOC and section.size
+                    and section.addr <= addr < section.addr + section.size):
+                return section
+        return None
+
+    def read_section(self, section):
+        if isinstance(section, str):
+            section = self.section(section)
+        if section is None or section.type == SHT_NOBITS:
+            return b""
+        return self.data[section.offset:section.offset + section.size]
+
+    def read(self, addr, size):
+        section = self.section_at(addr)
+        if section is None or section.type == SHT_NOBITS:
+            return None
+        start = section.offset + addr - section.addr
+        return self.data[start:start + size]
+
+    @property
+    def symbols(self):
+        if self._symbols is None:
+            self._symbols = self._parse_symbols()
+        return self._symbols
+
+    def _parse_symbols(self):
+        symtab = next((s for s in self.sections if s.type == SHT_SYMTAB), None)
+        if symtab is None:
+            return []
+        strtab = self.sections[symtab.link]
+        fmt = "<IBBHQQ" if self.is64 else "<IIIBBH"
+        entsize = struct.calcsize(fmt)
+        result = []
+        current_file = None
+        for offset in range(symtab.offset, symtab.offset + symtab.size, entsize):
+            fields = struct.unpack_from(fmt, self.data, offset)
+            if self.is64:
+                name, info, _, shndx, value, size = fields
+            else:
+                name, value, size, info, _, shndx = fields
+            sym_type, bind = info & 0xF, info >> 4
+            name = self._string(strtab.offset, name) if name else ""
+            if sym_type == STT_FILE:
+                current_file = name
+                continue
+            section = (self.sections[shndx].name
+                       if 0 < shndx < len(self.sections) else None)
+            result.append(Symbol(
+                name, value, size, sym_type, bind, section,
+                current_file if bind == STB_LOCAL else None))
+        return result
+
+    def functions(self):
+        """Sized function symbols with the Thumb bit cleared, sorted by address."""
+        seen = set()
+        result = []
+        for sym in self.symbols:
+            if sym.type != STT_FUNC or not sym.size or not sym.name:
+                continue
+            addr = sym.value & ~1
+            if (addr, sym.name) in seen:
+                continue
+            seen.add((addr, sym.name))
+            result.append(sym._replace(value=addr))
+        result.sort(key=lambda s: (s.value, -s.size))
+        return result
+
+
+def _uleb128(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def arm_attributes(firmware):
+    """Returns the file-scope "aeabi" build attributes as {tag: value}."""
+    data = firmware.read_section(".ARM.attributes")
+    attributes = {}
+    if data[:1] != b"A":
+        return attributes
+    pos = 1
+    while pos + 4 <= len(data):
+        length = struct.unpack_from("<I", data, pos)[0]
+        end = pos + length
+        vendor_end = data.index(b"\x00", pos + 4)
+        vendor = data[pos + 4:vendor_end]
+        pos = vendor_end + 1
+        while vendor == b"aeabi" and pos < end:
+            tag, sub_pos = _uleb128(data, pos)
+            sub_end = pos + struct.unpack_from("<I", data, sub_pos)[0]
+            pos = sub_pos + 4
+            while tag == ATTR_FILE and pos < sub_end:
+                attr, pos = _uleb128(data, pos)
+                if attr == 32:  # Tag_compatibility: ULEB128 followed by a string
+                    _, pos = _uleb128(data, pos)
+                if attr in (4, 5, 32, 67) or (attr > 32 and attr & 1):
+                    value_end = data.index(b"\x00", pos)
+                    attributes[attr] = data[pos:value_end].decode("ascii", "replace")
+                    pos = value_end + 1
+                else:
+                    attributes[attr], pos = _uleb128(data, pos)
+            pos = sub_end
+        pos = end
+    return attributes
+
+
+def read_archive(path):
+    """Yields (member name, data) for all members of an `ar` archive."""
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data[:8] != b"!<arch>\n":
+        raise ElfError("%s is not an archive" % path)
+    long_names = b""
+    pos = 8
+    while pos + 60 <= len(data):
+        header = data[pos:pos + 60]
+        name = header[:16].decode("ascii", "replace").rstrip()
+        size = int(header[48:58].decode("ascii").strip() or 0)
+        body = data[pos + 60:pos + 60 + size]
+        pos += 60 + size + (size & 1)
+        if name == "//":
+            long_names = body
+            continue
+        if name in ("/", "/SYM64/"):
+            continue
+        if name.startswith("/") and name[1:].isdigit():
+            start = int(name[1:])
+            name = long_names[start:long_names.index(b"\n", start)].decode(
+                "utf-8", "replace")
+        yield name.rstrip("/"), body
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def demangle(names, tool, sysenv=None):
+    """Demangle names with a single c++filt process, returns a name -> text map."""
+    names = [n for n in set(names) if n.startswith("_Z")]
+    if not names or not tool:
+        return {}
+    try:
+        proc = subprocess.run(
+            [tool], input="\n".join(names) + "\n", stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True, env=sysenv,
+            check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return {}
+    lines = proc.stdout.splitlines()
+    if len(lines) != len(names):
+        return {}
+    return dict(zip(names, lines))
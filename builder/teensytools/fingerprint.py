@@ -0,0 +1,103 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Whole-build fingerprint for the no-op fast path
+
+The platform computes a digest over the build inputs (project files and
+directories, environment options, board manifest, package versions) before
+starting SCons and passes it in TEENSY_BUILD_FINGERPRINT. After a successful
+build, `builder/main.py` stores it in `noop_fingerprint.json` together with
+the size and mtime of the outputs. If the digest and the outputs still match
+on the next run, SCons is not started at all. The effective compiler flags
+are derived from these inputs; their digest is stored for reference.
+"""
+
+import hashlib
+import json
+import os
+
+ENV_VAR = "TEENSY_BUILD_FINGERPRINT"
+STATE_FILE = "noop_fingerprint.json"
+STATE_FORMAT = 1
+
+# targets that are complete when the firmware is up to date
+BUILD_TARGETS = ("buildprog", "checkprogsize", "size", "upload")
+
+
+def _update_path(digest, path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        digest.update(("%s:missing\n" % path).encode())
+        return
+    if not os.path.isdir(path):
+        digest.update(("%s:%d:%d\n" % (path, stat.st_size, stat.st_mtime_ns)).encode())
+        return
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        # directory mtimes catch deleted and renamed files
+        digest.update(("%s:%d\n" % (root, os.stat(root).st_mtime_ns)).encode())
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            digest.update(("%s:%d:%d\n" % (file_path, stat.st_size, stat.st_mtime_ns)).encode())
+
+
+def input_digest(paths, data):
+    """Digest of the files below `paths` and of the JSON-serializable `data`."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(data, sort_keys=True, default=str).encode())
+    for path in paths:
+        _update_path(digest, os.path.abspath(path))
+    return digest.hexdigest()
+
+
+def _output_state(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save(build_dir, digest, flags_digest, outputs, size_report=None):
+    try:
+        state = dict(
+            format=STATE_FORMAT, inputs=digest, flags=flags_digest,
+            outputs={path: _output_state(path) for path in outputs},
+            size_report=size_report)
+        path = os.path.join(build_dir, STATE_FILE)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump(state, fp, indent=1)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def load_current(build_dir, digest):
+    """Returns the stored state if `digest` and all outputs still match."""
+    try:
+        with open(os.path.join(build_dir, STATE_FILE)) as fp:
+            state = json.load(fp)
+        if state.get("format") != STATE_FORMAT or state.get("inputs") != digest:
+            return None
+        for path, recorded in state["outputs"].items():
+            if _output_state(path) != recorded:
+                return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return state
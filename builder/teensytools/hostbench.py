@@ -0,0 +1,82 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Results of the host-native micro-benchmarks
+
+The runner in misc/host/core prints one line per benchmark:
+`BENCH <name> <ns per call> <items per second> <calls>`. Results are stored
+as JSON and compared against a baseline from an earlier run.
+"""
+
+import json
+import os
+
+DEFAULT_TOLERANCE = 0.15
+
+
+def parse_output(text):
+    results = {}
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) != 5 or parts[0] != "BENCH":
+            continue
+        try:
+            results[parts[1]] = dict(
+                ns_per_call=float(parts[2]), items_per_s=float(parts[3]), calls=int(parts[4]))
+        except ValueError:
+            continue
+    return results
+
+
+def save(path, results):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as fp:
+        json.dump(results, fp, indent=1, sort_keys=True)
+        fp.write("\n")
+
+
+def load(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns [(name, baseline ns, current ns)] of benchmarks slower than allowed."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        if result["ns_per_call"] > reference["ns_per_call"] * (1 + tolerance):
+            regressions.append((name, reference["ns_per_call"], result["ns_per_call"]))
+    return regressions
+
+
+def format_table(results, baseline=None):
+    baseline = baseline or {}
+    width = max([len(name) for name in results] + [9])
+    lines = ["%-*s %14s %16s %9s" % (width, "Benchmark", "ns/call", "items/s", "change")]
+    for name, result in sorted(results.items()):
+        change = ""
+        reference = baseline.get(name)
+        if reference and reference["ns_per_call"]:
+            change = "%+8.1f%%" % (
+                (result["ns_per_call"] / reference["ns_per_call"] - 1) * 100)
+        lines.append("%-*s %14.3f %16.4g %9s" % (
+            width, name, result["ns_per_call"], result["items_per_s"], change))
+    return "\n".join(lines)
@@ -0,0 +1,194 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""
+Pruned include search paths per translation unit
+
+With `-MMD`, GCC writes the headers of every object to a `.d` file next to
+it. After a build, the include directories containing at least one of these
+headers are stored per object, and the next compilation of that object only
+searches these directories, in the original order. A directory without any
+used header never resolved an `#include` of the unit, so leaving it out does
+not change which header is found.
+
+A unit gets the full search path again if
+  * its preprocessor state changed: the macros predefined by the compiler
+    and the command line (`-D`, `-std`, `-include`, ...), as reported by
+    `-dM -E`, since an `#if` may include other headers now,
+  * its include directories changed: the list, or the mtime of a directory
+    or of one of the subdirectories its headers were found in (`<sub/x.h>`)
+    when headers were added, moved or removed,
+  * one of its dependencies was modified or is gone,
+  * its last compilation failed, then the `.d` file does not describe it.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import threading
+
+CACHE_VERSION = 2
+
+
+def parse_depfile(path):
+    """Prerequisites of the first rule of a Makefile dependency file."""
+    with open(path, encoding="utf-8", errors="replace") as fp:
+        text = fp.read().replace("\\\r\n", " ").replace("\\\n", " ")
+    rule = text.split("\n", 1)[0]
+    tokens = []
+    current = ""
+    escaped = False
+    for char in rule:
+        if escaped:
+            current += char if char in " #:" else "\\" + char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in " \t":
+            if current:
+                tokens.append(current)
+            current = ""
+        else:
+            current += char
+    if current:
+        tokens.append(current)
+    for index, token in enumerate(tokens):
+        if token.endswith(":"):
+            return [t.replace("$$", "$") for t in tokens[index + 1:]]
+    return []
+
+
+class MacroCache(object):
+    """Digests of the predefined macros per preprocessor command."""
+
+    def __init__(self, sysenv=None):
+        self.sysenv = sysenv
+        self.digests = {}
+        self.lock = threading.Lock()
+
+    def digest(self, cmd):
+        """SHA-1 of the `-dM -E` output of `cmd`, None if it fails."""
+        key = "\0".join(cmd)
+        with self.lock:
+            if key in self.digests:
+                return self.digests[key]
+        try:
+            proc = subprocess.run(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=self.sysenv)
+            result = hashlib.sha1(proc.stdout).hexdigest() if proc.returncode == 0 else None
+        except OSError:
+            result = None
+        with self.lock:
+            self.digests[key] = result
+        return result
+
+
+class IncludeCache(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.units = {}
+        self.seen = {}
+        self._mtimes = {}
+        self.lock = threading.Lock()
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+            if data.get("version") == CACHE_VERSION:
+                self.units = data["units"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _mtime(self, path):
+        if path not in self._mtimes:
+            try:
+                self._mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                self._mtimes[path] = None
+        return self._mtimes[path]
+
+    def _layout(self, dirs, subdirs):
+        digest = hashlib.sha1()
+        for directory in dirs:
+            digest.update(("%s:%s\n" % (directory, self._mtime(directory))).encode("utf-8"))
+            for subdir in subdirs:
+                path = os.path.join(directory, subdir)
+                digest.update(("%s:%s\n" % (path, self._mtime(path))).encode("utf-8"))
+        return digest.hexdigest()
+
+    def select(self, obj, dirs, macros):
+        """Include directories for the next compilation of `obj`, a subset of `dirs`.
+
+        `macros` identifies the preprocessor state of the unit, None disables pruning.
+        """
+        absdirs = [os.path.abspath(d) for d in dirs]
+        with self.lock:
+            self.seen[obj] = (absdirs, macros)
+            unit = self.units.get(obj)
+            if not unit or macros is None or unit["macros"] != macros \
+                    or unit["layout"] != self._layout(absdirs, unit["subdirs"]):
+                return dirs
+            for path, mtime in unit["deps"].items():
+                if self._mtime(path) != mtime:
+                    return dirs
+        used = set(unit["dirs"])
+        return [d for d, absdir in zip(dirs, absdirs) if absdir in used]
+
+    def record(self, failed=()):
+        """Stores the directories used by the objects compiled in this build.
+
+        Objects in `failed` or without an object file keep the full search path.
+        """
+        self._mtimes = {}
+        changed = False
+        for obj, (dirs, macros) in self.seen.items():
+            if obj in failed or self._mtime(obj) is None:
+                changed |= self.units.pop(obj, None) is not None
+                continue
+            depfile = os.path.splitext(obj)[0] + ".d"
+            depfile_mtime = self._mtime(depfile)
+            unit = self.units.get(obj)
+            if depfile_mtime is None or (unit and unit["depfile"] == depfile_mtime):
+                continue
+            deps = [os.path.abspath(p) for p in parse_depfile(depfile)]
+            used = [d for d in dirs if any(p.startswith(d + os.sep) for p in deps)]
+            # every directory below an include directory a header was found in
+            subdirs = set()
+            for path in deps:
+                for directory in used:
+                    if path.startswith(directory + os.sep):
+                        subdir = os.path.dirname(os.path.relpath(path, directory))
+                        while subdir:
+                            subdirs.add(subdir)
+                            subdir = os.path.dirname(subdir)
+            subdirs = sorted(subdirs)
+            self.units[obj] = dict(
+                depfile=depfile_mtime, macros=macros, subdirs=subdirs,
+                layout=self._layout(dirs, subdirs),
+                deps={p: self._mtime(p) for p in deps}, dirs=used)
+            changed = True
+        if changed:
+            self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump(dict(version=CACHE_VERSION, units=self.units), fp)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,180 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+ITCM bank planner for Teensy 4
+
+FlexRAM hands out ITCM in 32 KiB banks; every bank that is not needed for
+code is available as DTCM. The planner inspects the linked firmware and
+suggests which functions to move between ITCM and flash so that no bank is
+spent on a few hundred bytes of code.
+"""
+
+from . import elf
+
+BANK_SIZE = 32768
+ITCM_END = 0x00080000
+FLASH_START = 0x60000000
+FLASH_END = 0x70000000
+# ".text.itcm" ends with ALIGN(16), keep some room for alignment gaps
+ALIGN_MARGIN = 16
+
+# functions executed before ResetHandler copied the ITCM image
+STARTUP_FUNCTIONS = frozenset((
+    "ResetHandler",
+    "ResetHandler2",
+    "configure_cache",
+    "configure_external_ram",
+    "usb_pll_start",
+    "reset_PFD",
+    "memory_copy",
+    "memory_clear",
+    "startup_default_early_hook",
+    "startup_early_hook",
+))
+
+
+def _aligned(size, align=4):
+    return (size + align - 1) & ~(align - 1)
+
+
+def banks_for(size):
+    return (size + BANK_SIZE - 1) // BANK_SIZE
+
+
+def minimal_demotion(functions, needed):
+    """Pick the fewest functions whose sizes add up to `needed` bytes.
+
+    Among the selections of minimal length the greedy pass prefers small
+    functions, so the amount of code leaving ITCM stays close to `needed`.
+    """
+    if needed <= 0:
+        return []
+    candidates = sorted(functions, key=lambda f: f.size, reverse=True)
+    total = 0
+    count = 0
+    for fn in candidates:
+        total += fn.size
+        count += 1
+        if total >= needed:
+            break
+    else:
+        return None
+
+    selected = []
+    remaining = needed
+    pool = list(candidates)
+    for slot in range(count, 0, -1):
+        choice = 0
+        largest = sum(f.size for f in pool[:slot - 1])
+        # pool is sorted descending, walk from the smallest upwards
+        for index in range(len(pool) - 1, slot - 2, -1):
+            if pool[index].size + largest >= remaining:
+                choice = index
+                break
+        fn = pool.pop(choice)
+        selected.append(fn)
+        remaining -= fn.size
+    return selected
+
+
+def maximal_promotion(functions, budget):
+    """Pick as many functions as possible that fit into `budget` bytes."""
+    selected = []
+    used = 0
+    for fn in sorted(functions, key=lambda f: f.size):
+        size = _aligned(fn.size)
+        if used + size > budget:
+            break
+        selected.append(fn)
+        used += size
+    return selected
+
+
+def plan(firmware):
+    if not isinstance(firmware, elf.ElfFile):
+        firmware = elf.ElfFile(firmware)
+    section = firmware.section(".text.itcm")
+    itcm = section.size if section else 0
+    banks = banks_for(itcm)
+    padding = banks * BANK_SIZE - itcm
+
+    itcm_functions = []
+    flash_functions = []
+    for fn in firmware.functions():
+        if fn.value < ITCM_END:
+            itcm_functions.append(fn)
+        elif FLASH_START <= fn.value < FLASH_END:
+            if fn.name not in STARTUP_FUNCTIONS:
+                flash_functions.append(fn)
+
+    overflow = itcm - (banks - 1) * BANK_SIZE if banks else 0
+    demote = minimal_demotion(
+        itcm_functions, overflow + ALIGN_MARGIN) if banks > 1 else []
+    promote = maximal_promotion(flash_functions, max(padding - ALIGN_MARGIN, 0))
+
+    return dict(
+        itcm=itcm,
+        banks=banks,
+        padding=padding,
+        overflow=overflow,
+        itcm_functions=sorted(itcm_functions, key=lambda f: f.size, reverse=True),
+        demote=demote or [],
+        promote=promote,
+    )
+
+
+def format_plan(result, names=None, limit=10):
+    names = names or {}
+
+    def label(fn):
+        return names.get(fn.name, fn.name)
+
+    lines = []
+    lines.append("ITCM:   %d bytes in %d x 32 KiB bank(s), %d bytes padding" % (
+        result["itcm"], result["banks"], result["padding"]))
+    if result["itcm_functions"]:
+        lines.append("")
+        lines.append("Largest ITCM functions:")
+        for fn in result["itcm_functions"][:limit]:
+            lines.append("  %7d  %s" % (fn.size, label(fn)))
+
+    lines.append("")
+    if result["banks"] > 1 and result["demote"]:
+        saved = sum(fn.size for fn in result["demote"])
+        lines.append(
+            "Demote to FLASHMEM to free one ITCM bank (+32 KiB DTCM), "
+            "%d bytes overflow the last bank:" % result["overflow"])
+        for fn in result["demote"]:
+            lines.append("  %7d  %s" % (fn.size, label(fn)))
+        lines.append("  %7d  total" % saved)
+    elif result["banks"] > 1:
+        lines.append("No set of functions frees an ITCM bank.")
+    else:
+        lines.append("ITCM already uses the minimum number of banks.")
+
+    lines.append("")
+    if result["promote"]:
+        used = sum(_aligned(fn.size) for fn in result["promote"])
+        lines.append(
+            "FASTRUN candidates that fit into the current padding "
+            "(%d of %d bytes):" % (used, result["padding"]))
+        for fn in result["promote"][:limit]:
+            lines.append("  %7d  %s" % (fn.size, label(fn)))
+        if len(result["promote"]) > limit:
+            lines.append("  ... and %d more" % (len(result["promote"]) - limit))
+    else:
+        lines.append("No flash function fits into the current ITCM padding.")
+    return "\n".join(lines)
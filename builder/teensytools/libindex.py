@@ -0,0 +1,164 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Header to library index for the framework library tree
+
+Maps every header a framework library exports to the library that provides
+it, together with the headers each library includes itself. With the index,
+the libraries a project needs can be found with dictionary lookups instead of
+probing the whole library tree.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+INDEX_FORMAT = 2
+HEADER_EXTENSIONS = (".h", ".hh", ".hpp", ".hxx", ".inc", ".tcc")
+SOURCE_EXTENSIONS = HEADER_EXTENSIONS + (
+    ".c", ".cc", ".cpp", ".cxx", ".ino", ".pde", ".S", ".s")
+SKIP_DIRS = ("examples", "extras", "docs", "test", "tests", ".git")
+
+_INCLUDE_RE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.M)
+
+
+def _walk(root):
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS]
+        for name in files:
+            yield os.path.join(path, name)
+
+
+def scan_includes(paths):
+    includes = set()
+    for path in paths:
+        if not path.endswith(SOURCE_EXTENSIONS):
+            continue
+        try:
+            with open(path, encoding="latin-1") as fp:
+                includes.update(_INCLUDE_RE.findall(fp.read()))
+        except OSError:
+            continue
+    return includes
+
+
+def scan_dirs(dirs):
+    return scan_includes(
+        path for root in dirs if os.path.isdir(root) for path in _walk(root))
+
+
+def get_signature(libraries_dir, version):
+    """Changes when headers are added, removed or renamed anywhere in a library's sources."""
+    digest = hashlib.sha1(str(version).encode("utf-8"))
+    for name in sorted(os.listdir(libraries_dir)):
+        lib_dir = os.path.join(libraries_dir, name)
+        if not os.path.isdir(lib_dir):
+            continue
+        src_dir = os.path.join(lib_dir, "src")
+        # the library directory as well, a new `src` changes the root
+        dirs = [lib_dir]
+        for path, subdirs, _ in os.walk(src_dir if os.path.isdir(src_dir) else lib_dir):
+            subdirs[:] = sorted(d for d in subdirs if d not in SKIP_DIRS)
+            dirs.append(path)
+        for path in dirs:
+            digest.update(("%s:%d\n" % (
+                os.path.relpath(path, libraries_dir), os.stat(path).st_mtime_ns)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_index(libraries_dir, version):
+    headers = {}
+    includes = {}
+    for name in sorted(os.listdir(libraries_dir)):
+        lib_dir = os.path.join(libraries_dir, name)
+        if not os.path.isdir(lib_dir):
+            continue
+        src_dir = os.path.join(lib_dir, "src")
+        root = src_dir if os.path.isdir(src_dir) else lib_dir
+        files = list(_walk(root))
+        for path in files:
+            if path.endswith(HEADER_EXTENSIONS):
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                headers.setdefault(rel, [])
+                if name not in headers[rel]:
+                    headers[rel].append(name)
+        includes[name] = sorted(scan_includes(files))
+    return dict(
+        format=INDEX_FORMAT,
+        signature=get_signature(libraries_dir, version),
+        headers=headers,
+        includes=includes,
+    )
+
+
+def load_index(cache_path, libraries_dir, version):
+    """Returns a valid index, rebuilding and persisting it when outdated."""
+    signature = get_signature(libraries_dir, version)
+    try:
+        with open(cache_path) as fp:
+            index = json.load(fp)
+        if index.get("format") == INDEX_FORMAT and index.get("signature") == signature:
+            return index
+    except (OSError, ValueError):
+        pass
+    index = build_index(libraries_dir, version)
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    with open(tmp_path, "w") as fp:
+        json.dump(index, fp)
+    os.replace(tmp_path, cache_path)
+    return index
+
+
+def resolve(index, includes, names=()):
+    """Libraries providing `includes`, following the libraries' own includes."""
+    all_libs = set(index["includes"])
+    selected = set(n for n in names if n in all_libs)
+    pending = list(includes) + [
+        inc for name in selected for inc in index["includes"][name]]
+    seen = set()
+    while pending:
+        header = pending.pop()
+        if header in seen:
+            continue
+        seen.add(header)
+        for name in index["headers"].get(header, ()):
+            if name in selected:
+                continue
+            selected.add(name)
+            pending.extend(index["includes"][name])
+    return selected
+
+
+def sync_shadow_dir(shadow_dir, libraries_dir, names):
+    """Expose only `names` from libraries_dir through symlinks in shadow_dir."""
+    if not os.path.isdir(shadow_dir):
+        os.makedirs(shadow_dir)
+    names = set(names)
+    for name in os.listdir(shadow_dir):
+        link = os.path.join(shadow_dir, name)
+        target = os.path.join(libraries_dir, name)
+        # links into an old framework location are recreated
+        if name not in names or not os.path.islink(link) or os.readlink(link) != target:
+            os.unlink(link)
+    existing = set(os.listdir(shadow_dir))
+    for name in names - existing:
+        os.symlink(os.path.join(libraries_dir, name),
+                   os.path.join(shadow_dir, name), target_is_directory=True)
+    return shadow_dir
@@ -0,0 +1,242 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Local mirror for git packages
+
+All repositories share one object store (`objects.git`). Every fetch is
+shallow and only transfers the requested revision, and git's content
+addressing stores identical files and trees once, no matter how many
+repositories or revisions contain them. Objects are verified with
+`transfer.fsckObjects` while fetching.
+
+For every repository the mirror provides a small bare repository in
+`repos/<url hash>.git` that borrows the objects from the shared store.
+While PlatformIO installs a package, `url.<repo>.insteadOf` redirects its
+clone to that repository, so the installed package keeps its original
+source URL. The mirror directory can be shared between machines and
+containers; concurrent fetches are serialized with a lock file.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+_COMMIT_RE = re.compile(r"^[0-9a-f]{40}$")
+_GIT_URL_RE = re.compile(r"^(?:git\+)?(?:https?|ssh|git|file)://\S+$")
+MIN_GIT_VERSION = (2, 31)  # GIT_CONFIG_COUNT
+
+
+class MirrorError(Exception):
+    pass
+
+
+def parse_spec(requirements):
+    """Returns (url, ref) of a git package requirement or None."""
+    if not requirements or not _GIT_URL_RE.match(requirements):
+        return None
+    url, _, ref = requirements.partition("#")
+    if url.startswith("git+"):
+        url = url[4:]
+    elif not url.endswith(".git") and not url.startswith("file://"):
+        return None
+    return url, ref or None
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode()).hexdigest()[:20]
+
+
+def _git(args, git_dir=None, check=True):
+    cmd = ["git"]
+    if git_dir:
+        cmd += ["--git-dir", git_dir]
+    proc = subprocess.run(
+        cmd + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if check and proc.returncode != 0:
+        raise MirrorError("git %s failed: %s" % (" ".join(args), proc.stderr.strip()))
+    return proc.stdout.strip()
+
+
+def git_version():
+    try:
+        output = _git(["--version"])
+    except (OSError, MirrorError):
+        return ()
+    match = re.search(r"(\d+)\.(\d+)", output)
+    return (int(match.group(1)), int(match.group(2))) if match else ()
+
+
+@contextlib.contextmanager
+def _lock(mirror, timeout=600):
+    path = os.path.join(mirror, ".lock")
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            # a crashed fetch leaves the lock behind
+            try:
+                if time.time() - os.path.getmtime(path) > timeout:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise MirrorError("timeout waiting for %s" % path)
+            time.sleep(0.5)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _init_bare(path):
+    if not os.path.isfile(os.path.join(path, "HEAD")):
+        _git(["init", "--bare", "--quiet", path])
+
+
+def _load_index(mirror):
+    try:
+        with open(os.path.join(mirror, "index.json")) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(mirror, index):
+    path = os.path.join(mirror, "index.json")
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as fp:
+        json.dump(index, fp, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def fetch(mirror, url, ref=None):
+    """Fetches a single revision into the mirror, returns (repository path, commit)."""
+    if ref and re.match(r"^[0-9a-f]{7,39}$", ref):
+        raise MirrorError("abbreviated commit %s cannot be fetched, use the full hash" % ref)
+    mirror = os.path.abspath(mirror)
+    if not os.path.isdir(mirror):
+        os.makedirs(mirror)
+    key = url_key(url)
+    store = os.path.join(mirror, "objects.git")
+    repo = os.path.join(mirror, "repos", key + ".git")
+    mirror_ref = "refs/mirror/%s/%s" % (key, ref or "HEAD")
+    with _lock(mirror):
+        _init_bare(store)
+        index = _load_index(mirror)
+        entry = "%s#%s" % (url, ref or "")
+        cached = _git(["rev-parse", "--verify", "--quiet", mirror_ref + "^{commit}"],
+                      store, check=False)
+        # commits never change, branches and tags are fetched again
+        if not (cached and ref and _COMMIT_RE.match(ref)):
+            try:
+                _git(["-c", "transfer.fsckObjects=true", "fetch", "--quiet", "--depth", "1",
+                      "--no-tags", url, "+%s:%s" % (ref or "HEAD", mirror_ref)], store)
+            except MirrorError:
+                if not cached:
+                    raise
+                sys.stderr.write("Warning! Cannot update %s, using the mirrored revision\n" % entry)
+        commit = _git(["rev-parse", mirror_ref + "^{commit}"], store)
+        _init_bare(repo)
+        with open(os.path.join(repo, "objects", "info", "alternates"), "w") as fp:
+            fp.write(os.path.join(store, "objects") + "\n")
+        if os.path.isfile(os.path.join(store, "shallow")):
+            with open(os.path.join(store, "shallow")) as src, \
+                    open(os.path.join(repo, "shallow"), "w") as dst:
+                dst.write(src.read())
+        branch = "refs/heads/%s" % (ref if ref and not _COMMIT_RE.match(ref) else "main")
+        _git(["update-ref", branch, commit], repo)
+        _git(["symbolic-ref", "HEAD", branch], repo)
+        index[entry] = dict(
+            commit=commit, tree=_git(["rev-parse", commit + "^{tree}"], store), repo=repo)
+        _save_index(mirror, index)
+    return repo, commit
+
+
+@contextlib.contextmanager
+def redirect(mirror, url, ref=None):
+    """Redirects git clones of `url` to the mirror while the context is active."""
+    if git_version() < MIN_GIT_VERSION:
+        raise MirrorError("git %d.%d or newer is required" % MIN_GIT_VERSION)
+    repo, _ = fetch(mirror, url, ref)
+    saved_count = os.environ.get("GIT_CONFIG_COUNT")
+    count = int(saved_count or 0)
+    os.environ["GIT_CONFIG_KEY_%d" % count] = "url.file://%s.insteadOf" % repo.replace(os.sep, "/")
+    os.environ["GIT_CONFIG_VALUE_%d" % count] = url
+    os.environ["GIT_CONFIG_COUNT"] = str(count + 1)
+    try:
+        yield repo
+    finally:
+        for name in ("GIT_CONFIG_KEY_%d" % count, "GIT_CONFIG_VALUE_%d" % count):
+            os.environ.pop(name, None)
+        if saved_count is None:
+            os.environ.pop("GIT_CONFIG_COUNT", None)
+        else:
+            os.environ["GIT_CONFIG_COUNT"] = saved_count
+
+
+def install(mirror, name, spec, installer):
+    """Calls `installer()` with the clone of `spec` (url, ref) redirected to the
+    mirror, or without the mirror if it cannot provide the revision."""
+    try:
+        with redirect(mirror, *spec):
+            return installer()
+    except MirrorError as exc:
+        sys.stderr.write("Warning! Package mirror not used for %s: %s\n" % (name, exc))
+    return installer()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the git package mirror")
+    parser.add_argument("mirror", help="mirror directory")
+    subparsers = parser.add_subparsers(dest="command")
+    fetch_parser = subparsers.add_parser("fetch", help="mirror a package revision")
+    fetch_parser.add_argument("spec", help="git URL with optional #branch, tag or commit")
+    subparsers.add_parser("list", help="list mirrored revisions")
+    args = parser.parse_args(argv)
+    if args.command == "fetch":
+        spec = parse_spec(args.spec)
+        if not spec:
+            parser.error("%s is not a git URL" % args.spec)
+        try:
+            repo, commit = fetch(args.mirror, *spec)
+        except MirrorError as exc:
+            sys.stderr.write("Error: %s\n" % exc)
+            return 1
+        print("%s %s" % (commit, repo))
+    elif args.command == "list":
+        for entry, item in sorted(_load_index(args.mirror).items()):
+            print("%s %s tree %s" % (item["commit"][:12], entry, item["tree"][:12]))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Profile-driven code placement for Teensy 4
+
+Maps program counter samples onto the functions of the sampled firmware,
+keeps the hottest functions in ITCM within a byte budget and moves all
+other functions to flash by listing their input sections in the
+`.text.code` output section of a derived linker script. FASTRUN functions
+and functions in plain `.text` input sections (objects built without
+`-ffunction-sections`) cannot be moved; they stay in ITCM and are taken off
+the budget.
+
+Accepted sample files:
+  * text, one sample per line: `<address>` or `<address> <count>`
+    (hexadecimal address with optional `0x`, decimal count, separated by
+    whitespace, comma or semicolon, `#` starts a comment)
+  * raw SWO/ITM captures containing DWT periodic PC sample packets
+"""
+
+import argparse
+import json
+import os
+import re
+from bisect import bisect_right
+
+from . import elf
+
+DEFAULT_BUDGET = 65536
+FLASHMEM_MARKER = "*(.flashmem*)"
+
+_SAMPLE_RE = re.compile(
+    r"^\s*(0[xX][0-9a-fA-F]+|[0-9a-fA-F]+)(?:[\s,;]+(\d+))?\s*$")
+
+
+def parse_text_samples(text):
+    samples = {}
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            continue
+        addr = int(match.group(1), 16)
+        count = int(match.group(2)) if match.group(2) else 1
+        samples[addr] = samples.get(addr, 0) + count
+    return samples
+
+
+def parse_swo_samples(data):
+    """Decode DWT PC sample packets (header 0x17) from a raw SWO stream."""
+    samples = {}
+    pos = 0
+    end = len(data)
+    while pos < end:
+        header = data[pos]
+        pos += 1
+        if header == 0x00 or header == 0x80 or header == 0x70:
+            continue  # sync or overflow
+        if header in (0x94, 0xB4):
+            # global timestamp, continuation bytes up to the last one
+            while pos < end and data[pos] & 0x80:
+                pos += 1
+            pos += 1
+            continue
+        if header & 0x0F == 0x00 or header & 0x0B == 0x08:
+            # timestamp or extension packet, skip continuation bytes
+            if header & 0x80:
+                while pos < end and data[pos] & 0x80:
+                    pos += 1
+                pos += 1
+            continue
+        size = (0, 1, 2, 4)[header & 0x03]
+        if header == 0x17 and pos + 4 <= end:
+            addr = int.from_bytes(data[pos:pos + 4], "little")
+            samples[addr] = samples.get(addr, 0) + 1
+        pos += size
+    return samples
+
+
+def load_samples(path):
+    with open(path, "rb") as fp:
+        data = fp.read()
+    try:
+        text = data.decode("ascii")
+    except UnicodeDecodeError:
+        text = None
+    if text is not None and parse_text_samples(text):
+        return parse_text_samples(text)
+    return parse_swo_samples(bytearray(data))
+
+
+def pinned_functions(relocatable):
+    """Functions of an object file that the `.text.NAME` patterns do not move."""
+    names = set()
+    for sym in relocatable.symbols:
+        if sym.type != elf.STT_FUNC or not sym.name or not sym.section:
+            continue
+        if sym.section.startswith(".fastrun") or (
+                sym.section.startswith(".text") and sym.section != ".text." + sym.name):
+            names.add(sym.name)
+    return names
+
+
+def load_pinned(build_dir):
+    """Pinned functions of all objects and archives below `build_dir`."""
+    names = set()
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if name.endswith(".o"):
+                    names |= pinned_functions(elf.ElfFile(path))
+                elif name.endswith(".a"):
+                    for _, data in elf.read_archive(path):
+                        if data[:4] == b"\x7fELF":
+                            names |= pinned_functions(elf.ElfFile(path, data))
+            except (OSError, elf.ElfError):
+                continue
+    return names
+
+
+def map_samples(functions, samples):
+    """Returns ({function name: samples}, unmapped sample count)."""
+    starts = [fn.value for fn in functions]
+    counts = {}
+    unmapped = 0
+    for addr, count in samples.items():
+        addr &= ~1
+        index = bisect_right(starts, addr) - 1
+        if index >= 0 and addr < functions[index].value + functions[index].size:
+            name = functions[index].name
+            counts[name] = counts.get(name, 0) + count
+        else:
+            unmapped += count
+    return counts, unmapped
+
+
+def _aligned(size):
+    return (size + 3) & ~3
+
+
+def select(functions, counts, budget=DEFAULT_BUDGET, pinned=()):
+    """Pick the hottest functions by samples per byte until budget is used.
+
+    `pinned` functions stay in ITCM anyway, their size is taken off the budget.
+    Returns (hot, cold, bytes of the hot functions, bytes of the pinned functions).
+    """
+    sizes = {}
+    for fn in functions:
+        sizes[fn.name] = max(sizes.get(fn.name, 0), fn.size)
+    pinned = set(name for name in pinned if name in sizes)
+    pinned_bytes = sum(_aligned(sizes[name]) for name in pinned)
+    budget -= pinned_bytes
+    ranked = sorted(
+        (name for name in counts if sizes.get(name) and name not in pinned),
+        key=lambda name: (counts[name] / float(sizes[name]), counts[name]),
+        reverse=True)
+    hot = []
+    used = 0
+    for name in ranked:
+        size = _aligned(sizes[name])
+        if used + size > budget:
+            continue
+        hot.append(name)
+        used += size
+    in_itcm = set(hot) | pinned
+    cold = sorted(name for name in sizes if name not in in_itcm)
+    return hot, cold, used, pinned_bytes
+
+
+def build_assignments(firmware, samples, budget=DEFAULT_BUDGET, pinned=()):
+    if not isinstance(firmware, elf.ElfFile):
+        firmware = elf.ElfFile(firmware)
+    functions = firmware.functions()
+    counts, unmapped = map_samples(functions, samples)
+    hot, cold, used, pinned_bytes = select(functions, counts, budget, pinned)
+    total = sum(samples.values())
+    return dict(
+        budget=budget,
+        itcm_bytes=used + pinned_bytes,
+        pinned_bytes=pinned_bytes,
+        samples=total,
+        unmapped=unmapped,
+        coverage=(sum(counts[n] for n in hot) / float(total)) if total else 0.0,
+        hot=[dict(name=name, samples=counts[name]) for name in hot],
+        cold=cold,
+    )
+
+
+def save(assignments, path):
+    with open(path, "w") as fp:
+        json.dump(assignments, fp, indent=2, sort_keys=True)
+        fp.write("\n")
+
+
+def load(path):
+    with open(path) as fp:
+        return json.load(fp)
+
+
+def render_ldscript(text, cold):
+    """Insert the cold input sections right after the FLASHMEM input sections."""
+    lines = text.splitlines(True)
+    for index, line in enumerate(lines):
+        if FLASHMEM_MARKER in line:
+            indent = line[:len(line) - len(line.lstrip())]
+            patterns = ["%s*(.text.%s)\n" % (indent, name) for name in cold]
+            return "".join(lines[:index + 1] + patterns + lines[index + 1:])
+    raise ValueError("Linker script has no %s input section" % FLASHMEM_MARKER)
+
+
+def format_assignments(assignments, limit=20):
+    pinned_bytes = assignments.get("pinned_bytes", 0)
+    lines = [
+        "ITCM:   %d of %d bytes budget used, %d bytes by %d hot functions, "
+        "%d bytes by FASTRUN and .text code" % (
+            assignments["itcm_bytes"], assignments["budget"],
+            assignments["itcm_bytes"] - pinned_bytes, len(assignments["hot"]), pinned_bytes),
+        "        %.1f%% of %d samples covered, %d samples outside of functions" % (
+            assignments["coverage"] * 100, assignments["samples"], assignments["unmapped"]),
+        "Flash:  %d functions" % len(assignments["cold"]),
+    ]
+    for item in assignments["hot"][:limit]:
+        lines.append("  %9d  %s" % (item["samples"], item["name"]))
+    if pinned_bytes > assignments["budget"]:
+        lines.append("Warning! FASTRUN and .text code alone exceed the ITCM budget")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Select ITCM functions from PC samples")
+    parser.add_argument("elf", help="firmware the samples were recorded with")
+    parser.add_argument("samples", help="sample file (text or raw SWO)")
+    parser.add_argument("--budget", type=int, default=DEFAULT_BUDGET,
+                        help="ITCM bytes for hot functions")
+    parser.add_argument("--build-dir",
+                        help="objects of the firmware, to find FASTRUN and .text functions")
+    parser.add_argument("-o", "--output", help="write assignments JSON")
+    args = parser.parse_args(argv)
+    pinned = load_pinned(args.build_dir) if args.build_dir else ()
+    assignments = build_assignments(
+        args.elf, load_samples(args.samples), args.budget, pinned)
+    print(format_assignments(assignments))
+    if args.output:
+        save(assignments, args.output)
+
+
+if __name__ == "__main__":
+    main()
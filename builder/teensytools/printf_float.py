@@ -0,0 +1,108 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Detect floating point conversions in printf-style format strings
+
+newlib-nano only links the floating point part of printf when
+`_printf_float` is referenced. The scan looks at every object that calls a
+printf-family function and searches its string literals for %f, %e, %g or
+%a conversions.
+"""
+
+import os
+import re
+
+from . import elf
+
+_PRINTF_RE = re.compile(r"^_?v?(?:s|sn|f|as|d)?printf(?:_r)?$|\dv?printf[A-Z]")
+_FLOAT_RE = re.compile(
+    r"%[-+ #0']*(?:\*|\d+)?(?:\.(?:\*|\d*))?(?:hh|h|ll|l|L|q|j|z|t)?[fFeEgGaA]")
+_STRING_RE = re.compile(rb"[\x09\x0a\x0d\x20-\x7e]*%[\x09\x0a\x0d\x20-\x7e]*")
+
+_cache = {}
+
+
+def float_formats(data):
+    result = []
+    for raw in _STRING_RE.findall(data):
+        text = raw.decode("ascii")
+        if _FLOAT_RE.search(text.replace("%%", "")):
+            result.append(text.strip())
+    return result
+
+
+def scan_object(name, data):
+    """Returns (float format strings, calls printf, is LTO bytecode)."""
+    try:
+        obj = elf.ElfFile(name, data)
+    except elf.ElfError:
+        return [], False, False
+    lto = any(s.name.startswith(".gnu.lto_") for s in obj.sections)
+    calls = any(
+        sym.section is None and sym.bind != elf.STB_LOCAL and _PRINTF_RE.search(sym.name)
+        for sym in obj.symbols)
+    return (float_formats(data) if calls else []), calls, lto
+
+
+def scan_file(path):
+    key = (path, os.path.getmtime(path), os.path.getsize(path))
+    if key in _cache:
+        return _cache[key]
+    result = []
+    if path.endswith(".a"):
+        members = elf.read_archive(path)
+    else:
+        with open(path, "rb") as fp:
+            members = [(None, fp.read())]
+    for member, data in members:
+        name = "%s(%s)" % (path, member) if member else path
+        result.append((name,) + scan_object(name, data))
+    _cache[key] = result
+    return result
+
+
+def analyze(paths):
+    """Returns a dict with the decision and the call sites that caused it."""
+    users = []
+    lto_objects = []
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        for name, formats, calls, lto in scan_file(path):
+            if lto:
+                lto_objects.append(name)
+            if formats:
+                users.append((name, formats))
+    return dict(
+        required=bool(users or lto_objects),
+        users=users,
+        lto_objects=lto_objects,
+    )
+
+
+def format_report(result, limit=10):
+    if result["users"]:
+        lines = ["printf float support linked, float conversions used in:"]
+        for name, formats in result["users"][:limit]:
+            lines.append("  %s: %s" % (
+                name, ", ".join('"%s"' % f.encode("unicode_escape").decode() for f in formats[:3])))
+        if len(result["users"]) > limit:
+            lines.append("  ... and %d more" % (len(result["users"]) - limit))
+        return "\n".join(lines)
+    if result["lto_objects"]:
+        return ("printf float support linked, LTO objects cannot be scanned "
+                "(define DISABLE_PRINTF_FLOAT to drop it)")
+    return "printf float support not linked, no float conversions found"
@@ -0,0 +1,195 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Shared HTTP build cache
+
+Extends the SCons cache directory (used as the local tier) with a remote
+tier: `GET <url>/<key>` to fetch an entry and `PUT <url>/<key>` to store
+one. Any HTTP server or object store that supports these two requests works,
+for example a WebDAV share or an nginx location with `dav_methods PUT`.
+
+The cache key is the SCons build signature of a file (sources, included
+headers and the complete command line) combined with a salt covering the
+board manifest and the toolchain package versions.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from urllib import error, request
+
+DEFAULT_TIMEOUT = 10
+
+
+class RemoteStore(object):
+
+    def __init__(self, url, readonly=False, token=None, timeout=DEFAULT_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.readonly = readonly
+        self.token = token
+        self.timeout = timeout
+        self.can_fetch = True
+        self.can_store = not readonly
+
+    def _request(self, key, method="GET", data=None):
+        req = request.Request("%s/%s" % (self.url, key), data=data, method=method)
+        if self.token:
+            req.add_header("Authorization", "Bearer %s" % self.token)
+        if data is not None:
+            req.add_header("Content-Type", "application/octet-stream")
+        return request.urlopen(req, timeout=self.timeout)
+
+    def _failed(self, exc, direction):
+        if isinstance(exc, error.HTTPError):
+            # the server answered, only this direction is refused (e.g. a read-only token)
+            directions = (direction,)
+        else:
+            # stop talking to an unreachable server for the rest of the build
+            directions = ("fetch", "store")
+        for name in directions:
+            if getattr(self, "can_" + name):
+                setattr(self, "can_" + name, False)
+                sys.stderr.write("Warning! Remote build cache %s disabled: %s\n" % (
+                    "downloads" if name == "fetch" else "uploads", exc))
+
+    def fetch(self, key, path):
+        if not self.can_fetch:
+            return False
+        try:
+            with self._request(key) as resp:
+                data = resp.read()
+        except error.HTTPError as exc:
+            if exc.code != 404:
+                self._failed(exc, "fetch")
+            return False
+        except (OSError, ValueError) as exc:
+            self._failed(exc, "fetch")
+            return False
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+        return True
+
+    def store(self, key, path):
+        if not self.can_store or not os.path.isfile(path):
+            return False
+        with open(path, "rb") as fp:
+            data = fp.read()
+        try:
+            with self._request(key, "PUT", data):
+                pass
+        except (OSError, ValueError) as exc:
+            self._failed(exc, "store")
+            return False
+        return True
+
+
+class Stats(object):
+
+    def __init__(self):
+        # counted from the parallel SCons jobs
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.uploads = 0
+
+    def add(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        requests = self.local_hits + self.remote_hits + self.misses
+        return dict(
+            requests=requests,
+            local_hits=self.local_hits,
+            remote_hits=self.remote_hits,
+            misses=self.misses,
+            uploads=self.uploads,
+            hit_rate=(self.local_hits + self.remote_hits) / float(requests) if requests else 0.0,
+        )
+
+    def format(self):
+        stats = self.as_dict()
+        return ("Build cache: %(local_hits)d local hits, %(remote_hits)d remote hits, "
+                "%(misses)d misses, %(uploads)d uploads (%(hit_rate).0f%% hit rate)" % dict(
+                    stats, hit_rate=stats["hit_rate"] * 100))
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as fp:
+            json.dump(self.as_dict(), fp, indent=2)
+
+
+def get_salt(*parts):
+    return hashlib.sha1("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+def make_cache_class(base, store, salt, stats, stats_path=None):
+    """Create a SCons CacheDir subclass with the remote tier attached."""
+
+    class RemoteCacheDir(base):
+
+        def cachepath(self, node):
+            if not self.is_enabled():
+                return None, None
+            sig = hashlib.sha1(
+                (node.get_cachedir_bsig() + salt).encode("utf-8")).hexdigest()
+            cachedir = os.path.join(self.path, sig[:self.config["prefix_len"]].upper())
+            return cachedir, os.path.join(cachedir, sig)
+
+        def retrieve(self, node):
+            if not self.is_enabled():
+                return False
+            _, cachefile = self.cachepath(node)
+            local = os.path.isfile(cachefile)
+            remote = not local and store.fetch(os.path.basename(cachefile), cachefile)
+            if not base.retrieve(self, node):
+                stats.add("misses")
+                return False
+            if local:
+                stats.add("local_hits")
+            elif remote:
+                stats.add("remote_hits")
+            return True
+
+        def push(self, node):
+            result = base.push(self, node)
+            if self.is_enabled():
+                _, cachefile = self.cachepath(node)
+                if store.store(os.path.basename(cachefile), cachefile):
+                    stats.add("uploads")
+            return result
+
+    def report():
+        if stats.local_hits + stats.remote_hits + stats.misses == 0:
+            return
+        print(stats.format())
+        if stats_path:
+            stats.save(stats_path)
+
+    atexit.register(report)
+    return RemoteCacheDir
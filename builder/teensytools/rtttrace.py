@@ -0,0 +1,509 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""
+Host side of TeensyTrace: RTT stream reader, decoder and Perfetto writer
+
+A record is the sync byte 0xA5, the length of the rest of the record, the
+event type, the cycles since the previous record and the event arguments,
+all numbers as unsigned LEB128 (see misc/trace/TeensyTrace.h). Bytes outside
+of records, e.g. the banner of the J-Link telnet server, are skipped.
+
+Events are converted on the fly into Perfetto `TracePacket`s, the
+concatenation of which is a valid `Trace` protobuf message. Only the open
+slices and per interrupt statistics are kept in memory, so captures can run
+for any length of time.
+"""
+
+import argparse
+import math
+import os
+import socket
+import struct
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+from . import elf
+
+SYNC = 0xA5
+SECTION = ".trace_str"
+DEFAULT_PORT = 19021  # J-Link RTT telnet server
+
+HEADER, ISR_ENTER, ISR_EXIT, TASK_SWITCH, BEGIN, END, INSTANT, COUNTER, DROPPED, TASK_NAME = range(1, 11)
+_ARG_COUNTS = {HEADER: 2, ISR_ENTER: 1, ISR_EXIT: 1, TASK_SWITCH: 1, BEGIN: 1, END: 0,
+               INSTANT: 1, COUNTER: 2, DROPPED: 1, TASK_NAME: 1}
+
+EXCEPTION_NAMES = {
+    2: "NMI", 3: "HardFault", 4: "MemManage", 5: "BusFault", 6: "UsageFault",
+    11: "SVCall", 12: "DebugMon", 14: "PendSV", 15: "SysTick"}
+
+_BANNER = b"SEGGER J-Link - Real time terminal output\r\nProcess: rtttrace replay\r\n"
+
+
+class TraceError(Exception):
+    pass
+
+
+def load_strings(firmware):
+    """Returns {name id: text} from the `.trace_str` section."""
+    if not isinstance(firmware, elf.ElfFile):
+        firmware = elf.ElfFile(firmware)
+    section = firmware.section(SECTION)
+    if section is None:
+        return {}
+    data = firmware.read_section(section)
+    strings = {}
+    pos = 0
+    while pos < len(data):
+        if data[pos] == 0:
+            pos += 1
+            continue
+        end = data.index(b"\x00", pos)
+        strings[section.addr + pos] = data[pos:end].decode("utf-8", "replace")
+        pos = end + 1
+    return strings
+
+
+def load_irq_names(svd_path):
+    """Returns {exception number: name} from the interrupts of an SVD file."""
+    names = dict(EXCEPTION_NAMES)
+    for _, node in ElementTree.iterparse(svd_path):
+        if node.tag == "interrupt":
+            try:
+                names[int(node.findtext("value")) + 16] = node.findtext("name")
+            except (TypeError, ValueError):
+                pass
+    return names
+
+
+def _leb128(data, pos, end):
+    value = shift = 0
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+    raise ValueError("truncated number")
+
+
+class Decoder(object):
+    """Turns the byte stream into (cycles, type, args, text) events."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.cycles = 0
+        self.records = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def feed(self, data):
+        buf = self.buffer
+        buf.extend(data)
+        events = []
+        pos = 0
+        size = len(buf)
+        while True:
+            pos = buf.find(SYNC, pos)
+            if pos < 0 or pos + 2 > size:
+                break
+            end = pos + 2 + buf[pos + 1]
+            if end > size:
+                break
+            event = self._parse(buf, pos + 2, end)
+            if event is None:
+                # no record, resynchronize at the next sync byte
+                self.errors += 1
+                pos += 1
+                continue
+            events.append(event)
+            pos = end
+        del buf[:pos if pos >= 0 else size]
+        return events
+
+    def _parse(self, buf, pos, end):
+        if pos == end or buf[pos] not in _ARG_COUNTS:
+            return None
+        event_type = buf[pos]
+        try:
+            delta, pos = _leb128(buf, pos + 1, end)
+            args = []
+            for _ in range(_ARG_COUNTS[event_type]):
+                value, pos = _leb128(buf, pos, end)
+                args.append(value)
+        except ValueError:
+            return None
+        text = None
+        if event_type == TASK_NAME:
+            text = bytes(buf[pos:end]).decode("utf-8", "replace")
+        elif pos != end:
+            return None
+        if event_type == HEADER:
+            self.cycles = 0
+        else:
+            self.cycles += delta
+        if event_type == DROPPED:
+            self.dropped += args[0]
+        self.records += 1
+        return self.cycles, event_type, args, text
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, value):
+    if isinstance(value, (bytes, bytearray)):
+        return _varint(number << 3 | 2) + _varint(len(value)) + value
+    if isinstance(value, str):
+        return _field(number, value.encode())
+    if isinstance(value, float):
+        return _varint(number << 3 | 1) + struct.pack("<d", value)
+    return _varint(number << 3) + _varint(value & 0xFFFFFFFFFFFFFFFF)
+
+
+class IrqStats(object):
+    """Handler durations and the jitter of the intervals between entries."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.last_entry = None
+        self.intervals = 0
+        self.interval_mean = 0.0
+        self.interval_m2 = 0.0
+        self.interval_min = None
+        self.interval_max = 0
+
+    def enter(self, ns):
+        if self.last_entry is not None:
+            interval = ns - self.last_entry
+            # Welford's online variance
+            self.intervals += 1
+            diff = interval - self.interval_mean
+            self.interval_mean += diff / self.intervals
+            self.interval_m2 += diff * (interval - self.interval_mean)
+            self.interval_min = interval if self.interval_min is None else min(self.interval_min, interval)
+            self.interval_max = max(self.interval_max, interval)
+        self.last_entry = ns
+
+    def exit(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    @property
+    def jitter(self):
+        return math.sqrt(self.interval_m2 / self.intervals) if self.intervals > 1 else 0.0
+
+
+class PerfettoWriter(object):
+    """Writes decoded events as Perfetto track events."""
+
+    SEQUENCE_ID = 1
+    PROCESS_UUID = 1
+    TRACKS = ("Interrupts", "Tasks", "Markers")
+
+    def __init__(self, fp, frequency, strings=None, irq_names=None, process_name="Teensy"):
+        self.fp = fp
+        self.frequency = frequency
+        self.strings = strings or {}
+        self.irq_names = irq_names or EXCEPTION_NAMES
+        self.task_names = {}
+        self.counter_tracks = {}
+        self.next_uuid = 2 + len(self.TRACKS)
+        self.isr_stack = []
+        self.task = None
+        self.markers = 0
+        self.last_ns = 0
+        self.first_packet = True
+        self.stats = {}
+        self.packets = 0
+        self._packet(_field(60, _field(1, self.PROCESS_UUID) + _field(3, _field(1, 1) + _field(6, process_name))))
+        for tid, name in enumerate(self.TRACKS, 1):
+            self._packet(_field(60, _field(1, self._track(name)) + _field(5, self.PROCESS_UUID)
+                                + _field(4, _field(1, 1) + _field(2, tid) + _field(5, name))))
+
+    def _track(self, name):
+        return 2 + self.TRACKS.index(name)
+
+    def _packet(self, payload):
+        packet = _field(10, self.SEQUENCE_ID) + payload
+        if self.first_packet:
+            packet += _field(13, 1)  # SEQ_INCREMENTAL_STATE_CLEARED
+            self.first_packet = False
+        self.fp.write(_field(1, packet))
+        self.packets += 1
+
+    def _track_event(self, ns, track, event_type, name=None, counter=None):
+        event = _field(9, event_type) + _field(11, track)
+        if name is not None:
+            event += _field(23, name)
+        if counter is not None:
+            event += _field(30, counter)
+        self._packet(_field(8, ns) + _field(11, event))
+
+    def name(self, name_id):
+        return self.strings.get(name_id, "0x%x" % name_id)
+
+    def irq_name(self, exception):
+        return self.irq_names.get(exception, "IRQ %d" % (exception - 16))
+
+    def event(self, cycles, event_type, args, text=None):
+        if event_type == HEADER:
+            if args[1]:
+                self.frequency = args[1]
+            return
+        ns = cycles * 1000000000 // self.frequency
+        self.last_ns = ns
+        if event_type == ISR_ENTER:
+            stats = self.stats.setdefault(args[0], IrqStats())
+            stats.enter(ns)
+            if len(self.isr_stack) < 64:
+                self.isr_stack.append((args[0], ns))
+                self._track_event(ns, self._track("Interrupts"), 1, self.irq_name(args[0]))
+        elif event_type == ISR_EXIT:
+            if self.isr_stack and self.isr_stack[-1][0] == args[0]:
+                _, start = self.isr_stack.pop()
+                self.stats[args[0]].exit(ns - start)
+                self._track_event(ns, self._track("Interrupts"), 2)
+        elif event_type == TASK_NAME:
+            self.task_names[args[0]] = text
+        elif event_type == TASK_SWITCH:
+            if self.task is not None:
+                self._track_event(ns, self._track("Tasks"), 2)
+            self.task = args[0]
+            self._track_event(
+                ns, self._track("Tasks"), 1, self.task_names.get(args[0]) or "task 0x%x" % args[0])
+        elif event_type == BEGIN:
+            self.markers += 1
+            self._track_event(ns, self._track("Markers"), 1, self.name(args[0]))
+        elif event_type == END:
+            if self.markers:
+                self.markers -= 1
+                self._track_event(ns, self._track("Markers"), 2)
+        elif event_type == INSTANT:
+            self._track_event(ns, self._track("Markers"), 3, self.name(args[0]))
+        elif event_type == COUNTER:
+            self._track_event(ns, self._counter_track(args[0]), 4,
+                              counter=(args[1] >> 1) ^ -(args[1] & 1))
+        elif event_type == DROPPED:
+            # the intervals across the gap are unknown, and the exits of the open
+            # handlers may be among the dropped records
+            for stats in self.stats.values():
+                stats.last_entry = None
+            for _ in self.isr_stack:
+                self._track_event(ns, self._track("Interrupts"), 2)
+            self.isr_stack = []
+            self._track_event(ns, self._track("Markers"), 3, "%d records dropped" % args[0])
+
+    def _counter_track(self, name_id):
+        uuid = self.counter_tracks.get(name_id)
+        if uuid is None:
+            uuid = self.counter_tracks[name_id] = self.next_uuid
+            self.next_uuid += 1
+            self._packet(_field(60, _field(1, uuid) + _field(5, self.PROCESS_UUID)
+                                + _field(2, self.name(name_id)) + _field(8, b"")))
+        return uuid
+
+    def close(self):
+        """Ends the slices that are still open."""
+        for _ in self.isr_stack:
+            self._track_event(self.last_ns, self._track("Interrupts"), 2)
+        if self.task is not None:
+            self._track_event(self.last_ns, self._track("Tasks"), 2)
+        for _ in range(self.markers):
+            self._track_event(self.last_ns, self._track("Markers"), 2)
+        self.isr_stack = []
+        self.task = None
+        self.markers = 0
+
+    def format_stats(self):
+        lines = ["%-24s %8s %10s %10s %12s %10s" % (
+            "Interrupt", "Count", "Mean us", "Max us", "Period us", "Jitter us")]
+        for exception, stats in sorted(self.stats.items()):
+            lines.append("%-24s %8d %10.2f %10.2f %12.2f %10.2f" % (
+                self.irq_name(exception), stats.count,
+                stats.total / stats.count / 1000.0 if stats.count else 0.0, stats.max / 1000.0,
+                stats.interval_mean / 1000.0, stats.jitter / 1000.0))
+        return "\n".join(lines)
+
+
+class Capture(object):
+    """Decodes a stream into a Perfetto file, optionally keeping the raw bytes for replay."""
+
+    def __init__(self, output, frequency, strings=None, irq_names=None, raw_path=None,
+                 process_name="Teensy"):
+        self._fp = open(output, "wb")
+        self._raw = open(raw_path, "wb") if raw_path else None
+        self.decoder = Decoder()
+        self.writer = PerfettoWriter(self._fp, frequency, strings, irq_names, process_name)
+
+    def feed(self, data):
+        if self._raw:
+            self._raw.write(data)
+        for event in self.decoder.feed(data):
+            self.writer.event(*event)
+
+    def close(self):
+        self.writer.close()
+        self._fp.close()
+        if self._raw:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parse_address(value, default_port=DEFAULT_PORT):
+    host, _, port = value.rpartition(":")
+    if not host:
+        return value or "127.0.0.1", default_port
+    return host, int(port)
+
+
+def is_listening(address, timeout=0.5):
+    try:
+        socket.create_connection(address, timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def capture_socket(address, capture, duration=None, chunk_size=1 << 16):
+    """Reads from the RTT telnet port until it is closed, `duration` ends or Ctrl+C."""
+    deadline = time.time() + duration if duration else None
+    try:
+        sock = socket.create_connection(address, timeout=5)
+    except OSError as exc:
+        raise TraceError("cannot connect to %s:%d: %s" % (address[0], address[1], exc))
+    sock.settimeout(0.5)
+    try:
+        while deadline is None or time.time() < deadline:
+            try:
+                data = sock.recv(chunk_size)
+            except socket.timeout:
+                continue
+            if not data:
+                break
+            capture.feed(data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+def capture_file(path, capture, chunk_size=1 << 16):
+    with open(path, "rb") as fp:
+        while True:
+            data = fp.read(chunk_size)
+            if not data:
+                break
+            capture.feed(data)
+
+
+def serve(path, address, chunk_size=4096, rate=None, connections=1):
+    """Replays a recorded stream like the J-Link RTT telnet server, for testing."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen(1)
+    try:
+        for _ in range(connections):
+            conn, _ = server.accept()
+            with conn, open(path, "rb") as fp:
+                conn.sendall(_BANNER)
+                while True:
+                    data = fp.read(chunk_size)
+                    if not data:
+                        break
+                    conn.sendall(data)
+                    if rate:
+                        time.sleep(len(data) / float(rate))
+    finally:
+        server.close()
+
+
+def print_summary(capture, output):
+    print(capture.writer.format_stats())
+    print("%d records, %d dropped on the target, %d decoding errors" % (
+        capture.decoder.records, capture.decoder.dropped, capture.decoder.errors))
+    print("Trace written to %s, open it in https://ui.perfetto.dev" % output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert TeensyTrace RTT streams to Perfetto traces")
+    subparsers = parser.add_subparsers(dest="command")
+    for name in ("capture", "convert"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("firmware", help="ELF file of the running firmware")
+        if name == "convert":
+            sub.add_argument("input", help="recorded raw stream")
+        else:
+            sub.add_argument("--address", default="127.0.0.1:%d" % DEFAULT_PORT,
+                             help="RTT telnet server")
+            sub.add_argument("--duration", type=float, help="seconds, default until Ctrl+C")
+            sub.add_argument("--raw", help="also save the raw stream for replay")
+        sub.add_argument("-o", "--output", default="trace.perfetto-trace")
+        sub.add_argument("--frequency", type=int, default=600000000,
+                         help="timestamp frequency if the stream has no header")
+        sub.add_argument("--svd", help="SVD file for interrupt names")
+    sub = subparsers.add_parser("serve", help="replay a raw stream on a local TCP port")
+    sub.add_argument("input")
+    sub.add_argument("--address", default="127.0.0.1:%d" % DEFAULT_PORT)
+    sub.add_argument("--rate", type=int, help="bytes per second")
+    sub.add_argument("--connections", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.input, parse_address(args.address), rate=args.rate,
+              connections=args.connections)
+        return 0
+    if args.command not in ("capture", "convert"):
+        parser.print_help()
+        return 1
+    try:
+        irq_names = load_irq_names(args.svd) if args.svd else None
+        capture = Capture(args.output, args.frequency, load_strings(args.firmware), irq_names,
+                          getattr(args, "raw", None), os.path.basename(args.firmware))
+        with capture:
+            if args.command == "convert":
+                capture_file(args.input, capture)
+            else:
+                capture_socket(parse_address(args.address), capture, args.duration)
+    except (TraceError, elf.ElfError, OSError) as exc:
+        sys.stderr.write("Error: %s\n" % exc)
+        return 1
+    print_summary(capture, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Size report cache
+
+The output of the size tool and the totals per memory region are stored in
+`<firmware>.size.json` next to the firmware together with the SHA-256 of the
+ELF file. The file can be read by other tools without a toolchain:
+
+    {"elf": "<sha256>", "sections": "<size -A -d output>",
+     "summary": "<size report>", "regions": {"program": 1234, ...},
+     "checks": {"teensy_size": {"returncode": 0, "err": ""}}}
+
+`checks` holds the results of external size checks of the same ELF file.
+Run as a script, the section table of a report is printed, so it can stand
+in for the size tool in PlatformIO's upload size check.
+"""
+
+import json
+import os
+import re
+import sys
+
+REPORT_FORMAT = 1
+
+
+def report_path(firmware):
+    return os.path.splitext(firmware)[0] + ".size.json"
+
+
+def load(path, digest):
+    """Returns the cached report for the ELF hash `digest` or None."""
+    try:
+        with open(path) as fp:
+            report = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if report.get("format") != REPORT_FORMAT or report.get("elf") != digest:
+        return None
+    return report
+
+
+def save(path, report):
+    report["format"] = REPORT_FORMAT
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "w") as fp:
+            json.dump(report, fp, indent=1)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+
+def load_check(path, digest, name):
+    """Returns the cached result of the check `name` for the ELF hash `digest` or None."""
+    return ((load(path, digest) or {}).get("checks") or {}).get(name)
+
+
+def save_check(path, digest, name, result):
+    report = load(path, digest) or dict(elf=digest, sections=None, summary=None, regions={})
+    report.setdefault("checks", {})[name] = result
+    save(path, report)
+
+
+def calculate(output, pattern):
+    """Sum of all sizes in `output` (size -A -d) matching `pattern`, -1 if unknown."""
+    if not output or not pattern:
+        return -1
+    size = 0
+    regexp = re.compile(pattern)
+    for line in output.split("\n"):
+        match = regexp.search(line.strip())
+        if match:
+            size += sum(int(value) for value in match.groups())
+    return size
+
+
+def format_usage(value, total):
+    percent = float(value) / float(total)
+    blocks = min(int(round(10 * percent)), 10)
+    return "[{:{}}] {: 6.1%} (used {:d} bytes from {:d} bytes)".format(
+        "=" * blocks, 10, percent, value, total)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        sys.stderr.write("usage: sizecache.py <firmware>.size.json\n")
+        return 1
+    try:
+        with open(argv[0]) as fp:
+            sections = json.load(fp).get("sections")
+    except (OSError, ValueError) as exc:
+        sys.stderr.write("%s\n" % exc)
+        return 1
+    if sections is None:
+        return 1
+    print(sections)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Static worst-case stack usage
+
+Combines the per-function frame sizes from GCC's `-fstack-usage` with the
+call graph written by `-fcallgraph-info=su` (one VCG file per translation
+unit) and computes the deepest path from each entry point.
+"""
+
+import os
+import re
+from fnmatch import fnmatch
+
+INDIRECT_CALL = "__indirect_call"
+
+# exception entry pushes 8 words, or 26 words with a lazily stacked FPU context
+EXCEPTION_FRAME = 32
+EXCEPTION_FRAME_FPU = 104
+
+DEFAULT_ENTRY_POINTS = ("setup", "_Z5setupv", "loop", "_Z4loopv", "main")
+ISR_PATTERNS = ("*_isr", "*_IRQHandler", "*_Handler", "*_handler_isr")
+
+_NODE_RE = re.compile(r'^node:\s*{\s*title:\s*"([^"]*)"\s*label:\s*"([^"]*)"')
+_EDGE_RE = re.compile(r'^edge:\s*{\s*sourcename:\s*"([^"]*)"\s*targetname:\s*"([^"]*)"')
+_BYTES_RE = re.compile(r"(\d+) bytes \(([a-z,]+)\)")
+# location and function name, the size and the qualifiers are split off from the right
+_SU_RE = re.compile(r"^(.*?):(\d+):(\d+):(.+)$")
+
+
+class CallGraph(object):
+    """Call graph with functions mapped to dense integer indices."""
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.labels = []
+        self.frame = []  # bytes, None when no stack information is known
+        self.dynamic = []
+        self.callees = []
+
+    def node(self, name, label=None):
+        idx = self.index.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.index[name] = idx
+            self.names.append(name)
+            self.labels.append(label or name)
+            self.frame.append(None)
+            self.dynamic.append(False)
+            self.callees.append([])
+        elif label and self.labels[idx] == name:
+            self.labels[idx] = label
+        return idx
+
+    def set_frame(self, name, size, qualifier, label=None):
+        idx = self.node(name, label)
+        if self.frame[idx] is None or size > self.frame[idx]:
+            self.frame[idx] = size
+        if qualifier != "static":
+            self.dynamic[idx] = self.dynamic[idx] or "bounded" not in qualifier
+        return idx
+
+    def edge(self, source, target):
+        src = self.node(source)
+        dst = self.node(target)
+        if dst not in self.callees[src]:
+            self.callees[src].append(dst)
+
+    def find(self, names):
+        result = []
+        for name in names:
+            if name in self.index:
+                result.append(self.index[name])
+                continue
+            # static functions are prefixed with their file name
+            for title, idx in self.index.items():
+                if title.endswith(":" + name) or self.labels[idx] == name:
+                    result.append(idx)
+        return sorted(set(result))
+
+    def match(self, patterns):
+        return [idx for idx, label in enumerate(self.labels)
+                if self.frame[idx] is not None
+                and any(fnmatch(label, p) for p in patterns)]
+
+
+def parse_callgraph_info(text, graph):
+    for line in text.splitlines():
+        line = line.strip()
+        match = _NODE_RE.match(line)
+        if match:
+            title, label = match.groups()
+            parts = label.split("\\n")
+            frame = _BYTES_RE.search(label)
+            if frame:
+                graph.set_frame(title, int(frame.group(1)), frame.group(2), parts[0])
+            else:
+                graph.node(title, parts[0])
+            continue
+        match = _EDGE_RE.match(line)
+        if match:
+            graph.edge(*match.groups())
+    return graph
+
+
+def parse_stack_usage(text, graph):
+    for line in text.splitlines():
+        fields = line.strip().rsplit(None, 2)
+        if len(fields) != 3 or not fields[1].isdigit():
+            continue
+        # C++ names contain spaces, e.g. `main.cpp:5:6:void setup()  16  static`
+        match = _SU_RE.match(fields[0])
+        if match:
+            graph.set_frame(match.group(4).strip(), int(fields[1]), fields[2])
+    return graph
+
+
+def load(build_dir):
+    """Collect all .ci (or, for older compilers, .su) files below build_dir."""
+    graph = CallGraph()
+    callgraph_found = False
+    su_files = []
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            base, ext = os.path.splitext(path)
+            if ext not in (".ci", ".su") or not os.path.isfile(base + ".o"):
+                continue
+            if ext == ".ci":
+                callgraph_found = True
+                with open(path, encoding="utf-8", errors="replace") as fp:
+                    parse_callgraph_info(fp.read(), graph)
+            else:
+                su_files.append(path)
+    if not callgraph_found:
+        for path in su_files:
+            with open(path, encoding="utf-8", errors="replace") as fp:
+                parse_stack_usage(fp.read(), graph)
+    return graph, callgraph_found
+
+
+def worst_case(graph, root, shared=None):
+    """Deepest stack path from root.
+
+    Returns (bytes, path, flags) where flags is a set of "recursion",
+    "indirect", "dynamic" and "unknown" describing why the result may be
+    an underestimate. `shared` keeps the results of functions outside of
+    recursive cycles between calls for different roots, which do not depend
+    on the root.
+    """
+    if shared is None:
+        shared = {}
+    memo = {}
+    flags_memo = {}
+    state = {}  # missing new, 1 on stack, 2 done
+
+    def reuse(idx):
+        if idx not in shared:
+            return False
+        memo[idx], flags = shared[idx]
+        flags_memo[idx] = set(flags)
+        state[idx] = 2
+        return True
+
+    # iterative post-order DFS, recursion depth of real firmwares is too deep
+    stack = []
+    if not reuse(root):
+        stack.append((root, 0))
+        state[root] = 1
+    while stack:
+        idx, child = stack[-1]
+        callees = graph.callees[idx]
+        if child < len(callees):
+            stack[-1] = (idx, child + 1)
+            nxt = callees[child]
+            if nxt not in state and not reuse(nxt):
+                state[nxt] = 1
+                stack.append((nxt, 0))
+            elif state[nxt] == 1:
+                flags_memo.setdefault(idx, set()).add("recursion")
+            continue
+        stack.pop()
+        state[idx] = 2
+        flags = flags_memo.setdefault(idx, set())
+        if graph.names[idx] == INDIRECT_CALL:
+            flags.add("indirect")
+        elif graph.frame[idx] is None:
+            flags.add("unknown")
+        if graph.dynamic[idx]:
+            flags.add("dynamic")
+        best, best_path = 0, []
+        for nxt in callees:
+            if state.get(nxt) != 2 or nxt not in memo:
+                continue
+            flags |= flags_memo.get(nxt, set())
+            if memo[nxt][0] > best:
+                best, best_path = memo[nxt]
+        memo[idx] = ((graph.frame[idx] or 0) + best, [idx] + best_path)
+        if "recursion" not in flags:
+            shared[idx] = (memo[idx], frozenset(flags))
+    depth, path = memo[root]
+    return depth, [graph.labels[i] for i in path], flags_memo[root]
+
+
+def analyze(build_dir, entry_points=(), fpu=False):
+    graph, has_callgraph = load(build_dir)
+    frame = EXCEPTION_FRAME_FPU if fpu else EXCEPTION_FRAME
+    results = []
+    shared = {}
+    for idx in graph.find(list(DEFAULT_ENTRY_POINTS) + list(entry_points)):
+        depth, path, flags = worst_case(graph, idx, shared)
+        results.append(dict(kind="entry", name=graph.labels[idx],
+                            depth=depth, path=path, flags=flags))
+    for idx in graph.match(ISR_PATTERNS):
+        depth, path, flags = worst_case(graph, idx, shared)
+        results.append(dict(kind="isr", name=graph.labels[idx],
+                            depth=depth + frame, path=path, flags=flags))
+    entries = [r["depth"] for r in results if r["kind"] == "entry"]
+    isrs = [r["depth"] for r in results if r["kind"] == "isr"]
+    total = (max(entries) if entries else 0) + (max(isrs) if isrs else 0)
+    return dict(results=results, total=total, callgraph=has_callgraph,
+                functions=len(graph.names))
+
+
+def format_summary(report):
+    flags = set()
+    for result in report["results"]:
+        flags |= result["flags"]
+    notes = ", ".join(sorted(flags))
+    return "%d bytes worst case%s" % (
+        report["total"], " (%s)" % notes if notes else "")
+
+
+def format_report(report):
+    lines = []
+    if not report["callgraph"]:
+        lines.append("No call graph information, showing single frames only")
+    for result in sorted(report["results"], key=lambda r: (r["kind"], -r["depth"])):
+        lines.append("%-5s %7d  %s%s" % (
+            result["kind"], result["depth"], result["name"],
+            " [%s]" % ", ".join(sorted(result["flags"])) if result["flags"] else ""))
+        if len(result["path"]) > 1:
+            lines.append("              " + " -> ".join(result["path"]))
+    lines.append("total %7d  deepest entry point + deepest ISR" % report["total"])
+    return "\n".join(lines)
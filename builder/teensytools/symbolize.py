@@ -0,0 +1,182 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Batched address symbolizer for crash reports and backtraces
+
+The function ranges of the symbol table are kept as a sorted index next to
+the firmware (`<firmware>.symbols.json`) together with every address that was
+resolved before. Addresses not found in the cache are resolved by a single
+`addr2line -a -f -i -C` process, which reads the DWARF line tables once for
+the whole batch and also reports inlined frames.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import re
+import subprocess
+import sys
+
+from . import elf
+
+INDEX_FORMAT = 1
+
+_ADDRESS_RE = re.compile(r"\b0x([0-9a-fA-F]{1,8})\b")
+_HEX_LINE_RE = re.compile(r"^0x[0-9a-fA-F]+$")
+
+
+class Symbolizer(object):
+
+    def __init__(self, firmware_path, addr2line=None, sysenv=None, cache_path=None):
+        self.firmware_path = firmware_path
+        self.addr2line = addr2line
+        self.sysenv = sysenv
+        self.cache_path = cache_path or firmware_path + ".symbols.json"
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        digest = elf.file_hash(self.firmware_path)
+        try:
+            with open(self.cache_path) as fp:
+                index = json.load(fp)
+            if index.get("format") != INDEX_FORMAT or index.get("elf") != digest:
+                raise ValueError("outdated")
+        except (OSError, ValueError):
+            index = dict(format=INDEX_FORMAT, elf=digest, functions=[], frames={})
+            for sym in elf.ElfFile(self.firmware_path).functions():
+                index["functions"].append([sym.value, sym.size, sym.name])
+            self._dirty = True
+        self.index = index
+        self.frames = index["frames"]
+        self.starts = [item[0] for item in index["functions"]]
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        try:
+            with open(tmp_path, "w") as fp:
+                json.dump(self.index, fp)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+        except OSError:
+            pass
+
+    def function_at(self, addr):
+        """Returns (name, offset) of the function containing `addr` or None."""
+        addr &= ~1
+        pos = bisect.bisect_right(self.starts, addr) - 1
+        if pos < 0:
+            return None
+        start, size, name = self.index["functions"][pos]
+        if addr >= start + size:
+            return None
+        return name, addr - start
+
+    def resolve(self, addresses):
+        """Returns {address: [[function, location], ...]}, innermost frame first.
+
+        Addresses outside of all functions are not resolved.
+        """
+        result = {}
+        pending = {}
+        for addr in set(addresses):
+            code = addr & ~1
+            if self.function_at(code) is None:
+                continue
+            key = "%x" % code
+            if key in self.frames:
+                result[addr] = self.frames[key]
+            else:
+                pending.setdefault(code, []).append(addr)
+        if pending:
+            resolved = self._run_addr2line(sorted(pending))
+            for code, originals in pending.items():
+                name, offset = self.function_at(code)
+                frames = resolved.get(code) or [[name, "+0x%x" % offset]]
+                self.frames["%x" % code] = frames
+                for addr in originals:
+                    result[addr] = frames
+            self._dirty = True
+        return result
+
+    def _run_addr2line(self, addresses):
+        if not self.addr2line:
+            return {}
+        try:
+            proc = subprocess.run(
+                [self.addr2line, "-e", self.firmware_path, "-a", "-f", "-i", "-C"],
+                input="\n".join("0x%x" % addr for addr in addresses) + "\n",
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True, env=self.sysenv, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return {}
+        result = {}
+        frames = None
+        lines = proc.stdout.splitlines()
+        pos = 0
+        while pos < len(lines):
+            line = lines[pos].strip()
+            if _HEX_LINE_RE.match(line):
+                frames = result.setdefault(int(line, 16), [])
+                pos += 1
+                continue
+            location = lines[pos + 1].strip() if pos + 1 < len(lines) else "??"
+            if frames is not None and line != "??":
+                frames.append([line, location.split(" (discriminator")[0]])
+            pos += 2
+        return result
+
+    def annotate(self, lines):
+        """Appends the resolved frames after every line mentioning a code address."""
+        lines = list(lines)
+        addresses = []
+        for line in lines:
+            addresses.extend(int(m, 16) for m in _ADDRESS_RE.findall(line))
+        resolved = self.resolve(addresses)
+        output = []
+        for line in lines:
+            output.append(line)
+            for match in _ADDRESS_RE.findall(line):
+                for depth, (function, location) in enumerate(resolved.get(int(match, 16), [])):
+                    output.append("    0x%s: %s%s at %s" % (
+                        match, "(inlined by) " if depth else "", function, location))
+        self.save()
+        return output
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resolve code addresses in crash logs")
+    parser.add_argument("elf", help="firmware the log was produced by")
+    parser.add_argument("log", nargs="?", help="log file, default standard input")
+    parser.add_argument("--addr2line", default="arm-cortexm7f-eabi-addr2line",
+                        help="addr2line of the toolchain")
+    args = parser.parse_args(argv)
+    if args.log:
+        with open(args.log, errors="replace") as fp:
+            text = fp.read()
+    else:
+        text = sys.stdin.read()
+    symbolizer = Symbolizer(args.elf, args.addr2line)
+    for line in symbolizer.annotate(text.splitlines()):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,319 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""
+Unity test suites linked into a single firmware
+
+Every `test_*` directory below the test directory is a suite. Its objects
+and a private copy of Unity are linked into one relocatable object, then all
+strong global definitions except `setup()` are made local, so `setUp()`,
+`tearDown()`, the test functions and the Unity state do not collide between
+suites. `setup()` is renamed to `teensy_test_suite_<n>_setup`; a generated
+dispatcher calls these in sequence and prints a marker line before each
+suite. Weak symbols (inline functions, templates) and undefined references
+stay global and are resolved against the shared core and libraries.
+
+The host side reads the serial output and splits the Unity results per suite.
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import re
+import sys
+import time
+
+from . import elf
+from .uploadd import PJRC_VID
+
+SOURCE_SUFFIXES = (".c", ".cpp", ".cc", ".cxx", ".S")
+ENTRY_NAMES = ("setup", "_Z5setupv")
+SUITE_MARKER = "TEENSY_TEST_SUITE "
+END_MARKER = "TEENSY_TEST_BUNDLE_END"
+
+_RESULT_RE = re.compile(
+    r"^(?P<file>.+?):(?P<line>\d+):(?P<test>[^:]+):(?P<status>PASS|FAIL|IGNORE)(?::\s?(?P<message>.*))?$")
+_SUMMARY_RE = re.compile(r"^(\d+) Tests (\d+) Failures (\d+) Ignored")
+
+UNITY_CONFIG = """\
+#ifndef UNITY_CONFIG_H
+#define UNITY_CONFIG_H
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+void teensy_test_output_char(int c);
+void teensy_test_output_flush(void);
+#ifdef __cplusplus
+}
+#endif
+
+#define UNITY_OUTPUT_CHAR(c) teensy_test_output_char(c)
+#define UNITY_OUTPUT_FLUSH() teensy_test_output_flush()
+
+#endif
+"""
+
+
+class BundleError(Exception):
+    pass
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def find_suites(test_dir, filters=(), ignores=()):
+    """Sorted (name, directory) of the `test_*` suites, `name` relative to `test_dir`."""
+    suites = []
+    for root, dirs, _ in os.walk(test_dir):
+        dirs.sort()
+        for directory in list(dirs):
+            if not directory.startswith("test_"):
+                continue
+            dirs.remove(directory)
+            path = os.path.join(root, directory)
+            name = os.path.relpath(path, test_dir).replace(os.sep, "/")
+            if filters and not _matches(name, filters):
+                continue
+            if not _matches(name, ignores):
+                suites.append((name, path))
+    return sorted(suites)
+
+
+def suite_sources(suite_dir):
+    sources = []
+    for root, dirs, files in os.walk(suite_dir):
+        dirs.sort()
+        sources.extend(os.path.join(root, f) for f in sorted(files) if f.endswith(SOURCE_SUFFIXES))
+    return sources
+
+
+def entry_name(index):
+    return "teensy_test_suite_%d_setup" % index
+
+
+def render_dispatcher(names):
+    lines = ["// generated by teensytools/testbundle.py", "#include <Arduino.h>", "",
+             'extern "C" {']
+    lines.extend("void %s(void);" % entry_name(i) for i in range(len(names)))
+    lines.extend([
+        "",
+        "void teensy_test_output_char(int c) { Serial.write((uint8_t)c); }",
+        "void teensy_test_output_flush(void) { Serial.flush(); }",
+        "}",
+        "",
+        "static const struct { const char* name; void (*setup)(void); } suites[] = {",
+    ])
+    lines.extend('    {"%s", %s},' % (name, entry_name(i)) for i, name in enumerate(names))
+    lines.extend([
+        "};",
+        "",
+        "void setup() {",
+        "    while (!Serial) {",
+        "    }",
+        "    for (const auto& suite : suites) {",
+        '        Serial.print("%s");' % SUITE_MARKER,
+        "        Serial.println(suite.name);",
+        "        suite.setup();",
+        "        Serial.flush();",
+        "    }",
+        '    Serial.println("%s");' % END_MARKER,
+        "}",
+        "",
+        "void loop() {}",
+        "",
+    ])
+    return "\n".join(lines)
+
+
+def write_if_changed(path, content):
+    """Keeps the timestamp of unchanged generated files, so nothing is rebuilt."""
+    if os.path.isfile(path):
+        with open(path) as fp:
+            if fp.read() == content:
+                return
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def suite_symbols(relocatable):
+    """(setup symbol or None, strong global definitions to localize) of a partially linked suite."""
+    entry = None
+    localize = []
+    for sym in relocatable.symbols:
+        if sym.bind != elf.STB_GLOBAL or sym.section is None or not sym.name:
+            continue
+        if sym.name in ENTRY_NAMES:
+            entry = sym.name
+        else:
+            localize.append(sym.name)
+    return entry, sorted(set(localize))
+
+
+def parse_output(text):
+    """Unity results per suite from the serial output of the bundle."""
+    suites = []
+    current = None
+    finished = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith(SUITE_MARKER):
+            current = dict(name=line[len(SUITE_MARKER):].strip(), tests=[], complete=False)
+            suites.append(current)
+            continue
+        if line == END_MARKER:
+            finished = True
+            continue
+        if current is None:
+            continue
+        match = _RESULT_RE.match(line)
+        if match:
+            current["tests"].append(dict(
+                name=match.group("test"), status=match.group("status"),
+                file=match.group("file"), line=int(match.group("line")),
+                message=match.group("message") or ""))
+        elif _SUMMARY_RE.match(line):
+            current["complete"] = True
+    for suite in suites:
+        statuses = [test["status"] for test in suite["tests"]]
+        suite["passed"] = statuses.count("PASS")
+        suite["failed"] = statuses.count("FAIL")
+        suite["ignored"] = statuses.count("IGNORE")
+        suite["ok"] = suite["complete"] and not suite["failed"]
+    return dict(suites=suites, finished=finished)
+
+
+def format_results(results, expected=()):
+    lines = []
+    seen = set()
+    for suite in results["suites"]:
+        seen.add(suite["name"])
+        state = "PASSED" if suite["ok"] else ("FAILED" if suite["complete"] else "ABORTED")
+        lines.append("%-40s %-8s %3d passed %3d failed %3d ignored" % (
+            suite["name"], state, suite["passed"], suite["failed"], suite["ignored"]))
+        for test in suite["tests"]:
+            if test["status"] == "FAIL":
+                lines.append("    %s:%d: %s: %s" % (
+                    test["file"], test["line"], test["name"], test["message"]))
+    for name in expected:
+        if name not in seen:
+            lines.append("%-40s %-8s" % (name, "NOT RUN"))
+    return "\n".join(lines)
+
+
+def succeeded(results, expected=()):
+    names = set(suite["name"] for suite in results["suites"])
+    return (results["finished"] and set(expected) <= names
+            and all(suite["ok"] for suite in results["suites"]))
+
+
+def find_port():
+    from serial.tools import list_ports
+    for port in sorted(list_ports.comports(), key=lambda p: p.device):
+        if port.vid == PJRC_VID:
+            return port.device
+    return None
+
+
+def capture(port, timeout, speed=115200, echo=None):
+    """Serial output of the bundle until the end marker or `timeout` seconds."""
+    try:
+        import serial
+    except ImportError:
+        raise BundleError("pyserial is required to read the test results")
+    deadline = time.monotonic() + timeout
+    connection = None
+    while connection is None:
+        device = port or find_port()
+        try:
+            if device:
+                connection = serial.Serial(device, speed, timeout=0.2)
+        except serial.SerialException:
+            pass
+        if connection is None:
+            if time.monotonic() > deadline:
+                raise BundleError("serial port %s not available" % (port or "of a Teensy"))
+            time.sleep(0.2)
+    text = ""
+    pending = b""
+    with connection:
+        while time.monotonic() < deadline:
+            try:
+                pending += connection.read(4096)
+            except serial.SerialException:
+                break
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                line = line.decode("utf-8", "replace").rstrip("\r")
+                text += line + "\n"
+                if echo:
+                    echo(line)
+                if line.strip() == END_MARKER:
+                    return text
+    return text
+
+
+def save(path, results):
+    with open(path, "w") as fp:
+        json.dump(results, fp, indent=1)
+        fp.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Results of a test bundle firmware")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+    cmd = sub.add_parser("parse", help="split a saved serial capture into suites")
+    cmd.add_argument("capture")
+    cmd = sub.add_parser("capture", help="read the results from the serial port")
+    cmd.add_argument("--port", help="default: first Teensy")
+    cmd.add_argument("--timeout", type=float, default=300)
+    cmd.add_argument("--output", help="save the raw capture")
+    cmd = sub.add_parser("suites", help="list the suites of a test directory")
+    cmd.add_argument("test_dir")
+    cmd.add_argument("--filter", action="append", default=[])
+    cmd.add_argument("--ignore", action="append", default=[])
+    args = parser.parse_args(argv)
+
+    if args.command == "suites":
+        for name, path in find_suites(args.test_dir, args.filter, args.ignore):
+            print("%-40s %d sources" % (name, len(suite_sources(path))))
+        return 0
+    if args.command == "parse":
+        with open(args.capture, encoding="utf-8", errors="replace") as fp:
+            text = fp.read()
+    else:
+        try:
+            text = capture(args.port, args.timeout, echo=print)
+        except BundleError as exc:
+            sys.stderr.write("Error: %s\n" % exc)
+            return 1
+        if args.output:
+            with open(args.output, "w") as fp:
+                fp.write(text)
+    results = parse_output(text)
+    print(format_results(results))
+    return 0 if succeeded(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
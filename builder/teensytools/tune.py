@@ -0,0 +1,288 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Compiler flag autotuner
+
+Searches a flag space with coordinate descent: starting from the first
+choice of every dimension, all alternatives of one dimension are built in
+parallel and the best one is kept before moving on to the next dimension.
+Passes are repeated until nothing improves.
+
+Candidates are built by `pio run` with the profile passed in the
+TEENSY_OPT_PROFILE environment variable. Every build slot keeps its build
+directory and all slots share one build cache, so objects are only
+recompiled if their flags changed. Results are memoized per profile and
+source state in `results.json`.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import queue
+import re
+import shlex
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import elf
+
+LTO_FLAG = "-flto"
+
+# every dimension lists alternative flag sets, the first one is the baseline
+DEFAULT_SPACE = [
+    ("opt", [["-O2"], ["-Os"], ["-O1"], ["-O3"]]),
+    # LTO builds always use -fipa-pta, so it is only an alternative without LTO
+    ("lto", [[], ["-fipa-pta"], [LTO_FLAG]]),
+    ("inline", [[], ["-finline-limit=50"], ["-finline-limit=300"], ["-fno-inline-small-functions"]]),
+    ("tree", [[], ["-fno-tree-vectorize"], ["-fno-tree-loop-distribute-patterns"], ["-fno-tree-pre"]]),
+    ("pure-code", [[], ["-mpure-code"]]),
+    ("unroll", [[], ["-funroll-loops"]]),
+]
+
+
+class TuneError(Exception):
+    pass
+
+
+def profile_from_choice(space, choice):
+    flags = []
+    for (_, options), index in zip(space, choice):
+        flags.extend(options[index])
+    lto = LTO_FLAG in flags
+    # LTO adds -fipa-pta itself, the same profile must not be built twice
+    redundant = (LTO_FLAG, "-fipa-pta") if lto else (LTO_FLAG,)
+    return dict(flags=[f for f in flags if f not in redundant], lto=lto)
+
+
+def load_profile(value, base_dir=""):
+    """Parses a profile given as JSON text or as path to a JSON file."""
+    text = value.strip()
+    if not text.startswith("{"):
+        path = os.path.join(base_dir, text)
+        try:
+            with open(path) as fp:
+                text = fp.read()
+        except OSError as exc:
+            raise TuneError("cannot read optimization profile %s: %s" % (path, exc))
+    try:
+        profile = json.loads(text)
+    except ValueError as exc:
+        raise TuneError("invalid optimization profile: %s" % exc)
+    if not isinstance(profile.get("flags"), list) or not all(
+            isinstance(f, str) for f in profile["flags"]):
+        raise TuneError("optimization profile needs a list of `flags`")
+    profile["lto"] = bool(profile.get("lto"))
+    return profile
+
+
+def load_space(path):
+    """Reads a flag space: {"dimension": [[flags...], ...], ...}."""
+    with open(path) as fp:
+        data = json.load(fp)
+    space = []
+    for name, options in data.items():
+        if not options or not all(isinstance(o, list) for o in options):
+            raise TuneError("dimension %s needs a list of flag lists" % name)
+        space.append((name, options))
+    return space
+
+
+def image_size(firmware):
+    """Bytes stored in flash: the file size of all loadable segments."""
+    return sum(s.filesz for s in elf.ElfFile(firmware).segments if s.type == elf.PT_LOAD)
+
+
+def source_fingerprint(project_dir):
+    digest = hashlib.sha256()
+    paths = [os.path.join(project_dir, "platformio.ini")]
+    for name in ("src", "include", "lib"):
+        for root, dirs, files in os.walk(os.path.join(project_dir, name)):
+            dirs.sort()
+            paths.extend(os.path.join(root, f) for f in sorted(files))
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update(("%s:%d:%d\n" % (path, stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()
+
+
+class Tuner(object):
+
+    def __init__(self, project_dir, environment, work_dir, space=None, jobs=2,
+                 benchmark=None, maximize=False, python=sys.executable, log=None):
+        self.project_dir = os.path.abspath(project_dir)
+        self.environment = environment
+        self.work_dir = work_dir
+        self.space = space or DEFAULT_SPACE
+        self.benchmark = benchmark
+        self.maximize = maximize
+        self.python = python
+        self.log = log or (lambda text: sys.stdout.write(text + "\n"))
+        self.results_path = os.path.join(work_dir, "results.json")
+        self.fingerprint = source_fingerprint(self.project_dir)
+        self.results = {}
+        try:
+            with open(self.results_path) as fp:
+                self.results = json.load(fp)
+        except (OSError, ValueError):
+            pass
+        self.slots = queue.Queue()
+        for slot in range(max(1, jobs)):
+            self.slots.put(os.path.join(work_dir, "slot%d" % slot))
+        self.jobs = max(1, jobs)
+        self._lock = threading.Lock()
+        self._benchmark_lock = threading.Lock()
+
+    def _key(self, profile):
+        text = json.dumps([self.environment, self.fingerprint, self.benchmark, profile],
+                          sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _save_results(self):
+        tmp_path = "%s.%d.tmp" % (self.results_path, os.getpid())
+        with open(tmp_path, "w") as fp:
+            json.dump(self.results, fp, indent=1)
+        os.replace(tmp_path, self.results_path)
+
+    def build(self, profile, build_dir):
+        env = dict(os.environ)
+        env.update(
+            TEENSY_OPT_PROFILE=json.dumps(profile),
+            PLATFORMIO_BUILD_DIR=build_dir,
+            PLATFORMIO_BUILD_CACHE_DIR=os.path.join(self.work_dir, "cache"),
+        )
+        env.pop("TEENSY_UPLOAD_DAEMON", None)
+        proc = subprocess.run(
+            [self.python, "-m", "platformio", "run", "-d", self.project_dir,
+             "-e", self.environment],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True, env=env)
+        if proc.returncode != 0:
+            return None, proc.stdout[-2000:] or "exit code %d" % proc.returncode
+        firmware = os.path.join(build_dir, self.environment, "firmware.elf")
+        if not os.path.isfile(firmware):
+            return None, "firmware.elf not found in %s" % build_dir
+        return firmware, None
+
+    def score(self, firmware):
+        if not self.benchmark:
+            return float(image_size(firmware))
+        # benchmarks usually need the hardware, run one at a time
+        with self._benchmark_lock:
+            proc = subprocess.run(
+                shlex.split(self.benchmark) + [firmware], cwd=self.project_dir,
+                stdout=subprocess.PIPE, universal_newlines=True)
+        numbers = re.findall(r"[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?", proc.stdout)
+        if proc.returncode != 0 or not numbers:
+            raise TuneError("benchmark failed (exit code %d)" % proc.returncode)
+        return float(numbers[-1])
+
+    def evaluate(self, profile):
+        """Returns the score of `profile` or None if it does not build."""
+        key = self._key(profile)
+        with self._lock:
+            if key in self.results:
+                return self.results[key]["score"]
+        build_dir = self.slots.get()
+        try:
+            firmware, error = self.build(profile, build_dir)
+            score = None
+            if firmware:
+                try:
+                    score = self.score(firmware)
+                except (TuneError, elf.ElfError, OSError) as exc:
+                    error = str(exc)
+        finally:
+            self.slots.put(build_dir)
+        self.log("  %s: %s" % (
+            " ".join(profile["flags"] + ([LTO_FLAG] if profile["lto"] else [])) or "(no flags)",
+            "failed: %s" % error.strip().splitlines()[-1] if error else "%g" % score))
+        with self._lock:
+            self.results[key] = dict(profile=profile, score=score)
+            self._save_results()
+        return score
+
+    def better(self, score, best):
+        if score is None:
+            return False
+        if best is None:
+            return True
+        return score > best if self.maximize else score < best
+
+    def run(self, max_passes=3):
+        if not os.path.isdir(self.work_dir):
+            os.makedirs(self.work_dir)
+        choice = [0] * len(self.space)
+        best = self.evaluate(profile_from_choice(self.space, choice))
+        if best is None:
+            raise TuneError("the baseline profile does not build")
+        with ThreadPoolExecutor(self.jobs) as pool:
+            for pass_index in range(max_passes):
+                improved = False
+                for dim, (name, options) in enumerate(self.space):
+                    self.log("Pass %d, %s" % (pass_index + 1, name))
+                    candidates = []
+                    for index in range(len(options)):
+                        if index != choice[dim]:
+                            candidate = list(choice)
+                            candidate[dim] = index
+                            candidates.append(candidate)
+                    scores = pool.map(
+                        lambda c: self.evaluate(profile_from_choice(self.space, c)), candidates)
+                    for candidate, score in zip(candidates, list(scores)):
+                        if self.better(score, best):
+                            best, choice, improved = score, candidate, True
+                if not improved:
+                    break
+        return profile_from_choice(self.space, choice), best
+
+
+def save_profile(path, profile, score, objective):
+    data = dict(profile, objective=objective, score=score)
+    with open(path, "w") as fp:
+        json.dump(data, fp, indent=2)
+        fp.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search compiler flags for an environment")
+    parser.add_argument("-d", "--project-dir", default=os.getcwd())
+    parser.add_argument("-e", "--environment", required=True)
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="parallel candidate builds")
+    parser.add_argument("--space", help="JSON file with the flag space")
+    parser.add_argument("--benchmark", help="command printing a score for the firmware path "
+                        "appended to it, default is the flash image size")
+    parser.add_argument("--maximize", action="store_true", help="higher benchmark scores are better")
+    parser.add_argument("--passes", type=int, default=3)
+    parser.add_argument("-o", "--output", default="teensy_opt_profile.json")
+    args = parser.parse_args(argv)
+    work_dir = os.path.join(args.project_dir, ".pio", "tune", args.environment)
+    tuner = Tuner(args.project_dir, args.environment, work_dir,
+                  load_space(args.space) if args.space else None, args.jobs,
+                  args.benchmark, args.maximize)
+    profile, score = tuner.run(args.passes)
+    save_profile(args.output, profile, score, args.benchmark or "size")
+    print("Best: %s (%g), saved to %s" % (" ".join(profile["flags"]), score, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
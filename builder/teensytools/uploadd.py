@@ -0,0 +1,512 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Teensy upload daemon
+
+A long running service that keeps track of attached Teensy boards and their
+bootloader state, queues upload requests and streams progress back to the
+client. Boards are programmed through the HalfKay HID protocol directly when
+the `hid` (hidapi) module is available, otherwise `teensy_reboot` and
+`teensy_loader_cli` are used. The `fake` backend simulates boards for tests.
+
+Clients send one JSON line per request and receive JSON lines:
+  {"op": "devices"}
+  {"op": "upload", "board": "teensy41", "mcu": "TEENSY41",
+   "hex": "/path/firmware.hex", "serial": null}
+Upload responses are progress events followed by a final
+{"event": "done", "ok": true|false, "message": "..."}.
+
+The script only uses the standard library (plus optional pyserial and
+hidapi) so it can be started directly:
+  python teensytools/uploadd.py serve [--backend fake]
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+DEFAULT_ADDRESS = ("127.0.0.1", 37821)
+POLL_INTERVAL = 0.25
+REBOOT_TIMEOUT = 15.0
+# longest silence of the daemon during an upload (reboot, erase, teensy_loader_cli)
+PROGRESS_TIMEOUT = 120.0
+
+PJRC_VID = 0x16C0
+HALFKAY_PID = 0x0478
+
+# code size and block size per board, as used by teensy_loader_cli
+BOARDS = {
+    "teensy2": (32256, 128),
+    "teensy2pp": (130048, 256),
+    "teensylc": (63488, 512),
+    "teensy30": (131072, 1024),
+    "teensy31": (262144, 1024),
+    "teensy35": (524288, 1024),
+    "teensy36": (1048576, 1024),
+    "teensy40": (2031616, 1024),
+    "teensy41": (8126464, 1024),
+    "teensymm": (16515072, 1024),
+}
+FLEXSPI_BASE = 0x60000000
+
+
+class UploadError(Exception):
+    pass
+
+
+class Device(object):
+
+    def __init__(self, serial, state, port=None, handle=None):
+        self.serial = serial
+        self.state = state  # "bootloader" or "running"
+        self.port = port
+        self.handle = handle
+
+    def as_dict(self):
+        return dict(serial=self.serial, state=self.state, port=self.port)
+
+
+def parse_ihex(path, board):
+    """Returns {address: byte} with FlexSPI addresses mapped to 0."""
+    code_size, block_size = BOARDS[board]
+    memory = bytearray(b"\xff" * code_size)
+    used = set()
+    base = 0
+    with open(path) as fp:
+        for number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith(":"):
+                raise UploadError("%s:%d: not an Intel HEX record" % (path, number))
+            record = bytes.fromhex(line[1:])
+            if sum(record) & 0xFF:
+                raise UploadError("%s:%d: checksum error" % (path, number))
+            count, addr, kind = record[0], (record[1] << 8) | record[2], record[3]
+            data = record[4:4 + count]
+            if kind == 0:
+                addr += base
+                if (code_size > 1048576 and block_size >= 1024
+                        and FLEXSPI_BASE <= addr < FLEXSPI_BASE + code_size):
+                    addr -= FLEXSPI_BASE
+                if addr + count > code_size:
+                    raise UploadError("%s: image does not fit into %s" % (path, board))
+                memory[addr:addr + count] = data
+                used.update(range(addr // block_size, (addr + count - 1) // block_size + 1))
+            elif kind == 1:
+                break
+            elif kind == 2:
+                base = ((data[0] << 8) | data[1]) << 4
+            elif kind == 4:
+                base = ((data[0] << 8) | data[1]) << 16
+    return memory, used
+
+
+def halfkay_blocks(memory, used, board):
+    """Yields (address, report) pairs in the order HalfKay expects them."""
+    code_size, block_size = BOARDS[board]
+    blank = b"\xff" * block_size
+    for addr in range(0, code_size, block_size):
+        data = bytes(memory[addr:addr + block_size])
+        # the first block is always written, it erases the chip
+        if addr and (addr // block_size not in used or data == blank):
+            continue
+        if block_size <= 256 and code_size < 0x10000:
+            report = bytes((addr & 0xFF, (addr >> 8) & 0xFF)) + data
+        elif block_size == 256:
+            report = bytes(((addr >> 8) & 0xFF, (addr >> 16) & 0xFF)) + data
+        else:
+            report = bytes((addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF)) + \
+                bytes(61) + data
+        yield addr, report
+
+
+def boot_report(board):
+    _, block_size = BOARDS[board]
+    header = 2 if block_size <= 256 else 64
+    return b"\xff\xff\xff" + bytes(block_size + header - 3)
+
+
+class FakeBackend(object):
+    """Simulated boards, `serials` are attached in running state."""
+
+    def __init__(self, serials=("1234567",), delay=0.0):
+        self.lock = threading.Lock()
+        self.boards = dict((s, "running") for s in serials)
+        self.delay = delay
+        self.images = {}
+
+    def list_devices(self):
+        with self.lock:
+            return [Device(s, state, port="fake:%s" % s) for s, state in self.boards.items()]
+
+    def reboot(self, device):
+        with self.lock:
+            self.boards[device.serial] = "bootloader"
+
+    def program(self, device, board, path, progress, mcu=None):
+        memory, used = parse_ihex(path, board)
+        blocks = list(halfkay_blocks(memory, used, board))
+        image = bytearray()
+        for index, (addr, report) in enumerate(blocks):
+            time.sleep(self.delay)
+            image += report
+            progress(100 * (index + 1) // len(blocks), "block 0x%06x" % addr)
+        with self.lock:
+            self.images[device.serial] = bytes(image)
+            self.boards[device.serial] = "running"
+
+
+class CliBackend(object):
+    """teensy_loader_cli based programming, used without hidapi."""
+
+    def __init__(self):
+        try:
+            from serial.tools import list_ports
+        except ImportError:
+            list_ports = None
+        self.list_ports = list_ports
+
+    def list_devices(self):
+        if self.list_ports is None:
+            return []
+        return [Device(p.serial_number or p.device, "running", port=p.device)
+                for p in self.list_ports.comports() if p.vid == PJRC_VID]
+
+    def reboot(self, device):
+        subprocess.call(["teensy_reboot", "-s"])
+
+    def program(self, device, board, path, progress, mcu=None):
+        progress(0, "teensy_loader_cli")
+        # the board id is no valid MCU name for every board (e.g. teensymm)
+        cmd = ["teensy_loader_cli", "-mmcu=%s" % (mcu or board.upper()), "-w", "-s", "-v", path]
+        if subprocess.call(cmd) != 0 and subprocess.call(cmd) != 0:
+            raise UploadError("teensy_loader_cli failed")
+        progress(100, "done")
+
+
+class HalfKayBackend(CliBackend):
+    """Programs boards through the HalfKay HID bootloader."""
+
+    def __init__(self, hid):
+        CliBackend.__init__(self)
+        self.hid = hid
+        # shared by the tracker thread (list_devices) and the upload thread (_open)
+        self.lock = threading.Lock()
+        self.handles = {}
+
+    def _open(self, path):
+        with self.lock:
+            if path not in self.handles:
+                if hasattr(self.hid, "device"):
+                    handle = self.hid.device()
+                    handle.open_path(path)
+                else:
+                    handle = self.hid.Device(path=path)
+                self.handles[path] = handle
+            return self.handles[path]
+
+    def list_devices(self):
+        devices = CliBackend.list_devices(self)
+        present = set()
+        for info in self.hid.enumerate(PJRC_VID, HALFKAY_PID):
+            present.add(info["path"])
+            devices.append(Device(
+                info.get("serial_number") or info["path"], "bootloader",
+                port=info["path"]))
+        with self.lock:
+            for path in list(self.handles):
+                if path not in present:
+                    self.handles.pop(path).close()
+        return devices
+
+    def reboot(self, device):
+        if device.port and self.list_ports is not None:
+            import serial
+            # opening the port at 134 baud requests the bootloader
+            try:
+                serial.Serial(device.port, 134).close()
+            except (OSError, serial.SerialException):
+                pass
+
+    def _write(self, handle, report, timeout):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if handle.write(b"\x00" + report) > 0:
+                    return
+            except (OSError, ValueError):
+                pass
+            if time.time() > deadline:
+                raise UploadError("bootloader does not respond")
+            time.sleep(0.01)
+
+    def program(self, device, board, path, progress, mcu=None):
+        memory, used = parse_ihex(path, board)
+        blocks = list(halfkay_blocks(memory, used, board))
+        handle = self._open(device.port)
+        erase_timeout = 45.0 if BOARDS[board][0] > 1048576 else 5.0
+        for index, (addr, report) in enumerate(blocks):
+            self._write(handle, report, erase_timeout if index == 0 else 0.5)
+            progress(100 * (index + 1) // len(blocks), "block 0x%06x" % addr)
+        self._write(handle, boot_report(board), 0.5)
+
+
+def create_backend(name):
+    if name == "fake":
+        return FakeBackend()
+    if name in ("auto", "halfkay"):
+        try:
+            import hid
+            return HalfKayBackend(hid)
+        except ImportError:
+            if name == "halfkay":
+                raise
+    return CliBackend()
+
+
+class Tracker(object):
+    """Polls the backend and keeps the current device list."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.devices = []
+        self.changed = threading.Condition()
+
+    def poll(self):
+        devices = self.backend.list_devices()
+        with self.changed:
+            self.devices = devices
+            self.changed.notify_all()
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as exc:  # keep tracking after USB hiccups
+                sys.stderr.write("device polling failed: %s\n" % exc)
+            time.sleep(POLL_INTERVAL)
+
+    def find(self, serial=None, state=None):
+        with self.changed:
+            return self._find(serial, state)
+
+    def _find(self, serial, state):
+        candidates = [d for d in self.devices if state is None or d.state == state]
+        if serial:
+            matching = [d for d in candidates
+                        if d.port == serial or _same_serial(d.serial, serial)]
+            if matching or state != "bootloader":
+                return matching[0] if matching else None
+        return candidates[0] if len(candidates) == 1 else None
+
+    def wait_for(self, serial, state, timeout):
+        deadline = time.time() + timeout
+        with self.changed:
+            while True:
+                device = self._find(serial, state)
+                if device is not None:
+                    return device
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+
+
+def _same_serial(a, b):
+    if a == b:
+        return True
+    # bootloaders report the serial number in hex, running boards in decimal
+    try:
+        return int(str(a), 16) == int(str(b)) or int(str(a)) == int(str(b), 16)
+    except ValueError:
+        return False
+
+
+class Uploader(object):
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.tracker = Tracker(backend)
+        self.jobs = queue.Queue()
+
+    def start(self):
+        self.tracker.poll()
+        for target in (self.tracker.run, self.run):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, request):
+        events = queue.Queue()
+        self.jobs.put((request, events))
+        return events
+
+    def run(self):
+        while True:
+            request, events = self.jobs.get()
+            try:
+                self.upload(request, lambda percent, message: events.put(
+                    dict(event="progress", percent=percent, message=message)))
+                events.put(dict(event="done", ok=True, message="upload finished"))
+            except (UploadError, OSError, KeyError, ValueError) as exc:
+                events.put(dict(event="done", ok=False, message=str(exc)))
+
+    def upload(self, request, progress):
+        board = request["board"]
+        if board not in BOARDS:
+            raise UploadError("unsupported board %s" % board)
+        serial = request.get("serial")
+        device = self.tracker.find(serial, "bootloader")
+        if device is None:
+            running = self.tracker.find(serial, "running")
+            if running is None and serial:
+                raise UploadError("board %s not found" % serial)
+            if running is not None:
+                progress(0, "rebooting %s" % running.serial)
+                self.backend.reboot(running)
+                self.tracker.poll()
+            else:
+                progress(0, "waiting for a board in bootloader mode")
+            device = self.tracker.wait_for(serial, "bootloader", REBOOT_TIMEOUT)
+            if device is None:
+                raise UploadError("no board entered the bootloader, press the program button")
+        progress(0, "programming %s" % device.serial)
+        self.backend.program(device, board, request["hex"], progress, request.get("mcu"))
+        self.tracker.poll()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError:
+                self._send(dict(event="error", message="invalid request"))
+                return
+            if request.get("op") == "devices":
+                self._send(dict(event="devices", devices=[
+                    d.as_dict() for d in self.server.uploader.tracker.devices]))
+            elif request.get("op") == "upload":
+                events = self.server.uploader.submit(request)
+                while True:
+                    event = events.get()
+                    self._send(event)
+                    if event["event"] == "done":
+                        break
+            else:
+                self._send(dict(event="error", message="unknown operation"))
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+
+class UploadServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, uploader):
+        socketserver.TCPServer.__init__(self, address, RequestHandler)
+        self.uploader = uploader
+
+
+def parse_address(value):
+    host, _, port = (value or "").rpartition(":")
+    if not host:
+        return DEFAULT_ADDRESS
+    return host, int(port)
+
+
+def request_upload(address, board, hex_path, serial=None, progress=None, timeout=3,
+                   mcu=None, progress_timeout=PROGRESS_TIMEOUT):
+    """Upload through a running daemon.
+
+    Returns None if no daemon is listening, otherwise (ok, message).
+    """
+    try:
+        sock = socket.create_connection(address, timeout=timeout)
+    except OSError:
+        return None
+    with sock:
+        sock.settimeout(progress_timeout)
+        request = dict(op="upload", board=board, mcu=mcu, hex=os.path.abspath(hex_path),
+                       serial=serial)
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            for line in sock.makefile("rb"):
+                event = json.loads(line.decode("utf-8"))
+                if event["event"] == "progress" and progress:
+                    progress(event["percent"], event["message"])
+                elif event["event"] == "done":
+                    return event["ok"], event["message"]
+        except socket.timeout:
+            return False, "no response from upload daemon for %g s" % progress_timeout
+        except OSError as exc:
+            return False, "upload daemon connection failed: %s" % exc
+    return False, "connection closed by upload daemon"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Teensy upload daemon")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser("serve", help="run the upload daemon")
+    serve.add_argument("--address", default="%s:%d" % DEFAULT_ADDRESS)
+    serve.add_argument("--backend", choices=("auto", "halfkay", "cli", "fake"),
+                       default="auto")
+    upload = commands.add_parser("upload", help="upload through the daemon")
+    upload.add_argument("--address", default="%s:%d" % DEFAULT_ADDRESS)
+    upload.add_argument("--serial")
+    upload.add_argument("--mcu", help="MCU name for teensy_loader_cli (default: board)")
+    upload.add_argument("board", choices=sorted(BOARDS))
+    upload.add_argument("hex")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        uploader = Uploader(create_backend(args.backend))
+        uploader.start()
+        server = UploadServer(parse_address(args.address), uploader)
+        print("Upload daemon listening on %s:%d (%s backend)" % (
+            server.server_address[0], server.server_address[1],
+            type(uploader.backend).__name__))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    if args.command == "upload":
+        result = request_upload(
+            parse_address(args.address), args.board, args.hex, args.serial,
+            lambda percent, message: print("%3d%% %s" % (percent, message)), mcu=args.mcu)
+        if result is None:
+            sys.stderr.write("No upload daemon listening on %s\n" % args.address)
+            return 1
+        print(result[1])
+        return 0 if result[0] else 1
+    parser.print_help()
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+/*
+ * CMSIS-DSP benchmark
+ * Compares the throughput of the CMSIS-DSP FIR filter and real FFT
+ * with straightforward C implementations and prints the results
+ * every few seconds.
+ */
+
+#include <Arduino.h>
+#include <arm_math.h>
+
+#define BLOCK_SIZE 256
+#define NUM_TAPS 32
+#define FFT_SIZE 256
+#define ITERATIONS 200
+
+static float32_t input[BLOCK_SIZE];
+static float32_t output[BLOCK_SIZE];
+static float32_t coeffs[NUM_TAPS];
+static float32_t fir_state[BLOCK_SIZE + NUM_TAPS - 1];
+static float32_t history[BLOCK_SIZE + NUM_TAPS - 1];
+static float32_t fft_in[FFT_SIZE];
+static float32_t fft_out[FFT_SIZE];
+static float32_t fft_re[FFT_SIZE];
+static float32_t fft_im[FFT_SIZE];
+
+static arm_fir_instance_f32 fir;
+static arm_rfft_fast_instance_f32 rfft;
+
+static void generic_fir(const float32_t* in, float32_t* out)
+{
+  memcpy(history + NUM_TAPS - 1, in, BLOCK_SIZE * sizeof(float32_t));
+  for (int n = 0; n < BLOCK_SIZE; n++) {
+    float32_t acc = 0;
+    for (int k = 0; k < NUM_TAPS; k++) {
+      acc += coeffs[k] * history[n + NUM_TAPS - 1 - k];
+    }
+    out[n] = acc;
+  }
+  memmove(history, history + BLOCK_SIZE, (NUM_TAPS - 1) * sizeof(float32_t));
+}
+
+// iterative radix-2 FFT of a real input, result in fft_re/fft_im
+static void generic_fft(const float32_t* in)
+{
+  for (unsigned i = 0, j = 0; i < FFT_SIZE; i++) {
+    fft_re[j] = in[i];
+    fft_im[j] = 0;
+    unsigned bit = FFT_SIZE >> 1;
+    while (j & bit) {
+      j ^= bit;
+      bit >>= 1;
+    }
+    j |= bit;
+  }
+  for (unsigned len = 2; len <= FFT_SIZE; len <<= 1) {
+    const float32_t angle = -2 * PI / len;
+    for (unsigned i = 0; i < FFT_SIZE; i += len) {
+      for (unsigned k = 0; k < len / 2; k++) {
+        const float32_t wr = cosf(angle * k), wi = sinf(angle * k);
+        const unsigned a = i + k, b = i + k + len / 2;
+        const float32_t tr = fft_re[b] * wr - fft_im[b] * wi;
+        const float32_t ti = fft_re[b] * wi + fft_im[b] * wr;
+        fft_re[b] = fft_re[a] - tr;
+        fft_im[b] = fft_im[a] - ti;
+        fft_re[a] += tr;
+        fft_im[a] += ti;
+      }
+    }
+  }
+}
+
+static void report(const char* name, uint32_t us, uint32_t samples)
+{
+  Serial.printf("%-14s %8.2f us/block %10.0f samples/s\n", name, (double)us / ITERATIONS,
+                samples * (double)ITERATIONS * 1e6 / us);
+}
+
+void setup()
+{
+  Serial.begin(115200);
+  for (int i = 0; i < NUM_TAPS; i++) {
+    coeffs[i] = 1.0f / NUM_TAPS;
+  }
+  for (int i = 0; i < BLOCK_SIZE; i++) {
+    input[i] = fft_in[i] = arm_sin_f32(2 * PI * 5 * i / BLOCK_SIZE);
+  }
+  arm_fir_init_f32(&fir, NUM_TAPS, coeffs, fir_state, BLOCK_SIZE);
+  arm_rfft_fast_init_f32(&rfft, FFT_SIZE);
+}
+
+void loop()
+{
+  elapsedMicros us;
+  for (int i = 0; i < ITERATIONS; i++) {
+    arm_fir_f32(&fir, input, output, BLOCK_SIZE);
+  }
+  report("FIR CMSIS-DSP", us, BLOCK_SIZE);
+
+  us = 0;
+  for (int i = 0; i < ITERATIONS; i++) {
+    generic_fir(input, output);
+  }
+  report("FIR generic", us, BLOCK_SIZE);
+
+  us = 0;
+  for (int i = 0; i < ITERATIONS; i++) {
+    memcpy(fft_out, fft_in, sizeof(fft_in));
+    arm_rfft_fast_f32(&rfft, fft_out, output, 0);
+  }
+  report("FFT CMSIS-DSP", us, FFT_SIZE);
+
+  us = 0;
+  for (int i = 0; i < ITERATIONS; i++) {
+    generic_fft(fft_in);
+  }
+  report("FFT generic", us, FFT_SIZE);
+
+  Serial.println();
+  delay(5000);
+}
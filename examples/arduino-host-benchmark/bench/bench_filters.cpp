@@ -0,0 +1,23 @@
+#include <Arduino.h>
+#include <MovingAverage.h>
+#include <TeensyBench.h>
+
+static float input[512];
+static float output[512];
+static float coeffs[32];
+static MovingAverage<16> average;
+
+TEENSY_BENCH(moving_average, 512)
+{
+  for (size_t i = 0; i < 512; i++) {
+    output[i] = average.update(input[i]);
+  }
+  teensy_bench::clobber_memory();
+}
+
+TEENSY_BENCH(fir_32_taps, 512 - 32 + 1)
+{
+  input[0] += 1.0f;
+  fir_filter(coeffs, 32, input, output, 512);
+  teensy_bench::clobber_memory();
+}
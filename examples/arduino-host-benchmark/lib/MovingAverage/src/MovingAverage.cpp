@@ -0,0 +1,12 @@
+#include "MovingAverage.h"
+
+void fir_filter(const float* coeffs, size_t taps, const float* input, float* output, size_t len)
+{
+  for (size_t i = 0; i + taps <= len; i++) {
+    float acc = 0;
+    for (size_t k = 0; k < taps; k++) {
+      acc += input[i + k] * coeffs[k];
+    }
+    output[i] = acc;
+  }
+}
@@ -0,0 +1,24 @@
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+// Moving average over the last `N` samples
+template <size_t N>
+class MovingAverage {
+  public:
+    float update(float sample) {
+      sum_ += sample - history_[pos_];
+      history_[pos_] = sample;
+      pos_ = (pos_ + 1) % N;
+      return sum_ / N;
+    }
+
+  private:
+    float history_[N] = {};
+    float sum_ = 0;
+    size_t pos_ = 0;
+};
+
+// FIR filter with `taps` coefficients, processes `len` samples
+void fir_filter(const float* coeffs, size_t taps, const float* input, float* output, size_t len);
@@ -0,0 +1,24 @@
+/*
+ * Filters analog readings, the filters are benchmarked on the
+ * build machine with `pio run -t host_bench` (see bench/).
+ */
+
+#include <Arduino.h>
+#include <MovingAverage.h>
+
+MovingAverage<16> average;
+elapsedMillis since_print;
+
+void setup()
+{
+  Serial.begin(115200);
+}
+
+void loop()
+{
+  const float value = average.update(analogRead(A0));
+  if (since_print >= 500) {
+    since_print = 0;
+    Serial.println(value);
+  }
+}
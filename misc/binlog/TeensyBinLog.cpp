@@ -0,0 +1,7 @@
+#include <Arduino.h>
+
+#include "TeensyBinLog.h"
+
+extern "C" __attribute__((weak)) void teensy_binlog_output(const uint8_t* data, size_t len) {
+    Serial.write(data, len);
+}
@@ -0,0 +1,106 @@
+/*
+ * TeensyBinLog: deferred formatting of log messages
+ *
+ * BINLOG("adc %d: %f V\n", channel, volts) sends a few bytes instead of the
+ * formatted text. The format string is placed in the `.binlog_fmt` section,
+ * which stays in the ELF file but is not loaded onto the target, and its
+ * address is used as ID. The host decodes the records with the ELF file, see
+ * builder/teensytools/binlog.py.
+ *
+ * The arguments are checked against the format string like for printf().
+ *
+ * Enabled with `build_flags = -DTEENSY_BINLOG`.
+ */
+
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+#include <string.h>
+#include <type_traits>
+
+#define TEENSY_BINLOG_SYNC 0xB7
+#define TEENSY_BINLOG_MAX_RECORD 257
+#define TEENSY_BINLOG_MAX_STRING 128
+
+/* '@' starts a comment for the ARM assembler, so the "a" (alloc) flag GCC appends is dropped */
+#ifndef TEENSY_BINLOG_SECTION
+#define TEENSY_BINLOG_SECTION ".binlog_fmt,\"\",%progbits @"
+#endif
+
+/* Sends a complete record, defaults to Serial.write(). Define it to log to another port. */
+extern "C" void teensy_binlog_output(const uint8_t* data, size_t len);
+
+namespace teensy_binlog {
+
+class Record {
+  public:
+    explicit Record(uint32_t id) : len_(2) {
+        buf_[0] = TEENSY_BINLOG_SYNC;
+        do {
+            uint8_t byte = id & 0x7f;
+            id >>= 7;
+            buf_[len_++] = id ? (byte | 0x80) : byte;
+        } while (id);
+    }
+
+    void put(const void* data, size_t len) {
+        if (len_ + len > sizeof(buf_)) {
+            len = sizeof(buf_) - len_;
+        }
+        memcpy(buf_ + len_, data, len);
+        len_ += len;
+    }
+
+    void send() {
+        buf_[1] = static_cast<uint8_t>(len_ - 2);
+        teensy_binlog_output(buf_, len_);
+    }
+
+  private:
+    uint8_t buf_[TEENSY_BINLOG_MAX_RECORD];
+    size_t len_;
+};
+
+template <typename T>
+inline void add(Record& record, const T& value) {
+    using U = std::decay_t<T>;
+    if constexpr (std::is_floating_point_v<U>) {
+        const double v = value;
+        record.put(&v, sizeof(v));
+    } else if constexpr (std::is_same_v<U, const char*> || std::is_same_v<U, char*>) {
+        const uint8_t len = value ? strnlen(value, TEENSY_BINLOG_MAX_STRING) : 0;
+        record.put(&len, sizeof(len));
+        record.put(value, len);
+    } else if constexpr (std::is_pointer_v<U>) {
+        const uint32_t v = reinterpret_cast<uintptr_t>(value);
+        record.put(&v, sizeof(v));
+    } else if constexpr (sizeof(U) == 8) {
+        record.put(&value, sizeof(value));
+    } else {
+        using W = std::conditional_t<std::is_signed_v<U>, int32_t, uint32_t>;
+        const W v = static_cast<W>(value);
+        record.put(&v, sizeof(v));
+    }
+}
+
+/* never called, lets the compiler check the arguments against the format string */
+__attribute__((format(printf, 1, 2))) inline void check_format(const char*, ...) {}
+
+template <typename... Args>
+inline void write(uint32_t id, const Args&... args) {
+    Record record(id);
+    (add(record, args), ...);
+    record.send();
+}
+
+} // namespace teensy_binlog
+
+#define BINLOG(fmt, ...)                                                                                           \
+    do {                                                                                                           \
+        if (0) {                                                                                                   \
+            ::teensy_binlog::check_format(fmt, ##__VA_ARGS__);                                                     \
+        }                                                                                                          \
+        static const char _teensy_binlog_fmt[] __attribute__((section(TEENSY_BINLOG_SECTION), used)) = fmt;       \
+        ::teensy_binlog::write(reinterpret_cast<uintptr_t>(_teensy_binlog_fmt), ##__VA_ARGS__);                    \
+    } while (0)
@@ -0,0 +1,211 @@
+/*
+ * Host-native stand-in for the Teensy Arduino core
+ *
+ * Provides the timing functions, elapsedMillis/elapsedMicros, Serial and
+ * digital/analog I/O so that sketch and library code can be compiled for the
+ * build machine, e.g. to benchmark algorithms with `pio run -t host_bench`.
+ * Pins are simulated as plain memory, Serial prints to stdout.
+ */
+
+#pragma once
+
+#include <math.h>
+#include <stdarg.h>
+#include <stddef.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifndef TEENSY_HOST
+#define TEENSY_HOST 1
+#endif
+
+#ifndef F_CPU
+#define F_CPU 600000000
+#endif
+#define F_CPU_ACTUAL F_CPU
+
+#define FASTRUN
+#define FLASHMEM
+#define PROGMEM
+#define DMAMEM
+#define EXTMEM
+#define F(s) (s)
+#define PSTR(s) (s)
+
+#define HIGH 1
+#define LOW 0
+#define INPUT 0
+#define OUTPUT 1
+#define INPUT_PULLUP 2
+#define INPUT_PULLDOWN 3
+#define OUTPUT_OPENDRAIN 4
+#define LED_BUILTIN 13
+#define NUM_DIGITAL_PINS 64
+
+#define PI 3.1415926535897932384626433832795
+#define HALF_PI 1.5707963267948966192313216916398
+#define TWO_PI 6.283185307179586476925286766559
+#define DEG_TO_RAD 0.017453292519943295769236907684886
+#define RAD_TO_DEG 57.295779513082320876798154814105
+
+#define bitRead(value, bit) (((value) >> (bit)) & 0x01)
+#define bitSet(value, bit) ((value) |= (1UL << (bit)))
+#define bitClear(value, bit) ((value) &= ~(1UL << (bit)))
+#define bitWrite(value, bit, bitvalue) ((bitvalue) ? bitSet(value, bit) : bitClear(value, bit))
+#define bit(b) (1UL << (b))
+#define lowByte(w) ((uint8_t)((w) & 0xff))
+#define highByte(w) ((uint8_t)((w) >> 8))
+
+#define interrupts()
+#define noInterrupts()
+#define __disable_irq()
+#define __enable_irq()
+
+/* cycle counter derived from the host clock at F_CPU */
+#define ARM_DWT_CYCCNT (teensy_host_cycles())
+
+typedef bool boolean;
+typedef uint8_t byte;
+
+uint32_t teensy_host_cycles();
+
+uint32_t millis();
+uint32_t micros();
+void delay(uint32_t ms);
+void delayMicroseconds(uint32_t us);
+void yield();
+
+void pinMode(uint8_t pin, uint8_t mode);
+void digitalWrite(uint8_t pin, uint8_t val);
+uint8_t digitalRead(uint8_t pin);
+void digitalToggle(uint8_t pin);
+void digitalWriteFast(uint8_t pin, uint8_t val);
+uint8_t digitalReadFast(uint8_t pin);
+void digitalToggleFast(uint8_t pin);
+int analogRead(uint8_t pin);
+void analogWrite(uint8_t pin, int val);
+void analogReadResolution(unsigned int bits);
+void analogWriteResolution(unsigned int bits);
+
+/* simulated pin levels for tests, indexed by pin number */
+extern uint8_t teensy_host_pins[NUM_DIGITAL_PINS];
+extern int teensy_host_analog[NUM_DIGITAL_PINS];
+
+long random(long howbig);
+long random(long howsmall, long howbig);
+void randomSeed(uint32_t seed);
+
+#ifdef __cplusplus
+
+template <class A, class B>
+constexpr auto min(A a, B b) -> decltype(a < b ? a : b) {
+    return b < a ? b : a;
+}
+
+template <class A, class B>
+constexpr auto max(A a, B b) -> decltype(a < b ? a : b) {
+    return a < b ? b : a;
+}
+
+template <class T, class L, class H>
+constexpr T constrain(T amt, L low, H high) {
+    return amt < low ? low : (amt > high ? high : amt);
+}
+
+template <class T>
+constexpr T sq(T x) {
+    return x * x;
+}
+
+long map(long x, long in_min, long in_max, long out_min, long out_max);
+
+#define DEC 10
+#define HEX 16
+#define OCT 8
+#define BIN 2
+
+class Print {
+  public:
+    virtual ~Print() = default;
+    virtual size_t write(uint8_t b) = 0;
+    virtual size_t write(const uint8_t* buffer, size_t size);
+    size_t write(const char* str) { return str ? write(reinterpret_cast<const uint8_t*>(str), strlen(str)) : 0; }
+    virtual void flush() {}
+
+    size_t print(const char* s) { return write(s); }
+    size_t print(char c) { return write(static_cast<uint8_t>(c)); }
+    size_t print(int n, int base = DEC) { return print(static_cast<long>(n), base); }
+    size_t print(unsigned int n, int base = DEC) { return print(static_cast<unsigned long>(n), base); }
+    size_t print(long n, int base = DEC);
+    size_t print(unsigned long n, int base = DEC);
+    size_t print(long long n, int base = DEC);
+    size_t print(unsigned long long n, int base = DEC);
+    size_t print(double n, int digits = 2);
+
+    size_t println() { return write("\r\n"); }
+    template <typename T>
+    size_t println(T value) { return print(value) + println(); }
+    template <typename T>
+    size_t println(T value, int format) { return print(value, format) + println(); }
+
+    int printf(const char* format, ...) __attribute__((format(printf, 2, 3)));
+};
+
+class Stream : public Print {
+  public:
+    virtual int available() { return 0; }
+    virtual int read() { return -1; }
+    virtual int peek() { return -1; }
+};
+
+class HardwareSerialStub : public Stream {
+  public:
+    explicit HardwareSerialStub(FILE* out) : out_(out) {}
+    void begin(uint32_t) {}
+    void end() {}
+    explicit operator bool() const { return true; }
+    size_t write(uint8_t b) override;
+    size_t write(const uint8_t* buffer, size_t size) override;
+    using Print::write;
+    void flush() override;
+
+  private:
+    FILE* out_;
+};
+
+/* Serial prints to stdout, the hardware serial ports discard their output */
+extern HardwareSerialStub Serial;
+extern HardwareSerialStub Serial1, Serial2, Serial3, Serial4, Serial5, Serial6, Serial7, Serial8;
+
+class elapsedMillis {
+  public:
+    elapsedMillis() : ms_(millis()) {}
+    elapsedMillis(unsigned long val) : ms_(millis() - val) {}
+    operator unsigned long() const { return millis() - ms_; }
+    elapsedMillis& operator=(unsigned long val) { ms_ = millis() - val; return *this; }
+    elapsedMillis& operator-=(unsigned long val) { ms_ += val; return *this; }
+    elapsedMillis& operator+=(unsigned long val) { ms_ -= val; return *this; }
+
+  private:
+    unsigned long ms_;
+};
+
+class elapsedMicros {
+  public:
+    elapsedMicros() : us_(micros()) {}
+    elapsedMicros(unsigned long val) : us_(micros() - val) {}
+    operator unsigned long() const { return micros() - us_; }
+    elapsedMicros& operator=(unsigned long val) { us_ = micros() - val; return *this; }
+    elapsedMicros& operator-=(unsigned long val) { us_ += val; return *this; }
+    elapsedMicros& operator+=(unsigned long val) { us_ -= val; return *this; }
+
+  private:
+    unsigned long us_;
+};
+
+void setup();
+void loop();
+
+#endif /* __cplusplus */
@@ -0,0 +1,52 @@
+/*
+ * Micro-benchmark registry of the host-native core
+ *
+ *   TEENSY_BENCH(fir_q15, 256) {      // 256 items per call
+ *       fir.process(input, output, 256);
+ *       teensy_bench::do_not_optimize(output);
+ *   }
+ *
+ * Every benchmark is called until it ran for at least `--min-time` seconds,
+ * the best of several batches is reported.
+ */
+
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+namespace teensy_bench {
+
+typedef void (*Function)();
+
+struct Benchmark {
+    const char* name;
+    uint64_t items;
+    Function function;
+    Benchmark* next;
+};
+
+void add(Benchmark* benchmark);
+Benchmark* first();
+int run(int argc, char** argv);
+
+struct Registrar {
+    Registrar(Benchmark* benchmark) { add(benchmark); }
+};
+
+template <typename T>
+inline void do_not_optimize(T const& value) {
+    asm volatile("" : : "r,m"(value) : "memory");
+}
+
+inline void clobber_memory() {
+    asm volatile("" : : : "memory");
+}
+
+} // namespace teensy_bench
+
+#define TEENSY_BENCH(name, items)                                                                          \
+    static void teensy_bench_fn_##name();                                                                  \
+    static ::teensy_bench::Benchmark teensy_bench_##name = {#name, items, teensy_bench_fn_##name, nullptr}; \
+    static ::teensy_bench::Registrar teensy_bench_reg_##name(&teensy_bench_##name);                       \
+    static void teensy_bench_fn_##name()
@@ -0,0 +1,270 @@
+#include <chrono>
+#include <random>
+#include <thread>
+
+#include "Arduino.h"
+#include "TeensyBench.h"
+
+using Clock = std::chrono::steady_clock;
+
+static const Clock::time_point start_time = Clock::now();
+
+uint8_t teensy_host_pins[NUM_DIGITAL_PINS];
+int teensy_host_analog[NUM_DIGITAL_PINS];
+
+static uint64_t elapsed_ns() {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(Clock::now() - start_time).count();
+}
+
+uint32_t teensy_host_cycles() {
+    return static_cast<uint32_t>(elapsed_ns() * (F_CPU / 1000000ULL) / 1000ULL);
+}
+
+uint32_t millis() {
+    return static_cast<uint32_t>(elapsed_ns() / 1000000ULL);
+}
+
+uint32_t micros() {
+    return static_cast<uint32_t>(elapsed_ns() / 1000ULL);
+}
+
+void delay(uint32_t ms) {
+    std::this_thread::sleep_for(std::chrono::milliseconds(ms));
+}
+
+void delayMicroseconds(uint32_t us) {
+    const uint64_t until = elapsed_ns() + us * 1000ULL;
+    while (elapsed_ns() < until) {
+    }
+}
+
+void yield() {}
+
+void pinMode(uint8_t, uint8_t) {}
+
+void digitalWrite(uint8_t pin, uint8_t val) {
+    if (pin < NUM_DIGITAL_PINS) {
+        teensy_host_pins[pin] = val ? HIGH : LOW;
+    }
+}
+
+uint8_t digitalRead(uint8_t pin) {
+    return pin < NUM_DIGITAL_PINS ? teensy_host_pins[pin] : LOW;
+}
+
+void digitalToggle(uint8_t pin) {
+    digitalWrite(pin, !digitalRead(pin));
+}
+
+void digitalWriteFast(uint8_t pin, uint8_t val) {
+    digitalWrite(pin, val);
+}
+
+uint8_t digitalReadFast(uint8_t pin) {
+    return digitalRead(pin);
+}
+
+void digitalToggleFast(uint8_t pin) {
+    digitalToggle(pin);
+}
+
+int analogRead(uint8_t pin) {
+    return pin < NUM_DIGITAL_PINS ? teensy_host_analog[pin] : 0;
+}
+
+void analogWrite(uint8_t pin, int val) {
+    if (pin < NUM_DIGITAL_PINS) {
+        teensy_host_analog[pin] = val;
+    }
+}
+
+void analogReadResolution(unsigned int) {}
+
+void analogWriteResolution(unsigned int) {}
+
+static std::minstd_rand random_engine;
+
+long random(long howbig) {
+    return howbig > 0 ? static_cast<long>(random_engine() % howbig) : 0;
+}
+
+long random(long howsmall, long howbig) {
+    return howsmall >= howbig ? howsmall : howsmall + random(howbig - howsmall);
+}
+
+void randomSeed(uint32_t seed) {
+    random_engine.seed(seed);
+}
+
+long map(long x, long in_min, long in_max, long out_min, long out_max) {
+    return (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min;
+}
+
+size_t Print::write(const uint8_t* buffer, size_t size) {
+    size_t count = 0;
+    while (size--) {
+        count += write(*buffer++);
+    }
+    return count;
+}
+
+size_t Print::print(long n, int base) {
+    if (n < 0 && base == DEC) {
+        return print('-') + print(static_cast<unsigned long long>(-static_cast<long long>(n)), base);
+    }
+    return print(static_cast<unsigned long long>(static_cast<unsigned long>(n)), base);
+}
+
+size_t Print::print(unsigned long n, int base) {
+    return print(static_cast<unsigned long long>(n), base);
+}
+
+size_t Print::print(long long n, int base) {
+    if (n < 0 && base == DEC) {
+        return print('-') + print(0ULL - static_cast<unsigned long long>(n), base);
+    }
+    return print(static_cast<unsigned long long>(n), base);
+}
+
+size_t Print::print(unsigned long long n, int base) {
+    char buf[66];
+    char* p = buf + sizeof(buf) - 1;
+    *p = '\0';
+    if (base < 2) {
+        base = DEC;
+    }
+    do {
+        const int digit = n % base;
+        *--p = digit < 10 ? '0' + digit : 'A' + digit - 10;
+        n /= base;
+    } while (n);
+    return write(p);
+}
+
+size_t Print::print(double n, int digits) {
+    char buf[64];
+    snprintf(buf, sizeof(buf), "%.*f", digits, n);
+    return write(buf);
+}
+
+int Print::printf(const char* format, ...) {
+    char buf[256];
+    va_list args;
+    va_start(args, format);
+    const int len = vsnprintf(buf, sizeof(buf), format, args);
+    va_end(args);
+    if (len < 0) {
+        return len;
+    }
+    write(reinterpret_cast<const uint8_t*>(buf), len < static_cast<int>(sizeof(buf)) ? len : sizeof(buf) - 1);
+    return len;
+}
+
+size_t HardwareSerialStub::write(uint8_t b) {
+    if (out_) {
+        fputc(b, out_);
+    }
+    return 1;
+}
+
+size_t HardwareSerialStub::write(const uint8_t* buffer, size_t size) {
+    if (out_) {
+        fwrite(buffer, 1, size, out_);
+    }
+    return size;
+}
+
+void HardwareSerialStub::flush() {
+    if (out_) {
+        fflush(out_);
+    }
+}
+
+HardwareSerialStub Serial(stdout);
+HardwareSerialStub Serial1(nullptr), Serial2(nullptr), Serial3(nullptr), Serial4(nullptr);
+HardwareSerialStub Serial5(nullptr), Serial6(nullptr), Serial7(nullptr), Serial8(nullptr);
+
+namespace teensy_bench {
+
+static Benchmark* benchmarks = nullptr;
+
+void add(Benchmark* benchmark) {
+    Benchmark** tail = &benchmarks;
+    while (*tail) {
+        tail = &(*tail)->next;
+    }
+    *tail = benchmark;
+}
+
+Benchmark* first() {
+    return benchmarks;
+}
+
+static double run_batch(Function function, uint64_t calls) {
+    const auto begin = Clock::now();
+    for (uint64_t i = 0; i < calls; ++i) {
+        function();
+    }
+    return std::chrono::duration<double>(Clock::now() - begin).count();
+}
+
+int run(int argc, char** argv) {
+    double min_time = 0.2;
+    int repetitions = 5;
+    const char* filter = nullptr;
+    for (int i = 1; i < argc; ++i) {
+        if (!strcmp(argv[i], "--min-time") && i + 1 < argc) {
+            min_time = atof(argv[++i]);
+        } else if (!strcmp(argv[i], "--repetitions") && i + 1 < argc) {
+            repetitions = atoi(argv[++i]);
+        } else if (!strcmp(argv[i], "--filter") && i + 1 < argc) {
+            filter = argv[++i];
+        }
+    }
+    for (Benchmark* benchmark = benchmarks; benchmark; benchmark = benchmark->next) {
+        if (filter && !strstr(benchmark->name, filter)) {
+            continue;
+        }
+        benchmark->function();
+        uint64_t calls = 1;
+        double seconds = run_batch(benchmark->function, calls);
+        while (seconds < min_time / repetitions && calls < (1ULL << 40)) {
+            calls *= seconds > 0 ? static_cast<uint64_t>(min_time / repetitions / seconds) + 1 : 10;
+            seconds = run_batch(benchmark->function, calls);
+        }
+        double best = seconds;
+        for (int i = 1; i < repetitions; ++i) {
+            const double batch = run_batch(benchmark->function, calls);
+            best = batch < best ? batch : best;
+        }
+        const double ns_per_call = best * 1e9 / calls;
+        /* machine-readable, parsed by builder/teensytools/hostbench.py */
+        ::printf("BENCH %s %.3f %.1f %llu\n", benchmark->name, ns_per_call,
+                 benchmark->items * 1e9 / ns_per_call, static_cast<unsigned long long>(calls));
+    }
+    return 0;
+}
+
+} // namespace teensy_bench
+
+__attribute__((weak)) void setup() {}
+
+__attribute__((weak)) void loop() {}
+
+int main(int argc, char** argv) {
+    if (teensy_bench::first()) {
+        return teensy_bench::run(argc, argv);
+    }
+    long loops = 1;
+    for (int i = 1; i < argc; ++i) {
+        if (!strcmp(argv[i], "--loops") && i + 1 < argc) {
+            loops = atol(argv[++i]);
+        }
+    }
+    setup();
+    for (long i = 0; i < loops; ++i) {
+        loop();
+    }
+    Serial.flush();
+    return 0;
+}
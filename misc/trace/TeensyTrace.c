@@ -0,0 +1,317 @@
+#include "TeensyTrace.h"
+
+#include <string.h>
+
+#if defined(__ZEPHYR__)
+#if __has_include(<zephyr/kernel.h>)
+#include <zephyr/kernel.h>
+#else
+#include <kernel.h>
+#endif
+#ifdef CONFIG_USE_SEGGER_RTT
+#include <SEGGER_RTT.h>
+#endif
+#else
+#include <Arduino.h>
+#endif
+
+#ifndef FASTRUN
+#define FASTRUN
+#endif
+
+#define RECORD_MAX (4 + 3 * 5 + TEENSY_TRACE_MAX_NAME)
+#define TASK_CACHE_SIZE 16
+
+#if !defined(CONFIG_USE_SEGGER_RTT)
+/* Layout of the SEGGER RTT control block, located by the debugger through its ID */
+typedef struct {
+    const char* name;
+    char* buffer;
+    unsigned size;
+    volatile unsigned wr_off;
+    volatile unsigned rd_off;
+    unsigned flags;
+} rtt_buffer_t;
+
+typedef struct {
+    char id[16];
+    int max_up_buffers;
+    int max_down_buffers;
+    rtt_buffer_t up[1];
+    rtt_buffer_t down[1];
+} rtt_control_block_t;
+
+rtt_control_block_t _SEGGER_RTT __attribute__((used, aligned(4)));
+static char up_buffer[TEENSY_TRACE_BUFFER_SIZE];
+static char down_buffer[16];
+
+static int rtt_write(const uint8_t* data, unsigned len) {
+    rtt_buffer_t* up = &_SEGGER_RTT.up[0];
+    const unsigned size = up->size;
+    unsigned wr = up->wr_off;
+    const unsigned rd = up->rd_off;
+    const unsigned avail = rd > wr ? rd - wr - 1 : size - 1 - wr + rd;
+    if (len > avail) {
+        return 0;
+    }
+    unsigned first = size - wr;
+    if (first > len) {
+        first = len;
+    }
+    memcpy(up->buffer + wr, data, first);
+    memcpy(up->buffer, data + first, len - first);
+    wr += len;
+    if (wr >= size) {
+        wr -= size;
+    }
+    __asm__ volatile("dmb" ::: "memory");
+    up->wr_off = wr;
+    return 1;
+}
+
+static void rtt_init(void) {
+    rtt_control_block_t* cb = &_SEGGER_RTT;
+    cb->max_up_buffers = 1;
+    cb->max_down_buffers = 1;
+    cb->up[0].name = "Trace";
+    cb->up[0].buffer = up_buffer;
+    cb->up[0].size = sizeof(up_buffer);
+    cb->down[0].name = "Trace";
+    cb->down[0].buffer = down_buffer;
+    cb->down[0].size = sizeof(down_buffer);
+    /* the ID is written last and not as one string, so no other copy of it is found in RAM */
+    __asm__ volatile("dmb" ::: "memory");
+    memcpy(cb->id + 7, "RTT", 4);
+    memcpy(cb->id, "SEGGER", 6);
+    cb->id[6] = ' ';
+    __asm__ volatile("dmb" ::: "memory");
+}
+#else
+static int rtt_write(const uint8_t* data, unsigned len) {
+    return SEGGER_RTT_WriteSkipNoLock(0, data, len) == len;
+}
+
+static void rtt_init(void) {}
+#endif
+
+static volatile uint8_t initialized;
+static uint32_t last_cycles;
+static uint32_t dropped;
+static uintptr_t named_tasks[TASK_CACHE_SIZE];
+static unsigned named_tasks_next;
+
+static inline uint32_t irq_save(void) {
+    uint32_t primask;
+    __asm__ volatile("mrs %0, primask\n\tcpsid i" : "=r"(primask)::"memory");
+    return primask;
+}
+
+static inline void irq_restore(uint32_t primask) {
+    __asm__ volatile("msr primask, %0" ::"r"(primask) : "memory");
+}
+
+static inline unsigned put_leb128(uint8_t* buf, uint32_t value) {
+    unsigned len = 0;
+    do {
+        const uint8_t byte = value & 0x7f;
+        value >>= 7;
+        buf[len++] = value ? (byte | 0x80) : byte;
+    } while (value);
+    return len;
+}
+
+/* SYNC, length of the rest, type, timestamp delta and the arguments as LEB128 */
+static unsigned build(uint8_t* buf, uint8_t type, uint32_t delta, const uint32_t* args, unsigned nargs,
+    const char* text, unsigned text_len) {
+    unsigned len = 2;
+    buf[len++] = type;
+    len += put_leb128(buf + len, delta);
+    for (unsigned i = 0; i < nargs; ++i) {
+        len += put_leb128(buf + len, args[i]);
+    }
+    if (text_len) {
+        memcpy(buf + len, text, text_len);
+        len += text_len;
+    }
+    buf[0] = TEENSY_TRACE_SYNC;
+    buf[1] = (uint8_t) (len - 2);
+    return len;
+}
+
+static void emit(uint8_t type, const uint32_t* args, unsigned nargs, const char* text, unsigned text_len) {
+    uint8_t buf[RECORD_MAX];
+    if (!initialized) {
+        teensy_trace_init();
+    }
+    const uint32_t primask = irq_save();
+    const uint32_t now = teensy_trace_cycles();
+    uint32_t delta = now - last_cycles;
+    if (dropped) {
+        const unsigned len = build(buf, TEENSY_TRACE_EV_DROPPED, delta, &dropped, 1, NULL, 0);
+        if (!rtt_write(buf, len)) {
+            ++dropped;
+            irq_restore(primask);
+            return;
+        }
+        dropped = 0;
+        last_cycles = now;
+        delta = 0;
+    }
+    const unsigned len = build(buf, type, delta, args, nargs, text, text_len);
+    if (rtt_write(buf, len)) {
+        last_cycles = now;
+    } else {
+        ++dropped;
+    }
+    irq_restore(primask);
+}
+
+void teensy_trace_init(void) {
+    const uint32_t primask = irq_save();
+    if (!initialized) {
+#if !defined(__ZEPHYR__) && (defined(__ARM_ARCH_7M__) || defined(__ARM_ARCH_7EM__))
+        ARM_DEMCR |= ARM_DEMCR_TRCENA;
+        ARM_DWT_CTRL |= ARM_DWT_CTRL_CYCCNTENA;
+#endif
+        rtt_init();
+        last_cycles = teensy_trace_cycles();
+        initialized = 1;
+        const uint32_t args[2] = {TEENSY_TRACE_VERSION, teensy_trace_frequency()};
+        uint8_t buf[RECORD_MAX];
+        rtt_write(buf, build(buf, TEENSY_TRACE_EV_HEADER, 0, args, 2, NULL, 0));
+    }
+    irq_restore(primask);
+}
+
+FASTRUN void teensy_trace_event(uint8_t type, uint32_t arg0, uint32_t arg1) {
+    const uint32_t args[2] = {arg0, arg1};
+    emit(type, args, type == TEENSY_TRACE_EV_END ? 0 : (type == TEENSY_TRACE_EV_COUNTER ? 2 : 1), NULL, 0);
+}
+
+void teensy_trace_task_switch(uintptr_t task, const char* name) {
+    const uint32_t id = (uint32_t) task;
+    if (name) {
+        unsigned i = 0;
+        while (i < TASK_CACHE_SIZE && named_tasks[i] != task) {
+            ++i;
+        }
+        if (i == TASK_CACHE_SIZE) {
+            named_tasks[named_tasks_next] = task;
+            named_tasks_next = (named_tasks_next + 1) % TASK_CACHE_SIZE;
+            emit(TEENSY_TRACE_EV_TASK_NAME, &id, 1, name, strnlen(name, TEENSY_TRACE_MAX_NAME));
+        }
+    }
+    emit(TEENSY_TRACE_EV_TASK_SWITCH, &id, 1, NULL, 0);
+}
+
+#if defined(__ZEPHYR__)
+__attribute__((weak)) uint32_t teensy_trace_cycles(void) {
+    return k_cycle_get_32();
+}
+
+__attribute__((weak)) uint32_t teensy_trace_frequency(void) {
+    return sys_clock_hw_cycles_per_sec();
+}
+
+static inline uint32_t current_exception(void) {
+    uint32_t ipsr;
+    __asm__ volatile("mrs %0, ipsr" : "=r"(ipsr));
+    return ipsr & 0x1ff;
+}
+
+/* CONFIG_TRACING_USER hooks */
+void sys_trace_isr_enter_user(int nested_interrupts) {
+    (void) nested_interrupts;
+    teensy_trace_event(TEENSY_TRACE_EV_ISR_ENTER, current_exception(), 0);
+}
+
+void sys_trace_isr_exit_user(int nested_interrupts) {
+    (void) nested_interrupts;
+    teensy_trace_event(TEENSY_TRACE_EV_ISR_EXIT, current_exception(), 0);
+}
+
+void sys_trace_thread_switched_in_user(void) {
+    const k_tid_t thread = k_current_get();
+#ifdef CONFIG_THREAD_NAME
+    teensy_trace_task_switch((uintptr_t) thread, k_thread_name_get(thread));
+#else
+    teensy_trace_task_switch((uintptr_t) thread, NULL);
+#endif
+}
+#else
+#if defined(__ARM_ARCH_7M__) || defined(__ARM_ARCH_7EM__)
+__attribute__((weak)) uint32_t teensy_trace_cycles(void) {
+    return ARM_DWT_CYCCNT;
+}
+#else
+extern volatile uint32_t systick_millis_count;
+
+/* Cortex-M0+ has no cycle counter, SysTick counts down once per millisecond */
+__attribute__((weak)) uint32_t teensy_trace_cycles(void) {
+    const uint32_t primask = irq_save();
+    uint32_t count = systick_millis_count;
+    const uint32_t current = SYST_CVR;
+    if ((SCB_ICSR & SCB_ICSR_PENDSTSET) && current > 50) {
+        ++count;
+    }
+    irq_restore(primask);
+    return count * (F_CPU / 1000) + (SYST_RVR - current);
+}
+#endif
+
+__attribute__((weak)) uint32_t teensy_trace_frequency(void) {
+#ifdef F_CPU_ACTUAL
+    return F_CPU_ACTUAL;
+#else
+    return F_CPU;
+#endif
+}
+
+#define NUM_EXCEPTIONS (NVIC_NUM_INTERRUPTS + 16)
+
+static void (*original_handlers[NUM_EXCEPTIONS])(void);
+
+/* Shared by all hooked exceptions, IPSR tells which one is active */
+static FASTRUN void trace_handler(void) {
+    uint32_t ipsr;
+    __asm__ volatile("mrs %0, ipsr" : "=r"(ipsr));
+    const uint32_t exception = ipsr & 0x1ff;
+    teensy_trace_event(TEENSY_TRACE_EV_ISR_ENTER, exception, 0);
+    original_handlers[exception]();
+    teensy_trace_event(TEENSY_TRACE_EV_ISR_EXIT, exception, 0);
+}
+
+void teensy_trace_hook_exception(int exception) {
+    if (exception < 2 || exception >= NUM_EXCEPTIONS || _VectorsRam[exception] == trace_handler) {
+        return;
+    }
+    teensy_trace_init();
+    const uint32_t primask = irq_save();
+    original_handlers[exception] = _VectorsRam[exception];
+    _VectorsRam[exception] = trace_handler;
+    __asm__ volatile("dsb\n\tisb" ::: "memory");
+    irq_restore(primask);
+}
+
+void teensy_trace_hook_all_irqs(void) {
+    /* the default handler fills most of the table */
+    void (*fallback)(void) = NULL;
+    unsigned fallback_count = 0;
+    for (int i = 16; i < NUM_EXCEPTIONS; ++i) {
+        unsigned count = 0;
+        for (int j = 16; j < NUM_EXCEPTIONS; ++j) {
+            count += _VectorsRam[j] == _VectorsRam[i];
+        }
+        if (count > fallback_count) {
+            fallback = _VectorsRam[i];
+            fallback_count = count;
+        }
+    }
+    for (int i = 16; i < NUM_EXCEPTIONS; ++i) {
+        if (_VectorsRam[i] != fallback) {
+            teensy_trace_hook_exception(i);
+        }
+    }
+    teensy_trace_hook_exception(15); /* SysTick */
+}
+#endif
@@ -0,0 +1,95 @@
+/*
+ * TeensyTrace: timestamped event recording over SEGGER RTT
+ *
+ * Interrupt entry/exit, task switches, user slices, instant markers and
+ * counters are written as small binary records to RTT up-buffer 0. The host
+ * reads them from the J-Link RTT telnet port and converts them to a Perfetto
+ * trace, see builder/teensytools/rtttrace.py and `pio run -t rtt_trace`.
+ *
+ * Names passed to the macros are placed in the `.trace_str` section, which
+ * stays in the ELF file but is not loaded onto the target; only their
+ * address is sent.
+ *
+ * Enabled with `build_flags = -DTEENSY_RTT_TRACE`.
+ *
+ * Arduino: call teensy_trace_hook_all_irqs() (or teensy_trace_hook_irq())
+ * at the end of setup(), after the libraries installed their handlers.
+ * Zephyr: add CONFIG_TRACING=y and CONFIG_TRACING_USER=y to prj.conf,
+ * interrupts and thread switches are then recorded by the tracing hooks.
+ */
+
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+#define TEENSY_TRACE_SYNC 0xA5
+#define TEENSY_TRACE_VERSION 1
+#define TEENSY_TRACE_MAX_NAME 32
+
+#ifndef TEENSY_TRACE_BUFFER_SIZE
+#define TEENSY_TRACE_BUFFER_SIZE 4096
+#endif
+
+/* '@' starts a comment for the ARM assembler, so the "a" (alloc) flag GCC appends is dropped */
+#ifndef TEENSY_TRACE_SECTION
+#define TEENSY_TRACE_SECTION ".trace_str,\"\",%progbits @"
+#endif
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+enum teensy_trace_type {
+    TEENSY_TRACE_EV_HEADER = 1,      /* version, timestamp frequency */
+    TEENSY_TRACE_EV_ISR_ENTER = 2,   /* exception number */
+    TEENSY_TRACE_EV_ISR_EXIT = 3,    /* exception number */
+    TEENSY_TRACE_EV_TASK_SWITCH = 4, /* task id */
+    TEENSY_TRACE_EV_BEGIN = 5,       /* name id */
+    TEENSY_TRACE_EV_END = 6,
+    TEENSY_TRACE_EV_INSTANT = 7,     /* name id */
+    TEENSY_TRACE_EV_COUNTER = 8,     /* name id, zigzag value */
+    TEENSY_TRACE_EV_DROPPED = 9,     /* number of records lost since the last record */
+    TEENSY_TRACE_EV_TASK_NAME = 10   /* task id, name bytes */
+};
+
+/* Sets up the RTT control block and sends the header, called by the first event. */
+void teensy_trace_init(void);
+
+/* Records an event with up to two arguments. */
+void teensy_trace_event(uint8_t type, uint32_t arg0, uint32_t arg1);
+
+/* Records a switch to `task`, `name` (may be NULL) is sent the first times a task is seen. */
+void teensy_trace_task_switch(uintptr_t task, const char* name);
+
+/* Timestamp source, the DWT cycle counter or SysTick by default. */
+uint32_t teensy_trace_cycles(void);
+uint32_t teensy_trace_frequency(void);
+
+#if !defined(__ZEPHYR__)
+/* Records entry and exit of the handler for exception number `exception` (IRQ number + 16). */
+void teensy_trace_hook_exception(int exception);
+/* Hooks all interrupts that have a handler other than the default one. */
+void teensy_trace_hook_all_irqs(void);
+#define teensy_trace_hook_irq(irq) teensy_trace_hook_exception((irq) + 16)
+#endif
+
+#define TEENSY_TRACE_NAME(name)                                                                                 \
+    __extension__({                                                                                             \
+        static const char _teensy_trace_name[] __attribute__((section(TEENSY_TRACE_SECTION), used)) = name;     \
+        (uint32_t)(uintptr_t)_teensy_trace_name;                                                                \
+    })
+
+#define TEENSY_TRACE_BEGIN(name) teensy_trace_event(TEENSY_TRACE_EV_BEGIN, TEENSY_TRACE_NAME(name), 0)
+#define TEENSY_TRACE_END() teensy_trace_event(TEENSY_TRACE_EV_END, 0, 0)
+#define TEENSY_TRACE_INSTANT(name) teensy_trace_event(TEENSY_TRACE_EV_INSTANT, TEENSY_TRACE_NAME(name), 0)
+#define TEENSY_TRACE_COUNTER(name, value)                                                                       \
+    do {                                                                                                        \
+        const int32_t _teensy_trace_value = (value);                                                            \
+        teensy_trace_event(TEENSY_TRACE_EV_COUNTER, TEENSY_TRACE_NAME(name),                                    \
+            ((uint32_t) _teensy_trace_value << 1) ^ (uint32_t) (_teensy_trace_value >> 31));                    \
+    } while (0)
+
+#ifdef __cplusplus
+}
+#endif
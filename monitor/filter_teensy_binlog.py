@@ -0,0 +1,84 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import codecs
+import os
+import sys
+import time
+
+from platformio.public import DeviceMonitorFilterBase, load_build_metadata
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "builder"))
+
+from teensytools import binlog  # noqa: E402
+
+
+class TeensyBinLogDecoder(DeviceMonitorFilterBase):
+    """Decodes TeensyBinLog records in the serial monitor.
+
+    Needs `monitor_encoding = latin-1`: the monitor has to pass every byte
+    through unchanged, but records contain arbitrary bytes and start with
+    0xB7, which the UTF-8 decoder drops or merges with the previous byte
+    (e.g. "\u00b7" is C2 B7).
+    """
+
+    NAME = "teensy_binlog"
+    # share of the time spent decoding at which the monitor no longer keeps up
+    SATURATED = 0.9
+
+    def __call__(self):
+        self.decoder = None
+        self.busy = 0.0
+        self.window_start = time.monotonic()
+        self.saturated = False
+        encoding = (getattr(self, "options", None) or {}).get("encoding")
+        if encoding and codecs.lookup(encoding).name != "iso8859-1":
+            sys.stderr.write(
+                "%s: binary records need `monitor_encoding = latin-1` (not %s), "
+                "records are not decoded\n" % (self.__class__.__name__, encoding))
+            return self
+        firmware_path = None
+        try:
+            data = load_build_metadata(os.path.abspath(self.project_dir), self.environment)
+            firmware_path = data.get("prog_path")
+        except Exception:  # pylint: disable=broad-except
+            pass
+        if not firmware_path or not os.path.isfile(firmware_path):
+            sys.stderr.write(
+                "%s: firmware not found, build the project before starting the monitor\n"
+                % self.__class__.__name__)
+            return self
+        self.decoder = binlog.Decoder(binlog.load_formats(firmware_path))
+        return self
+
+    def rx(self, text):
+        # latin-1 maps the characters back to the raw bytes
+        if self.decoder is None:
+            return text
+        start = time.monotonic()
+        text = self.decoder.feed(text.encode("latin-1", "replace"))
+        now = time.monotonic()
+        self.busy += now - start
+        if now - self.window_start >= 2.0:
+            # decoding runs on the monitor's read path, the board has to wait meanwhile
+            if self.busy >= self.SATURATED * (now - self.window_start) and not self.saturated:
+                self.saturated = True
+                sys.stderr.write(
+                    "%s: decoding does not keep up with the board, it blocks or drops "
+                    "records; use `python -m teensytools.binlog firmware.elf --port PORT` "
+                    "to buffer the stream\n" % self.__class__.__name__)
+            self.busy = 0.0
+            self.window_start = now
+        return text
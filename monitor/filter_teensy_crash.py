@@ -0,0 +1,59 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import sys
+
+from platformio.public import DeviceMonitorFilterBase, load_build_metadata
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "builder"))
+
+from teensytools import symbolize  # noqa: E402
+
+
+class TeensyCrashDecoder(DeviceMonitorFilterBase):
+    NAME = "teensy_crash"
+
+    def __call__(self):
+        self.buffer = ""
+        self.symbolizer = None
+        try:
+            data = load_build_metadata(os.path.abspath(self.project_dir), self.environment)
+        except Exception:  # pylint: disable=broad-except
+            data = {}
+        firmware_path = data.get("prog_path")
+        if not firmware_path or not os.path.isfile(firmware_path):
+            sys.stderr.write(
+                "%s: firmware not found, build the project before starting the monitor\n"
+                % self.__class__.__name__)
+            return self
+        addr2line = None
+        if data.get("cc_path"):
+            cc_dir, cc_name = os.path.split(data["cc_path"])
+            addr2line = os.path.join(cc_dir, cc_name.replace("gcc", "addr2line"))
+        self.symbolizer = symbolize.Symbolizer(firmware_path, addr2line)
+        return self
+
+    def rx(self, text):
+        if self.symbolizer is None:
+            return text
+        self.buffer += text
+        if "\n" not in self.buffer:
+            return ""
+        complete, self.buffer = self.buffer.rsplit("\n", 1)
+        lines = complete.split("\n")
+        if "0x" in complete:
+            lines = self.symbolizer.annotate(lines)
+        return "\n".join(lines) + "\n"
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
 import sys
 import platform
 
@@ -19,10 +21,18 @@ from platformio import exception, util
 from platformio.public import PlatformBase
 from platformio.util import get_systype
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "builder"))
+
+from teensytools import fingerprint, pkgmirror, sizecache  # noqa: E402
+
 
 IS_WINDOWS = sys.platform.startswith("win")
 
 
+def environ_flag(name):
+    return os.environ.get(name, "").lower() in ("1", "yes", "true")
+
+
 class TeensytsPlatform(PlatformBase):
 
     @staticmethod
@@ -138,6 +148,99 @@ class TeensytsPlatform(PlatformBase):
 
         return super().configure_default_packages(variables, targets)
 
+    def run(self, variables, targets, silent, verbose, jobs):
+        state = None
+        build_dir = None
+        os.environ.pop(fingerprint.ENV_VAR, None)
+        if self._is_fast_noop_possible(variables, targets):
+            build_dir = os.path.join(
+                self.config.get("platformio", "build_dir"), variables["pioenv"])
+            digest = self._get_build_fingerprint(variables)
+            os.environ[fingerprint.ENV_VAR] = digest
+            state = fingerprint.load_current(build_dir, digest)
+        if state is None:
+            return super().run(variables, targets, silent, verbose, jobs)
+        # nothing changed since the last successful build
+        if "upload" in targets:
+            return super().run(variables, targets + ["nobuild"], silent, verbose, jobs)
+        if not silent:
+            self._print_cached_size(variables, state)
+        return {"returncode": 0, "out": "", "err": ""}
+
+    def install_package(self, name, spec=None, force=False):
+        mirror = os.environ.get("TEENSY_PACKAGE_MIRROR")
+        git_spec = None
+        if mirror and spec is None and (force or not self.get_package(name)):
+            git_spec = pkgmirror.parse_spec(self.packages.get(name, {}).get("version"))
+        if not git_spec:
+            return super().install_package(name, spec, force)
+        return pkgmirror.install(
+            mirror, name, git_spec, lambda: super(TeensytsPlatform, self).install_package(
+                name, spec, force))
+
+    def _is_fast_noop_possible(self, variables, targets):
+        if not set(targets) <= set(fingerprint.BUILD_TARGETS):
+            return False
+        if "piotest_running_name" in variables or environ_flag("TEENSY_DISABLE_FAST_NOOP"):
+            return False
+        options = self.config.items(env=variables["pioenv"], as_dict=True)
+        return str(options.get("custom_fast_noop", "yes")).lower() not in ("0", "no", "false")
+
+    def _get_build_fingerprint(self, variables):
+        env = variables["pioenv"]
+        options = self.config.items(env=env, as_dict=True)
+        options = {
+            key: value for key, value in options.items()
+            if not key.startswith(("monitor_", "test_", "debug_")) and key != "upload_port"
+        }
+        paths = [variables.get("project_config") or self.config.path]
+        paths.extend(
+            os.path.join(self.get_dir(), name)
+            for name in ("builder", "boards", "misc", "platform.json", "platform.py"))
+        for option in ("src_dir", "include_dir", "lib_dir", "test_dir", "boards_dir"):
+            paths.append(self.config.get("platformio", option))
+        paths.append(os.path.join(self.config.get("platformio", "libdeps_dir"), env))
+        paths.extend(options.get("lib_extra_dirs", []))
+        paths.extend(
+            script.split(":", 1)[-1] if script.startswith(("pre:", "post:")) else script
+            for script in options.get("extra_scripts", []))
+        board = options.get("board")
+        data = dict(
+            env=env,
+            options=options,
+            board=self.board_config(board).manifest if board else None,
+            packages={name: self.get_package_version(name) for name in sorted(self.packages)},
+            environ={
+                key: value for key, value in os.environ.items()
+                if key.startswith(("PLATFORMIO_", "TEENSY_")) and key != fingerprint.ENV_VAR
+            },
+        )
+        return fingerprint.input_digest(paths, data)
+
+    def _print_cached_size(self, variables, state):
+        print("Build is up to date, skipping SCons")
+        report = None
+        if state.get("size_report"):
+            try:
+                with open(state["size_report"]) as fp:
+                    report = json.load(fp)
+            except (OSError, ValueError):
+                pass
+        if not report:
+            return
+        if report.get("summary"):
+            print(report["summary"])
+            return
+        board = self.board_config(self.config.get("env:" + variables["pioenv"], "board"))
+        regions = report.get("regions", {})
+        for title, region, limit in (
+                ("RAM:  ", "data", "upload.maximum_ram_size"),
+                ("Flash:", "program", "upload.maximum_size")):
+            size = regions.get(region, -1)
+            total = int(board.get(limit, 0))
+            if size > -1 and total:
+                print("%s %s" % (title, sizecache.format_usage(size, total)))
+
     def get_boards(self, id_=None):
         result = super().get_boards(id_)
         if not result:
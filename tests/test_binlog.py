@@ -0,0 +1,117 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import struct
+import sys
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import binlog  # noqa: E402
+
+
+def record(ident, payload):
+    body = bytearray()
+    while True:
+        byte = ident & 0x7F
+        ident >>= 7
+        body.append(byte | 0x80 if ident else byte)
+        if not ident:
+            break
+    body += payload
+    return bytes([binlog.SYNC, len(body)]) + bytes(body)
+
+
+class DecoderTest(unittest.TestCase):
+
+    formats = {
+        0x10: binlog.Format("adc %d: %.2f V\n"),
+        0x300: binlog.Format("state %s -> %s (%u)\n"),
+        0x20: binlog.Format("t=%llu %a\n"),
+    }
+
+    def test_records_and_text(self):
+        data = b"boot\n" + record(0x10, struct.pack("<id", 3, 1.25))
+        data += record(0x300, b"\x04idle\x03run" + struct.pack("<I", 7))
+        data += record(0x20, struct.pack("<Qd", 1 << 40, 0.5)) + b"done\n"
+        decoder = binlog.Decoder(self.formats)
+        self.assertEqual(
+            decoder.feed(data),
+            "boot\nadc 3: 1.25 V\nstate idle -> run (7)\nt=1099511627776 0x1.0000000000000p-1\ndone\n")
+        self.assertEqual((decoder.records, decoder.errors), (3, 0))
+
+    def test_split_records(self):
+        data = record(0x10, struct.pack("<id", 1, 2.0)) * 3
+        decoder = binlog.Decoder(self.formats)
+        text = "".join(decoder.feed(data[i:i + 5]) for i in range(0, len(data), 5))
+        self.assertEqual(text, "adc 1: 2.00 V\n" * 3)
+
+    def test_errors(self):
+        data = record(0x99, b"") + record(0x10, b"\x01") + record(0x300, b"\x09idle")
+        decoder = binlog.Decoder(self.formats)
+        self.assertEqual(
+            decoder.feed(data),
+            "<binlog: unknown format id 0x99>\n<binlog: short record>\n<binlog: short record>\n")
+        self.assertEqual((decoder.records, decoder.errors), (0, 3))
+
+
+class StreamTest(unittest.TestCase):
+
+    formats = {0x10: binlog.Format("adc %d: %.2f V\n")}
+
+    def test_buffers_behind_slow_decoder(self):
+        chunks = [b"boot\n", record(0x10, struct.pack("<id", 1, 2.0)) * 1000, b""]
+        decoding = threading.Event()
+        queued = threading.Event()
+
+        def read():
+            if len(chunks) == 2:
+                decoding.wait(5)
+            elif len(chunks) == 1:
+                queued.set()
+            return chunks.pop(0)
+
+        class SlowOutput(io.StringIO):
+
+            def write(self, text):
+                # the reader keeps going while the first chunk is decoded
+                decoding.set()
+                queued.wait(5)
+                return io.StringIO.write(self, text)
+
+        output = SlowOutput()
+        raw = io.BytesIO()
+        with redirect_stderr(io.StringIO()) as stderr:
+            decoder = binlog.decode_stream(
+                read, binlog.Decoder(self.formats), output, raw, backlog_warning=1000)
+        self.assertEqual(output.getvalue(), "boot\n" + "adc 1: 2.00 V\n" * 1000)
+        self.assertEqual(decoder.records, 1000)
+        self.assertEqual(len(raw.getvalue()), 5 + 15 * 1000)
+        self.assertIn("behind the stream", stderr.getvalue())
+
+    def test_read_error(self):
+        def read():
+            raise OSError("device disconnected")
+
+        with redirect_stderr(io.StringIO()) as stderr:
+            binlog.decode_stream(read, binlog.Decoder(self.formats), io.StringIO())
+        self.assertIn("device disconnected", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import distcc  # noqa: E402
+
+# stands in for the ARM compiler: -E copies the source, -c writes the
+# command line and the input into the object file
+FAKE_COMPILER = """\
+#!%s
+import json, sys
+args = sys.argv[1:]
+if args == ["-dumpmachine"] or args == ["-dumpfullversion"]:
+    print("arm-none-eabi 11.3.1")
+    sys.exit(0)
+if args[0].startswith("-print-prog-name="):
+    print(args[0].split("=", 1)[1])
+    sys.exit(0)
+output = args[args.index("-o") + 1]
+source = [a for a in args if a.endswith((".cpp", ".c", ".ii", ".i")) and a != output][-1]
+with open(source, "rb") as fp:
+    data = fp.read()
+if "-E" in args:
+    data = b"# 1 preprocessed\\n" + data
+else:
+    data = json.dumps(args).encode() + b"\\n" + data
+with open(output, "wb") as fp:
+    fp.write(data)
+"""
+
+# the command line of a Teensy 4.1 Arduino compile
+TEENSY4_FLAGS = [
+    "-fno-exceptions", "-fno-non-call-exceptions", "-fno-unwind-tables",
+    "-fno-asynchronous-unwind-tables", "-felide-constructors", "-fno-rtti", "-std=gnu++20",
+    "-Wno-error=narrowing", "-Wno-volatile", "-fpermissive", "-Wall", "-Wextra",
+    "-ffunction-sections", "-fdata-sections", "-mthumb", "-mcpu=cortex-m7", "-nostdlib",
+    "--specs=nano.specs", "-mfloat-abi=hard", "-mfpu=fpv5-d16", "-O2",
+    "-DPLATFORMIO=60118", "-D__IMXRT1062__", "-DARDUINO_TEENSY41", "-DUSB_SERIAL",
+    "-DARDUINO=10819", "-DTEENSYDUINO=159", "-DCORE_TEENSY", "-DF_CPU=600000000",
+    "-DLAYOUT_US_ENGLISH", "-Iinclude", "-Isrc",
+]
+REMOTE_FLAGS = [
+    flag for flag in TEENSY4_FLAGS if not flag.startswith(("-D", "-I", "--specs="))]
+
+
+class SplitTest(unittest.TestCase):
+
+    def test_teensy_command(self):
+        args = ["arm-cortexm7f-eabi-g++", "-o", "main.cpp.o", "-c"] + TEENSY4_FLAGS + ["main.cpp"]
+        self.assertEqual(distcc.split_command(args), (REMOTE_FLAGS, "main.cpp", "main.cpp.o"))
+
+    def test_rejected_options(self):
+        for option in ("-Wa,-a=/tmp/listing", "-fplugin=/tmp/x.so", "-fdump-tree-all",
+                       "-specs=/tmp/evil.specs", "-B/tmp"):
+            args = ["arm-cortexm7f-eabi-gcc", "-c", option, "-o", "a.o", "a.c"]
+            self.assertIsNone(distcc.split_command(args), option)
+
+
+class WorkerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.tmp_dir, "bin")
+        os.makedirs(bin_dir)
+        self.compiler = os.path.join(bin_dir, "arm-cortexm7f-eabi-g++")
+        with open(self.compiler, "w") as fp:
+            fp.write(FAKE_COMPILER % sys.executable)
+        os.chmod(self.compiler, os.stat(self.compiler).st_mode | stat.S_IEXEC)
+        self.server = distcc.WorkerServer(("127.0.0.1", 0), 2, "secret", bin_dir)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.source = os.path.join(self.tmp_dir, "main.cpp")
+        with open(self.source, "w") as fp:
+            fp.write("void setup() {}\n")
+        self.output = os.path.join(self.tmp_dir, "main.cpp.o")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def compile(self, token):
+        args = [self.compiler, "-o", self.output, "-c"] + TEENSY4_FLAGS + [self.source]
+        returncode = distcc.client_compile(
+            args, [self.server.server_address], os.path.join(self.tmp_dir, "cache"), token)
+        self.assertEqual(returncode, 0)
+        with open(self.output, "rb") as fp:
+            command, data = fp.read().split(b"\n", 1)
+        return json.loads(command.decode()), data
+
+    def test_remote_round_trip(self):
+        command, data = self.compile("secret")
+        # compiled by the worker from the preprocessed unit, without the local options
+        self.assertEqual(command[:len(REMOTE_FLAGS)], REMOTE_FLAGS)
+        self.assertEqual(command[len(REMOTE_FLAGS):len(REMOTE_FLAGS) + 2], ["-x", "c++-cpp-output"])
+        self.assertEqual(data, b"# 1 preprocessed\nvoid setup() {}\n")
+
+    def test_wrong_token_compiles_locally(self):
+        command, data = self.compile("wrong")
+        self.assertIn("--specs=nano.specs", command)
+        self.assertEqual(data, b"void setup() {}\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import pkgmirror  # noqa: E402
+
+
+def git(*args, **kwargs):
+    return subprocess.check_output(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@localhost",
+         "-c", "init.defaultBranch=main", "-c", "protocol.file.allow=always"] + list(args),
+        universal_newlines=True, stderr=subprocess.DEVNULL, **kwargs).strip()
+
+
+def object_count(git_dir):
+    output = git("--git-dir", git_dir, "cat-file", "--batch-all-objects", "--batch-check")
+    return len(output.splitlines()) if output else 0
+
+
+@unittest.skipIf(pkgmirror.git_version() < pkgmirror.MIN_GIT_VERSION, "git is too old")
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.mirror = os.path.join(self.tmp_dir, "mirror")
+        self.first, self.head = self.make_repo("toolchain", ["old", "shared"], ["new", "shared"])
+        self.url = "file://" + os.path.join(self.tmp_dir, "toolchain.git")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_repo(self, name, *revisions):
+        """Bare repository `name`.git with one commit per (tool, shared) content pair."""
+        work = os.path.join(self.tmp_dir, name)
+        git("init", "--quiet", work)
+        commits = []
+        for tool, shared in revisions:
+            for filename, content in (("tool.txt", tool), ("shared.txt", shared)):
+                with open(os.path.join(work, filename), "w") as fp:
+                    fp.write(content + "\n")
+            git("-C", work, "add", "-A")
+            git("-C", work, "commit", "--quiet", "-m", tool)
+            commits.append(git("-C", work, "rev-parse", "HEAD"))
+        git("clone", "--quiet", "--bare", work, os.path.join(self.tmp_dir, name + ".git"))
+        return commits
+
+    def test_shallow_single_revision(self):
+        repo, commit = pkgmirror.fetch(self.mirror, self.url, "main")
+        self.assertEqual(commit, self.head)
+        store = os.path.join(self.mirror, "objects.git")
+        # the commit, its tree and two blobs, nothing of the first revision
+        self.assertEqual(object_count(store), 4)
+        self.assertNotEqual(subprocess.call(
+            ["git", "--git-dir", store, "cat-file", "-e", self.first]), 0)
+        self.assertEqual(git("--git-dir", repo, "rev-list", "--count", "main"), "1")
+
+    def test_identical_content_stored_once(self):
+        self.make_repo("framework", ["other", "shared"])
+        pkgmirror.fetch(self.mirror, self.url, "main")
+        repo, _ = pkgmirror.fetch(
+            self.mirror, "file://" + os.path.join(self.tmp_dir, "framework.git"), "main")
+        # the second repository adds a commit, a tree and one blob; shared.txt is reused
+        self.assertEqual(object_count(os.path.join(self.mirror, "objects.git")), 7)
+        # repositories only borrow the objects from the store
+        self.assertEqual(os.listdir(os.path.join(repo, "objects", "pack")), [])
+
+    def test_clone_through_redirect(self):
+        target = os.path.join(self.tmp_dir, "installed")
+        with pkgmirror.redirect(self.mirror, self.url, "main"):
+            # the mirror answers, the original repository is not needed
+            shutil.move(os.path.join(self.tmp_dir, "toolchain.git"),
+                        os.path.join(self.tmp_dir, "moved.git"))
+            git("clone", "--quiet", self.url, target)
+        self.assertEqual(git("-C", target, "rev-parse", "HEAD"), self.head)
+        with open(os.path.join(target, "tool.txt")) as fp:
+            self.assertEqual(fp.read(), "new\n")
+        self.assertNotIn("GIT_CONFIG_COUNT", os.environ)
+
+    def test_mirrored_branch_used_when_remote_fails(self):
+        pkgmirror.fetch(self.mirror, self.url, "main")
+        shutil.rmtree(os.path.join(self.tmp_dir, "toolchain.git"))
+        with redirect_stderr(io.StringIO()) as stderr:
+            _, commit = pkgmirror.fetch(self.mirror, self.url, "main")
+        self.assertEqual(commit, self.head)
+        self.assertIn("using the mirrored revision", stderr.getvalue())
+
+    def test_install_falls_back_without_mirror(self):
+        calls = []
+
+        def installer():
+            calls.append(os.environ.get("GIT_CONFIG_COUNT"))
+            return "installed"
+
+        missing = "file://" + os.path.join(self.tmp_dir, "missing.git")
+        with redirect_stderr(io.StringIO()) as stderr:
+            result = pkgmirror.install(self.mirror, "toolchain-gccarmnoneeabi",
+                                       (missing, "main"), installer)
+        self.assertEqual(result, "installed")
+        # called once, without the redirection
+        self.assertEqual(calls, [None])
+        self.assertIn("Package mirror not used for toolchain-gccarmnoneeabi", stderr.getvalue())
+
+        calls[:] = []
+        self.assertEqual(pkgmirror.install(self.mirror, "toolchain-gccarmnoneeabi",
+                                           (self.url, "main"), installer), "installed")
+        self.assertEqual(calls, ["1"])
+
+    def test_abbreviated_commit(self):
+        with self.assertRaises(pkgmirror.MirrorError):
+            pkgmirror.fetch(self.mirror, self.url, self.head[:12])
+
+
+if __name__ == "__main__":
+    unittest.main()
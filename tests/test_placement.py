@@ -0,0 +1,99 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import elf, placement  # noqa: E402
+
+
+def function(name, addr, size, section=None):
+    return elf.Symbol(name, addr, size, elf.STT_FUNC, 1, section, None)
+
+
+class FakeObject(object):
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+
+
+class SamplesTest(unittest.TestCase):
+
+    def test_text_samples(self):
+        samples = placement.parse_text_samples("0x100 3\n# comment\n104\n0x100;2\n")
+        self.assertEqual(samples, {0x100: 5, 0x104: 1})
+
+    def test_swo_pc_samples(self):
+        data = bytearray([0x00, 0x00, 0x80])  # sync
+        data += bytearray([0x17, 0x10, 0x02, 0x00, 0x00])
+        data += bytearray([0xC0, 0x85, 0x01])  # local timestamp
+        data += bytearray([0x17, 0x10, 0x02, 0x00, 0x00])
+        self.assertEqual(placement.parse_swo_samples(data), {0x210: 2})
+
+    def test_swo_global_timestamps(self):
+        # payload bytes of the global timestamps must not be read as headers
+        data = bytearray([0x94, 0x97, 0x97, 0x97, 0x17])
+        data += bytearray([0xB4, 0x97, 0x17])
+        data += bytearray([0x17, 0x20, 0x00, 0x00, 0x00])
+        self.assertEqual(placement.parse_swo_samples(data), {0x20: 1})
+
+
+class SelectTest(unittest.TestCase):
+
+    functions = [
+        function("hot", 0x100, 64),
+        function("warm", 0x140, 64),
+        function("cold", 0x180, 64),
+        function("fast", 0x1C0, 128),
+    ]
+
+    def test_budget(self):
+        hot, cold, used, pinned = placement.select(
+            self.functions, {"hot": 100, "warm": 10}, budget=64)
+        self.assertEqual(hot, ["hot"])
+        self.assertEqual(cold, ["cold", "fast", "warm"])
+        self.assertEqual((used, pinned), (64, 0))
+
+    def test_pinned_functions_use_budget(self):
+        hot, cold, used, pinned = placement.select(
+            self.functions, {"hot": 100, "warm": 10, "fast": 1000}, budget=256, pinned={"fast"})
+        self.assertEqual(hot, ["hot", "warm"])
+        self.assertEqual(cold, ["cold"])
+        self.assertEqual((used, pinned), (128, 128))
+
+    def test_pinned_sections(self):
+        obj = FakeObject([
+            function("moved", 0, 8, ".text.moved"),
+            function("fast", 0, 8, ".fastrun"),
+            function("plain", 0, 8, ".text"),
+            function("other", 0, 8, ".text.startup.other"),
+            function("flash", 0, 8, ".flashmem"),
+            function("extern", 0, 0, None),
+        ])
+        self.assertEqual(placement.pinned_functions(obj), {"fast", "plain", "other"})
+
+    def test_render_ldscript(self):
+        script = ".text.code : {\n    *(.flashmem*)\n}\n"
+        self.assertEqual(
+            placement.render_ldscript(script, ["a", "b"]),
+            ".text.code : {\n    *(.flashmem*)\n    *(.text.a)\n    *(.text.b)\n}\n")
+        with self.assertRaises(ValueError):
+            placement.render_ldscript("", ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
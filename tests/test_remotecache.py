@@ -0,0 +1,163 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.server
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import remotecache  # noqa: E402
+
+
+class CacheHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(("GET", self.path))
+        if server.get_status != 200:
+            self.send_error(server.get_status)
+            return
+        data = server.entries.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        server = self.server
+        server.requests.append(("PUT", self.path))
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if server.put_status != 201:
+            self.send_error(server.put_status)
+            return
+        server.entries[self.path] = data
+        server.tokens.append(self.headers.get("Authorization"))
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class RemoteStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), CacheHandler)
+        self.server.entries = {}
+        self.server.requests = []
+        self.server.tokens = []
+        self.server.get_status = 200
+        self.server.put_status = 201
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:%d/cache/" % self.server.server_address[1]
+        self.tmp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp_dir, "main.o")
+        with open(self.source, "wb") as fp:
+            fp.write(b"object")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        store = remotecache.RemoteStore(self.url, token="secret")
+        target = os.path.join(self.tmp_dir, "fetched", "main.o")
+        self.assertFalse(store.fetch("ab12", target))
+        self.assertTrue(store.store("ab12", self.source))
+        self.assertTrue(store.fetch("ab12", target))
+        with open(target, "rb") as fp:
+            self.assertEqual(fp.read(), b"object")
+        self.assertEqual(self.server.tokens, ["Bearer secret"])
+        # a miss does not disable anything
+        self.assertTrue(store.can_fetch and store.can_store)
+
+    def test_readonly(self):
+        store = remotecache.RemoteStore(self.url, readonly=True)
+        self.assertFalse(store.store("ab12", self.source))
+        self.assertFalse(any(method == "PUT" for method, _ in self.server.requests))
+        self.server.entries["/cache/ab12"] = b"shared"
+        self.assertTrue(store.fetch("ab12", os.path.join(self.tmp_dir, "out.o")))
+
+    def test_refused_upload_keeps_downloads(self):
+        self.server.put_status = 403
+        self.server.entries["/cache/ab12"] = b"shared"
+        store = remotecache.RemoteStore(self.url)
+        with redirect_stderr(io.StringIO()) as stderr:
+            self.assertFalse(store.store("cd34", self.source))
+            self.assertFalse(store.store("ef56", self.source))
+        self.assertEqual(stderr.getvalue().count("uploads disabled"), 1)
+        self.assertEqual(sum(1 for method, _ in self.server.requests if method == "PUT"), 1)
+        self.assertTrue(store.fetch("ab12", os.path.join(self.tmp_dir, "out.o")))
+
+    def test_refused_download_keeps_uploads(self):
+        self.server.get_status = 500
+        store = remotecache.RemoteStore(self.url)
+        with redirect_stderr(io.StringIO()):
+            self.assertFalse(store.fetch("ab12", os.path.join(self.tmp_dir, "out.o")))
+        self.assertFalse(store.can_fetch)
+        self.assertTrue(store.store("ab12", self.source))
+
+
+class UnreachableTest(unittest.TestCase):
+
+    def test_unreachable_server_disables_both(self):
+        # a port nothing listens on any more
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = "http://127.0.0.1:%d/cache/" % sock.getsockname()[1]
+        sock.close()
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        store = remotecache.RemoteStore(url, timeout=1)
+        with redirect_stderr(io.StringIO()) as stderr:
+            self.assertFalse(store.fetch("ab12", os.path.join(tmp_dir, "out.o")))
+        self.assertFalse(store.can_fetch or store.can_store)
+        self.assertIn("downloads disabled", stderr.getvalue())
+        self.assertIn("uploads disabled", stderr.getvalue())
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_parallel_counting(self):
+        stats = remotecache.Stats()
+
+        def count():
+            for _ in range(1000):
+                stats.add("misses")
+
+        threads = [threading.Thread(target=count) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.misses, 8000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,218 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import rtttrace  # noqa: E402
+
+SYSTICK = 15
+STRINGS = {0x100: "work", 0x104: "level"}
+
+
+def leb128(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        out.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(out)
+
+
+def record(event_type, delta, *args, text=b""):
+    body = bytes([event_type]) + leb128(delta) + b"".join(leb128(a) for a in args) + text
+    return bytes([rtttrace.SYNC, len(body)]) + body
+
+
+# 1 MHz, every cycle is 1 us
+STREAM = b"".join([
+    record(rtttrace.HEADER, 0, 1, 1000000),
+    record(rtttrace.TASK_NAME, 0, 1, text=b"main"),
+    record(rtttrace.TASK_SWITCH, 2, 1),
+    record(rtttrace.ISR_ENTER, 8, SYSTICK),
+    record(rtttrace.ISR_EXIT, 5, SYSTICK),
+    b"noise \xa5\x02\xff\x00",  # a sync byte without a valid record
+    record(rtttrace.BEGIN, 5, 0x100),
+    record(rtttrace.COUNTER, 1, 0x104, 5),  # zigzag encoded -3
+    record(rtttrace.END, 4),
+    record(rtttrace.ISR_ENTER, 5, SYSTICK),
+    record(rtttrace.DROPPED, 10, 7),
+    record(rtttrace.ISR_ENTER, 60, SYSTICK),
+    record(rtttrace.ISR_EXIT, 3, SYSTICK),
+])
+
+EVENTS = [
+    (0, rtttrace.HEADER, [1, 1000000], None),
+    (0, rtttrace.TASK_NAME, [1], "main"),
+    (2, rtttrace.TASK_SWITCH, [1], None),
+    (10, rtttrace.ISR_ENTER, [SYSTICK], None),
+    (15, rtttrace.ISR_EXIT, [SYSTICK], None),
+    (20, rtttrace.BEGIN, [0x100], None),
+    (21, rtttrace.COUNTER, [0x104, 5], None),
+    (25, rtttrace.END, [], None),
+    (30, rtttrace.ISR_ENTER, [SYSTICK], None),
+    (40, rtttrace.DROPPED, [7], None),
+    (100, rtttrace.ISR_ENTER, [SYSTICK], None),
+    (103, rtttrace.ISR_EXIT, [SYSTICK], None),
+]
+
+INTERRUPTS, TASKS, MARKERS, COUNTER_TRACK = 2, 3, 4, 5
+BEGIN, END, INSTANT, COUNTER = 1, 2, 3, 4
+
+# (timestamp ns, type, track, name, counter value)
+TRACK_EVENTS = [
+    (2000, BEGIN, TASKS, "main", None),
+    (10000, BEGIN, INTERRUPTS, "SysTick", None),
+    (15000, END, INTERRUPTS, None, None),
+    (20000, BEGIN, MARKERS, "work", None),
+    (21000, COUNTER, COUNTER_TRACK, None, -3),
+    (25000, END, MARKERS, None, None),
+    (30000, BEGIN, INTERRUPTS, "SysTick", None),
+    # the exit of the open handler was dropped
+    (40000, END, INTERRUPTS, None, None),
+    (40000, INSTANT, MARKERS, "7 records dropped", None),
+    (100000, BEGIN, INTERRUPTS, "SysTick", None),
+    (103000, END, INTERRUPTS, None, None),
+    (103000, END, TASKS, None, None),
+]
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def read_fields(data):
+    """Yields the (field number, value) pairs of a protobuf message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        yield key >> 3, value
+
+
+def track_events(trace):
+    events = []
+    for number, packet in read_fields(trace):
+        assert number == 1
+        fields = dict(read_fields(packet))
+        if 11 not in fields:
+            continue
+        event = dict(read_fields(fields[11]))
+        counter = event.get(30)
+        if counter is not None and counter >= 1 << 63:
+            counter -= 1 << 64
+        name = event.get(23)
+        events.append((fields[8], event[9], event[11],
+                       name.decode() if name is not None else None, counter))
+    return events
+
+
+class DecoderTest(unittest.TestCase):
+
+    def test_split_stream(self):
+        decoder = rtttrace.Decoder()
+        events = []
+        for offset in range(0, len(STREAM), 3):
+            events.extend(decoder.feed(STREAM[offset:offset + 3]))
+        self.assertEqual(events, EVENTS)
+        self.assertEqual((decoder.records, decoder.errors, decoder.dropped), (12, 1, 7))
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.recording = os.path.join(self.tmp_dir, "trace.rtt")
+        with open(self.recording, "wb") as fp:
+            fp.write(STREAM)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def replay(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        address = sock.getsockname()
+        sock.close()
+        # small chunks, records are split between reads
+        thread = threading.Thread(target=rtttrace.serve, args=(self.recording, address, 7))
+        thread.daemon = True
+        thread.start()
+        output = os.path.join(self.tmp_dir, "trace.perfetto-trace")
+        raw = os.path.join(self.tmp_dir, "capture.rtt")
+        deadline = time.time() + 5
+        while True:
+            capture = rtttrace.Capture(output, 600000000, STRINGS, raw_path=raw)
+            try:
+                with capture:
+                    rtttrace.capture_socket(address, capture)
+                break
+            except rtttrace.TraceError:
+                # the server is not listening yet
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+        thread.join(5)
+        with open(output, "rb") as fp, open(raw, "rb") as raw_fp:
+            return capture, fp.read(), raw_fp.read()
+
+    def test_serve_and_capture(self):
+        capture, trace, raw = self.replay()
+        self.assertEqual(raw, rtttrace._BANNER + STREAM)
+        decoder = capture.decoder
+        self.assertEqual((decoder.records, decoder.errors, decoder.dropped), (12, 1, 7))
+        self.assertEqual(track_events(trace), TRACK_EVENTS)
+
+        stats = capture.writer.stats[SYSTICK]
+        # the handler cut off by the dropped records is not counted
+        self.assertEqual((stats.count, stats.total, stats.max), (2, 8000, 5000))
+        # no period across the gap
+        self.assertEqual((stats.intervals, stats.interval_mean), (1, 20000.0))
+        self.assertIn("SysTick", capture.writer.format_stats())
+
+    def test_counter_track_descriptor(self):
+        _, trace, _ = self.replay()
+        descriptors = [dict(read_fields(dict(read_fields(packet))[60]))
+                       for _, packet in read_fields(trace)
+                       if 60 in dict(read_fields(packet))]
+        counter = [d for d in descriptors if d.get(1) == COUNTER_TRACK]
+        self.assertEqual(len(counter), 1)
+        self.assertEqual(counter[0][2], b"level")
+
+
+if __name__ == "__main__":
+    unittest.main()
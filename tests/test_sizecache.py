@@ -0,0 +1,68 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import sizecache  # noqa: E402
+
+SECTIONS = """\
+firmware.elf  :
+section      size        addr
+.text       12000           0
+.data         200   536805376
+.bss         1000   536805576
+Total       13200"""
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = sizecache.report_path(os.path.join(self.tmp_dir, "firmware.elf"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_and_load(self):
+        sizecache.save(self.path, dict(elf="abc", sections=SECTIONS, summary=None, regions={}))
+        self.assertEqual(sizecache.load(self.path, "abc")["sections"], SECTIONS)
+        self.assertIsNone(sizecache.load(self.path, "def"))
+        sizecache.save_check(self.path, "abc", "teensy_size", dict(returncode=0, err=""))
+        self.assertEqual(sizecache.load_check(self.path, "abc", "teensy_size")["returncode"], 0)
+        self.assertEqual(sizecache.load(self.path, "abc")["sections"], SECTIONS)
+
+    def test_calculate(self):
+        self.assertEqual(sizecache.calculate(SECTIONS, r"^(?:\.text|\.data)\s+([0-9]+).*"), 12200)
+        self.assertEqual(sizecache.calculate(None, r"^\.text\s+([0-9]+)"), -1)
+
+    def test_size_tool_stand_in(self):
+        # the script replaces the size tool in PlatformIO's upload size check
+        sizecache.save(self.path, dict(elf="abc", sections=SECTIONS, summary=None, regions={}))
+        output = subprocess.check_output(
+            [sys.executable, sizecache.__file__, self.path], universal_newlines=True)
+        self.assertEqual(output.strip(), SECTIONS)
+        self.assertEqual(subprocess.call(
+            [sys.executable, sizecache.__file__, self.path + ".missing"],
+            stderr=subprocess.DEVNULL), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
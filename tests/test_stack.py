@@ -0,0 +1,39 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import stack  # noqa: E402
+
+
+class StackUsageTest(unittest.TestCase):
+
+    def test_c_and_cpp_lines(self):
+        text = (
+            "main.cpp:5:6:void setup()\t16\tstatic\n"
+            "main.cpp:9:6:void Foo::bar(int, char*)\t32\tdynamic,bounded\n"
+            "C:\\src\\util.c:3:5:helper\t8\tdynamic\n"
+            "not a stack usage line\n")
+        graph = stack.parse_stack_usage(text, stack.CallGraph())
+        self.assertEqual(graph.names, ["void setup()", "void Foo::bar(int, char*)", "helper"])
+        self.assertEqual(graph.frame, [16, 32, 8])
+        self.assertEqual(graph.dynamic, [False, False, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
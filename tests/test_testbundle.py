@@ -0,0 +1,134 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import elf, testbundle  # noqa: E402
+
+OUTPUT = """\
+boot message
+TEENSY_TEST_SUITE test_math
+test/test_math/test_main.cpp:10:test_add:PASS
+test/test_math/test_main.cpp:14:test_div:FAIL: Expected 2 Was 3
+test/test_math/test_main.cpp:20:test_skip:IGNORE
+
+-----------------------
+3 Tests 1 Failures 1 Ignored
+FAIL
+TEENSY_TEST_SUITE net/test_socket
+test/net/test_socket/main.cpp:8:test_open:PASS
+
+-----------------------
+1 Tests 0 Failures 0 Ignored
+OK
+TEENSY_TEST_SUITE test_crash
+test/test_crash/main.cpp:5:test_first:PASS
+"""
+
+
+def symbol(name, bind=elf.STB_GLOBAL, section=1):
+    return elf.Symbol(name, 0, 4, elf.STT_FUNC, bind, section, None)
+
+
+class FakeObject(object):
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+
+
+class SuitesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        for path in ("test_math", "net/test_socket", "net/helpers", "test_crash/test_nested", "other"):
+            os.makedirs(os.path.join(self.test_dir, path))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_find_suites(self):
+        names = [name for name, _ in testbundle.find_suites(self.test_dir)]
+        self.assertEqual(names, ["net/test_socket", "test_crash", "test_math"])
+
+    def test_filter_and_ignore(self):
+        suites = testbundle.find_suites(self.test_dir, ["test_*", "net/*"], ["test_crash"])
+        self.assertEqual(suites, [
+            ("net/test_socket", os.path.join(self.test_dir, "net", "test_socket")),
+            ("test_math", os.path.join(self.test_dir, "test_math"))])
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def test_render_dispatcher(self):
+        source = testbundle.render_dispatcher(["test_a", "net/test_b"])
+        self.assertIn("void teensy_test_suite_0_setup(void);", source)
+        self.assertIn("void teensy_test_suite_1_setup(void);", source)
+        self.assertIn('{"test_a", teensy_test_suite_0_setup},', source)
+        self.assertIn('{"net/test_b", teensy_test_suite_1_setup},', source)
+        self.assertIn('Serial.println("%s");' % testbundle.END_MARKER, source)
+
+    def test_suite_symbols(self):
+        entry, localize = testbundle.suite_symbols(FakeObject([
+            symbol("_Z5setupv"),
+            symbol("_Z8test_addv"),
+            symbol("setUp"),
+            symbol("Unity"),
+            symbol("Unity"),
+            symbol("_Z7helperv", bind=elf.STB_LOCAL),
+            symbol("_ZN5Print5writeEh", bind=2),  # weak, shared with the core
+            symbol("digitalWrite", section=None),  # undefined reference
+        ]))
+        self.assertEqual(entry, "_Z5setupv")
+        self.assertEqual(localize, ["Unity", "_Z8test_addv", "setUp"])
+
+
+class ResultsTest(unittest.TestCase):
+
+    def test_parse_output(self):
+        results = testbundle.parse_output(OUTPUT)
+        self.assertFalse(results["finished"])
+        math, socket, crash = results["suites"]
+        self.assertEqual((math["name"], math["passed"], math["failed"], math["ignored"]),
+                         ("test_math", 1, 1, 1))
+        self.assertEqual(math["tests"][1]["message"], "Expected 2 Was 3")
+        self.assertTrue(math["complete"])
+        self.assertFalse(math["ok"])
+        self.assertTrue(socket["ok"])
+        self.assertFalse(crash["complete"])
+        self.assertFalse(crash["ok"])
+
+    def test_format_and_success(self):
+        results = testbundle.parse_output(OUTPUT + testbundle.END_MARKER + "\n")
+        text = testbundle.format_results(results, ["test_math", "test_missing"])
+        self.assertIn("FAILED", text.splitlines()[0])
+        self.assertIn("test/test_math/test_main.cpp:14: test_div: Expected 2 Was 3", text)
+        self.assertIn("ABORTED", text)
+        self.assertIn("test_missing", text.splitlines()[-1])
+        self.assertFalse(testbundle.succeeded(results))
+
+        passing = testbundle.parse_output(
+            "TEENSY_TEST_SUITE test_ok\nt.cpp:1:test_a:PASS\n1 Tests 0 Failures 0 Ignored\n"
+            + testbundle.END_MARKER + "\n")
+        self.assertTrue(testbundle.succeeded(passing, ["test_ok"]))
+        self.assertFalse(testbundle.succeeded(passing, ["test_ok", "test_other"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# Copyright 2014-present PlatformIO <contact@platformio.org>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "builder"))
+
+from teensytools import uploadd  # noqa: E402
+
+HEX = ":0400000001020304F2\n:00000001FF\n"
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.hex_path = os.path.join(self.tmp_dir, "firmware.hex")
+        with open(self.hex_path, "w") as fp:
+            fp.write(HEX)
+        self.backend = uploadd.FakeBackend(serials=("1234567",))
+        uploader = uploadd.Uploader(self.backend)
+        uploader.start()
+        self.server = uploadd.UploadServer(("127.0.0.1", 0), uploader)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_upload_progress(self):
+        events = []
+        result = uploadd.request_upload(
+            self.server.server_address, "teensy40", self.hex_path, "1234567",
+            lambda percent, message: events.append((percent, message)))
+        self.assertEqual(result, (True, "upload finished"))
+        self.assertEqual(events, [
+            (0, "rebooting 1234567"), (0, "programming 1234567"), (100, "block 0x000000")])
+        image = self.backend.images["1234567"]
+        # 3 address bytes and 61 bytes of padding before the block
+        self.assertEqual(image[:64], bytes(64))
+        self.assertEqual(image[64:68], b"\x01\x02\x03\x04")
+        self.assertEqual(self.backend.boards["1234567"], "running")
+
+    def test_unknown_board(self):
+        result = uploadd.request_upload(
+            self.server.server_address, "teensy99", self.hex_path)
+        self.assertEqual(result, (False, "unsupported board teensy99"))
+
+    def test_missing_serial(self):
+        result = uploadd.request_upload(
+            self.server.server_address, "teensy40", self.hex_path, "7654321")
+        self.assertEqual(result, (False, "board 7654321 not found"))
+
+
+class FakeHid(object):
+
+    class Device(object):
+
+        def __init__(self, path):
+            self.path = path
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    def __init__(self):
+        self.paths = []
+
+    def enumerate(self, vid, pid):
+        return [dict(path=path, serial_number="") for path in self.paths]
+
+
+class HalfKayTest(unittest.TestCase):
+
+    def test_handles_closed_when_detached(self):
+        hid = FakeHid()
+        backend = uploadd.HalfKayBackend(hid)
+        backend.list_ports = None
+        hid.paths = [b"usb-1"]
+        self.assertEqual([d.state for d in backend.list_devices()], ["bootloader"])
+        handle = backend._open(b"usb-1")
+        self.assertIs(backend._open(b"usb-1"), handle)
+        hid.paths = []
+        self.assertEqual(backend.list_devices(), [])
+        self.assertTrue(handle.closed)
+        self.assertEqual(backend.handles, {})
+
+
+class ClientTest(unittest.TestCase):
+
+    def test_no_daemon(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        address = sock.getsockname()
+        sock.close()
+        self.assertIsNone(uploadd.request_upload(address, "teensy40", "firmware.hex"))
+
+    def test_progress_timeout(self):
+        # accepts the connection but never answers
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(1)
+        self.addCleanup(sock.close)
+        result = uploadd.request_upload(
+            sock.getsockname(), "teensy40", "firmware.hex", progress_timeout=0.5)
+        self.assertEqual(result, (False, "no response from upload daemon for 0.5 s"))
+
+
+if __name__ == "__main__":
+    unittest.main()